@@ -0,0 +1,111 @@
+"""traffic controlの分類方法(iptables, flower, nftables)ごとのパケットあたりのコストを比較するベンチマーク
+
+ローカルにvethのペアを作成し,plan.pyが作成したコマンドで宛先IPアドレスの数を変えながら障害を設定したうえで,
+どの宛先にもマッチしないUDPパケットを送信し,障害を設定しない場合との1パケットあたりの送信時間の差を計測する.
+iptables, nftとtcを操作するためroot権限で実行する必要がある.
+
+    sudo PYTHONPATH=src python benchmarks/classifier_benchmark.py
+"""
+
+import argparse
+import shutil
+import socket
+import subprocess
+import time
+
+import plan
+
+DEVICE = "fitbench0"
+PEER = "fitbench1"
+ADDRESS = "198.18.0.1"
+DESTINATION = "198.18.0.2"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the per-packet cost of the traffic control classifiers."
+    )
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    classifiers = [c for c in ("iptables", "flower", "nftables") if __available(c)]
+    setup()
+    try:
+        baseline = measure(args.packets)
+        print(f"baseline: {baseline:.0f} ns/packet")
+        print(f"{'destinations':>12}" + "".join(f"{c:>12}" for c in classifiers))
+        for size in args.sizes:
+            row = [f"{size:>12}"]
+            for classifier in classifiers:
+                params = params_for(size)
+                run(plan.inject_traffic_control(params, classifier=classifier))
+                try:
+                    cost = measure(args.packets) - baseline
+                finally:
+                    cmd_lst, done_lst = plan.rollback_traffic_control(
+                        params, classifier=classifier
+                    )
+                    run(cmd_lst + done_lst)
+                row.append(f"{cost:>9.0f} ns")
+            print("".join(row))
+    finally:
+        teardown()
+
+
+def params_for(size: int):
+    # none of the destinations match the benchmark traffic, so every
+    # classifier has to evaluate all of its rules for each packet. Each
+    # destination is in its own /24, so that the addresses are not
+    # collapsed into a few CIDRs and every size yields as many rules
+    destinations = [f"10.{i // 256 % 256}.{i % 256}.1" for i in range(size)]
+    return {
+        "device": DEVICE,
+        "tc": [{"latency": 1, "destination_ip_addresses": destinations}],
+    }
+
+
+def measure(packets: int) -> float:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b"x" * 64
+    start = time.perf_counter_ns()
+    for _ in range(packets):
+        sock.sendto(payload, (DESTINATION, 9))
+    elapsed = time.perf_counter_ns() - start
+    sock.close()
+    return elapsed / packets
+
+
+def setup():
+    run(
+        [
+            f"ip link add {DEVICE} type veth peer name {PEER}",
+            f"ip addr add {ADDRESS}/24 dev {DEVICE}",
+            f"ip link set {DEVICE} up",
+            f"ip neigh replace {DESTINATION} lladdr 02:00:00:00:00:02 dev {DEVICE}",
+        ]
+    )
+
+
+def teardown():
+    run([f"ip link del {DEVICE}"], check=False)
+
+
+def run(cmd_lst, check: bool = True):
+    for cmd in cmd_lst:
+        cmd = cmd[len("sudo ") :] if cmd.startswith("sudo ") else cmd
+        subprocess.run(cmd, shell=True, check=check, stdout=subprocess.DEVNULL)
+
+
+def __available(classifier: str) -> bool:
+    if classifier == "iptables" and shutil.which("iptables") is None:
+        print("iptables is not found. The iptables classifier is skipped.")
+        return False
+    if classifier == "nftables" and shutil.which("nft") is None:
+        print("nft is not found. The nftables classifier is skipped.")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,34 @@
 import time
+from dataclasses import asdict
 
-import paramiko
 from beartype import beartype
-from beartype.typing import Dict, List, Union
+from beartype.typing import Dict, List, Optional, Set, Tuple, Union
 
+import agent_client
+import batch
+import channel_reader
 import command
-import tc_schema
-from io_mode import IOMode
-from iptables_action import IptablesAction
-from signal_ import Signal
+import fault_profile
+import local_journal
+import plan
+import ssh_pool
+from command_result import CommandResult
+from exec_mode import ExecMode
+from fan_out import DEFAULT_CONCURRENCY, fan_out, run_all
+from fault_journal import Journal
+from link import Link
+from qdisc_snapshot import QdiscSnapshot
 from target import Target
+from tc_registry import Allocation
 
 
+@fan_out
 @beartype
 def inject_cpu_stress(
     cores: int = 1,
     percent: int = 100,
     length: int = 60,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """ターゲットのcpuに負荷をかける
@@ -27,6 +39,7 @@ def inject_cpu_stress(
         cores (int, optional): 利用するコア数. Defaults to 1.
         percent (int, optional): 各コアのcpu利用率. Defaults to 100.
         length (int, optional): cpu負荷をかける時間(秒). Defaults to 60.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はSSHのセッションで実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
     Raises:
@@ -34,24 +47,20 @@ def inject_cpu_stress(
         ValueError: percentが[0,100]の範囲外で指定された場合
         ValueError: ターゲットのサーバにSSH接続するために必要な情報が設定されていない場合
     """
-    if cores < 1:
-        raise ValueError("The argument 'cores' must be greater than or equal to 1")
-    if percent not in range(0, 101):
-        raise ValueError("The argument 'percent' must be between 0 and 100")
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    cmd = command.cpu_stress(cores=cores, percent=percent, length=length)
-    __inject_command(command=cmd, target=target)
+    cmd_lst = plan.inject_cpu_stress(cores=cores, percent=percent, length=length)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    __run_command(target=target, command=cmd_lst[0], exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def inject_memory_stress(
     mb: int = None,
     gb: int = None,
     percentage: int = 100,
     length: int = 60,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """ターゲットのメモリに負荷をかける
@@ -63,6 +72,7 @@ def inject_memory_stress(
         gb (int, optional): 利用するメモリの値(GB). Defaults to None.
         percentage (int, optional): 利用可能なメモリ総量に対して利用するメモリの割合. Defaults to 100.
         length (int, optional): メモリ不可をかける時間(秒). Defaults to 60.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はSSHのセッションで実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
     Raises:
@@ -71,25 +81,15 @@ def inject_memory_stress(
         ValueError: percentageが不正な値
         ValueError: targetが不正な値
     """
-    if mb is not None:
-        if mb < 1:
-            raise ValueError("The argument 'mb' must be greater than or equal to 1")
-        cmd = command.memory_stress(size=f"{mb}m", length=length)
-    elif gb is not None:
-        if gb < 1:
-            raise ValueError("The argument 'gb' must be greater than or equal to 1")
-        cmd = command.memory_stress(size=f"{gb}g", length=length)
-    elif percentage:
-        if percentage not in range(0, 101):
-            raise ValueError("The argument 'percentage' must be between 0 and 100")
-        cmd = command.memory_stress(size=f"{percentage}%", length=length)
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_command(command=cmd, target=target)
+    cmd_lst = plan.inject_memory_stress(
+        mb=mb, gb=gb, percentage=percentage, length=length
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    __run_command(target=target, command=cmd_lst[0], exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def inject_disk_stress(
     dir: str = "/tmp",
@@ -97,6 +97,7 @@ def inject_disk_stress(
     block_size: int = 64,
     volume_percentage: int = 100,
     length: int = 60,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """ターゲットのディスクに負荷をかける
@@ -109,31 +110,25 @@ def inject_disk_stress(
         block_size (int, optional): 一度に書き込みを行うKB数. Defaults to 64.
         volume_percentage (int, optional): 書き込みで埋めるディスク容量の割合. Defaults to 100.
         length (int, optional): ディスク負荷をかける時間(秒). Defaults to 60.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はSSHのセッションで実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
     Raises:
         ValueError: 引数が不正な場合
     """
-    if workers < 1:
-        raise ValueError("The argument 'workers' must be greater than or equal to 1")
-    if block_size < 1:
-        raise ValueError("The argument 'block_size' must be greater than or equal to 1")
-    if volume_percentage not in range(1, 101):
-        raise ValueError("The argument 'volume_percentage' must be between 1 and 100")
-    cmd = command.disk_stress(
+    cmd_lst = plan.inject_disk_stress(
         dir=dir,
         workers=workers,
         block_size=block_size,
         volume_percentage=volume_percentage,
         length=length,
     )
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_command(command=cmd, target=target)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    __run_command(target=target, command=cmd_lst[0], exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def inject_io_stress(
     dir: str = "/tmp",
@@ -142,6 +137,7 @@ def inject_io_stress(
     block_size: int = 4,
     block_count: int = 1,
     length: int = 60,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """ファイルシステムに対してI/O負荷をかける
@@ -155,29 +151,13 @@ def inject_io_stress(
         block_size (int, optional): 一度にread/writeをおこなうKB数. Defaults to 4.
         block_count (int, optional): ワーカーによってread/writeされるブロック数. Defaults to 1.
         length (int, optional): IO負荷をかける時間(秒). Defaults to 60.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はSSHのセッションで実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
     Raises:
         ValueError: 引数が不正な場合
     """
-    if workers < 1:
-        raise ValueError("The argument 'workers' must be greater than or equal to 1")
-    try:
-        mode = IOMode[mode]
-    except KeyError as key:
-        msg = (
-            f"Invalid input: {key}."
-            f" The argument 'mode' must be chosen between {[s.name for s in IOMode]}."
-        )
-        raise ValueError(msg)
-    if block_size < 1:
-        raise ValueError("The argument 'block_size' must be greater than or equal to 1")
-    if block_count < 1:
-        raise ValueError(
-            "The argument 'block_count' must be greater than or equal to 1"
-        )
-
-    cmd = command.io_stress(
+    cmd_lst = plan.inject_io_stress(
         dir=dir,
         workers=workers,
         mode=mode,
@@ -185,17 +165,17 @@ def inject_io_stress(
         block_count=block_count,
         length=length,
     )
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_command(command=cmd, target=target)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    __run_command(target=target, command=cmd_lst[0], exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def inject_os_shutdown(
     delay: int = 1,
     reboot: bool = True,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """OSシャットダウンをおこなう
@@ -205,25 +185,25 @@ def inject_os_shutdown(
     Args:
         delay (int, optional): シャットダウンを行うまでの遅延時間(分). Defaults to 1.
         reboot (bool, optional): シャットダウン後に再起動をおこなうかを示すフラグ. Defaults to True.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はSSHのセッションで実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
     Raises:
         ValueError: 引数が不正な場合
     """
-    if delay < 0:
-        raise ValueError("The argument 'delay' must be greater than or equal to 0")
-    cmd = command.os_shutdown(delay=delay, reboot=reboot)
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_command(command=cmd, target=target)
+    cmd_lst = plan.inject_os_shutdown(delay=delay, reboot=reboot)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    __run_command(target=target, command=cmd_lst[0], exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def inject_time_travel(
     disable_ntp: bool = False,
     offset: int = 86400,
+    exec_mode: str = "exec",
+    ttl: Optional[int] = None,
     target: Dict[str, str] = None,
 ):
     """時刻変更をおこなう
@@ -233,43 +213,54 @@ def inject_time_travel(
     Args:
         disable_ntp (bool, optional): Trueが設定された場合, NTPが使用する宛先ポート123への通信をすべてブロックする. Default to False.
         offset (int, optional): 現在時刻から何秒時間を変更するかを指定する.値がマイナスの場合は過去にさかのぼる. Defaults to 86400.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        ttl (int, optional): 指定した場合, 設定の前にttl秒後に障害をロールバックするsystemdのタイマーをターゲット上に設定する. コントローラーが異常終了した場合やSSHの接続が切れた場合でも,障害はttl秒後に解除される. ロールバックするとタイマーも解除する. ターゲットにsystemdが必要. Defaults to None.
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
     """
-    cmd_lst = [command.time_travel(offset=offset)]
-    if disable_ntp:
-        cmd_lst.insert(0, "sudo iptables -A OUTPUT -p udp --dport 123 -j DROP")
+    cmd_lst = plan.inject_time_travel(disable_ntp=disable_ntp, offset=offset, ttl=ttl)
     print(cmd_lst)
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_commands(command_lst=cmd_lst, target=target)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    local_journal.record(
+        target, "time_travel", plan.time_travel_fault(disable_ntp), cmd_lst
+    )
+    return __inject_commands(command_lst=cmd_lst, target=target, exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
-def rollback_time_travel(enable_ntp: bool = False, target: Dict[str, str] = None):
+def rollback_time_travel(
+    enable_ntp: bool = False,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
     """時刻変更をもとに戻す
 
     Args:
         enable_ntp (bool, optional): Trueが設定された場合, NTPが使用する宛先ポート123への通信をブロックする設定を解除する. Default to False.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
     """
-    cmd_lst = ["sudo chronyc -a makestep"]
-    if enable_ntp:
-        cmd_lst.insert(0, "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP")
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    __inject_commands(command_lst=cmd_lst, target=target)
+    cmd_lst, done_lst = plan.rollback_time_travel(enable_ntp=enable_ntp)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault_id, _ = plan.time_travel_fault(enable_ntp)
+    return __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
 
 
+@fan_out
 @beartype
 def inject_process_kill(
     pid_lst: List[int],
@@ -277,11 +268,15 @@ def inject_process_kill(
     interval: Union[int, float] = 0,
     kill_children: bool = False,
     length: Union[int, float] = -1,
+    remote_loop: bool = False,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """指定されたPIDのプロセスを終了させる
 
-    引数からプロセスを終了させるコマンドを作成し,ターゲットのサーバ上で実行する
+    引数からプロセスを終了させるコマンドを作成し,ターゲットのサーバ上で実行する.
+    remote_loopがTrueの場合は繰り返しのループ自体をターゲット上で実行するため,
+    プロセスキルの頻度がSSHの往復時間に制限されない.
 
     Args:
         pid_lst (List[int]): 終了させたいプロセスのPIDのリスト.
@@ -289,36 +284,44 @@ def inject_process_kill(
         interval (Union[int, float], optional): プロセスキルを実行する前の遅延時間(秒). Defaults to 0.
         kill_children (bool, optional): プロセスの子プロセスも終了させるかどうかの設定. Defaults to False.
         length (Union[int, float], optional): 障害シミュレーションの長さ(秒). 値を指定しない場合はプロセスキルは1度だけ実行される. Defaults to -1.
+        remote_loop (bool, optional): Trueの場合はターゲット上の1つのセッションでプロセスキルをlength秒間繰り返す. Defaults to False.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. "agent"ではプロセスキルごとにSSHのセッションとsudoを起動せずに済む. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[int]: remote_loopがTrueの場合,シグナルを送ったプロセスの延べ数(子プロセスを除く).
+
     Raises:
         ValueError: 引数のpid_lstが空の場合
         ValueError: 引数のtarget内にSSH接続に必要な情報が設定されていなかった場合
         ValueError: 引数のsignalがsrc.signal_.Signalで定義されていないものの場合
     """
-    if not pid_lst:
-        raise ValueError("The argument 'pid_lst' must not be empty.")
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    try:
-        signal = Signal(signal)
-    except ValueError as error:
-        raise ValueError(
-            f"{error}. The argument 'signal' must be chosen between {[s.value for s in Signal]}."
+    exec_mode = plan.to_exec_mode(exec_mode)
+    cmd_lst = plan.inject_process_kill(
+        pid_lst=pid_lst,
+        signal=signal,
+        kill_children=kill_children,
+        sudo=not remote_loop and exec_mode != ExecMode.agent,
+        count=remote_loop,
+    )
+    target = plan.to_target(target)
+    if remote_loop:
+        return __inject_kill_loop(
+            target=target,
+            command_lst=cmd_lst,
+            interval=interval,
+            length=length,
+            exec_mode=exec_mode,
         )
-    cmd_lst = [command.kill(signal=signal, pid_lst=pid_lst)]
-    if kill_children:
-        cmd_lst.insert(0, command.kill_children_by_pid(signal=signal, pid_lst=pid_lst))
     start_time = time.time()
     while True:
         time.sleep(interval)
-        __inject_commands(target=target, command_lst=cmd_lst)
+        __inject_commands(target=target, command_lst=cmd_lst, exec_mode=exec_mode)
         if time.time() - start_time > length:
             break
 
 
+@fan_out
 @beartype
 def inject_process_pkill(
     process_name_lst: List[str],
@@ -332,11 +335,15 @@ def inject_process_pkill(
     kill_children: bool = False,
     full_match: bool = False,
     length: Union[int, float] = -1,
+    remote_loop: bool = False,
+    exec_mode: str = "exec",
     target: Dict[str, str] = None,
 ):
     """指定されたプロセス名のプロセスを終了させる
 
-    引数からプロセスを終了させるコマンドを作成し,ターゲットのサーバ上で実行する
+    引数からプロセスを終了させるコマンドを作成し,ターゲットのサーバ上で実行する.
+    remote_loopがTrueの場合は繰り返しのループ自体をターゲット上で実行するため,
+    プロセスキルの頻度がSSHの往復時間に制限されない.
 
     Args:
         process_name_lst (List[str]): 終了させたいプロセス名のリスト. exactオプションを利用しない場合は部分一致のプロセス名も終了の対象になる.
@@ -350,8 +357,13 @@ def inject_process_pkill(
         kill_children (bool, optional): プロセスの子プロセスも終了させるかどうかの設定. Defaults to False.
         full_match (bool, optional): Trueの場合はプロセス名だけでなくコマンドライン全体に対してマッチさせる. Defaults to False.
         length (Union[int, float], optional): 障害シミュレーションの長さ(秒). 値を指定しない場合はプロセスキルは1度だけ実行される. Defaults to -1.
+        remote_loop (bool, optional): Trueの場合はターゲット上の1つのセッションでプロセスキルをlength秒間繰り返す. Defaults to False.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. "agent"ではプロセスキルごとにSSHのセッションとsudoを起動せずに済む. Defaults to "exec".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[int]: remote_loopがTrueの場合,シグナルを送ったプロセスの延べ数(子プロセスを除く).
+
     Raises:
         ValueError: 引数のprocess_name_lstが空の場合
         ValueError: newestとoldestが同時にTrueだった場合
@@ -359,23 +371,10 @@ def inject_process_pkill(
         ValueError: 引数のsignalがsrc.signal_.Signalで定義されていないものの場合
 
     """
-    if not process_name_lst:
-        raise ValueError("The argument 'process_name_lst' must not be empty.")
-    if newest and oldest:
-        raise ValueError("'newest' flag cannot be used with 'oldest' flag.")
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    try:
-        signal = Signal(signal)
-    except ValueError as error:
-        raise ValueError(
-            f"{error}. The argument 'signal' must be chosen between {[s.value for s in Signal]}."
-        )
-    cmd_lst = command.pkill(
-        signal=signal,
+    exec_mode = plan.to_exec_mode(exec_mode)
+    cmd_lst = plan.inject_process_pkill(
         process_name_lst=process_name_lst,
+        signal=signal,
         group=group,
         user=user,
         newest=newest,
@@ -383,19 +382,52 @@ def inject_process_pkill(
         exact=exact,
         full_match=full_match,
         kill_children=kill_children,
+        sudo=not remote_loop and exec_mode != ExecMode.agent,
+        count=remote_loop,
     )
+    target = plan.to_target(target)
+    if remote_loop:
+        return __inject_kill_loop(
+            target=target,
+            command_lst=cmd_lst,
+            interval=interval,
+            length=length,
+            exec_mode=exec_mode,
+        )
     start_time = time.time()
     while True:
         time.sleep(interval)
-        __inject_commands(target=target, command_lst=cmd_lst)
+        __inject_commands(target=target, command_lst=cmd_lst, exec_mode=exec_mode)
         if time.time() - start_time > length:
             break
 
 
+@fan_out
 @beartype
-def inject_traffic_control(params: Dict, target: Dict[str, str] = None):
+def inject_traffic_control(
+    params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
     """ネットワークの遅延やパケットロスをシミュレーションする
 
+    設定の前にターゲット上でデバイスのリンク速度と送信キュー数を取得し,HTBのクラスのrateにリンク速度を指定する.
+    障害ごとにターゲット上のレジストリでスロットを割り当て,クラスIDやnetemのハンドルをスロットごとに分けるため,
+    同じデバイスに複数の障害を重ねて設定し,それぞれ独立にロールバックできる. 2つ目以降の障害は最初の障害が設定したHTBを共有する.
+    既存のqdiscとクラスの構成はターゲット上に保存してから削除し,rollback_traffic_controlで元の構成に戻す.
+    リンク速度を取得できない場合(仮想デバイスなど)は100gbitを指定する.
+    tcの要素が1つで,宛先IPアドレス,ポート,プロトコルのいずれも絞り込まない場合は,
+    iptablesによる分類をおこなわずにnetemをルートのqdiscとして設定する.
+    tcの要素にprofileを指定した場合は,設定の後にターゲット上でlength秒間netemの値をtc qdisc changeで変化させ,終了まで待機する.
+    値の変化はターゲット上のシェルが実行するため,SSHの往復なしに1秒未満の間隔で値を変更できる.
+    送信キューが複数ある場合は,ルートにmqを設定して送信キューごとにnetem(classifierが"flower"の場合はHTB)を設定し,
+    すべての送信キューが1つのqdiscのロックを共有しないようにする.
+    ttlのタイマーによるロールバックでは保存したqdiscの構成は復元せず,カーネルのデフォルトのqdiscに戻す.
+
     Args:
         params (Dict): ネットワーク遅延やパケットロスの設定をおこなうためのパラメータ群. 以下のdeviceとtcをキーとして設定できる. 詳細はtc_schema.pyを参照.
          - device (str, optional): 対象のネットワークデバイス名. Defaults to eth0.
@@ -407,134 +439,295 @@ def inject_traffic_control(params: Dict, target: Dict[str, str] = None):
            - loss (float, optional): パケットをロスさせる割合. 単位は%. 値の設定がない場合はパケットロスは設定されない. Defaults to None.
            - corrupt (bool, optional): Trueの場合パケットロスの代わりに指定した割合のパケット破損を発生させる. Defaults to False.
            - protocol (List[str], optional): 指定したプロトコル(tcp, udp, icmp)の通信に対してのみ影響を与える. 何も指定がない場合はすべてのプロトコル(tcp, udp, icmp)に対して影響を与える. Defaults to ["tcp", "udp", "icmp"].
-
+           - rate (str, optional): 帯域幅の保証値(例: "10mbit"). 値の設定がない場合は帯域を制限しない. Defaults to None.
+           - ceil (str, optional): 帯域幅の上限. rate以上の値を指定する. rateの指定が必要. Defaults to None.
+           - burst (str, optional): rateを超えて一度に送信できるバイト数(例: "15kb"). rateの指定が必要. Defaults to None.
+           - limit (int, optional): netemのキューに保持できるパケット数. 値の設定がない場合は遅延中のパケットを保持できるよう,遅延と帯域幅(rateまたはリンク速度)の積を平均パケットサイズで割った値を指定する. Defaults to None.
+           - jitter (int, optional): 遅延のゆらぎ. 単位はms. latencyの指定が必要. Defaults to None.
+           - distribution (str, optional): ゆらぎの分布(normal, pareto, paretonormal). jitterの指定が必要. 値の設定がない場合は一様分布になる. Defaults to None.
+           - correlation (float, optional): 直前のパケットの遅延との相関. 単位は%. jitterの指定が必要. Defaults to None.
+           - reorder (float, optional): 遅延させずに先に送信するパケットの割合. 単位は%. latencyの指定が必要. Defaults to None.
+           - duplicate (float, optional): パケットを複製する割合. 単位は%. Defaults to None.
+           - slot (Dict, optional): パケットをまとめて送信するスロットの設定(min_delay, max_delay, packets, bytes). 詳細はtc_schema.pyを参照. Defaults to None.
+           - profile (Dict, optional): latencyまたはlossを時間とともに変化させるプロファイル(field, shape, start, end, length, interval, steps, period, step_size, seed). 詳細はtc_schema.pyを参照. Defaults to None.
+
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        atomic (bool, optional): Trueの場合はtcのコマンドを1つの`tc -batch`に,iptablesのルールを1つの`iptables-restore --noflush`にまとめて標準入力から適用する. ルール数によらずほぼ一定の時間で適用でき,iptablesのルールはアトミックに適用される. Defaults to False.
+        ipset (bool, optional): Trueの場合は宛先IPアドレス,宛先ポート,送信元ポートをipsetにまとめ,1つのクラスに対してプロトコルごとに1つのルールでマッチさせる. 宛先の数によらずパケットごとのマッチングが一定の時間で済む. Defaults to False.
+        classifier (str, optional): パケットをクラスに分類する方法. "iptables"の場合はiptablesのCLASSIFYルールで, "flower"の場合はHTBのルートに設定したtcのflowerフィルタで, "nftables"の場合は専用のnftablesのテーブルに`nft -f`で1つのトランザクションとして設定したルールで分類する. "flower"ではnetfilterを経由せず, "flower"と"nftables"はipsetとは併用できない. Defaults to "iptables".
+        ttl (int, optional): 指定した場合, 設定の前にttl秒後に障害をロールバックするsystemdのタイマーをターゲット上に設定する. コントローラーが異常終了した場合やSSHの接続が切れた場合でも,障害はttl秒後に解除される. ロールバックするとタイマーも解除する. ターゲットにsystemdが必要. Defaults to None.
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[List[Dict]]: tcの要素にprofileを指定した場合, 値を適用した経過時間(time, 秒),tcの要素の番号(tc),パラメータ(field),値(value)とtcの終了ステータス(exit_status)のタイムライン. それ以外でexec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
+        ValueError: デバイスに設定されているほかの障害とqdiscの構成を共有できない場合(どちらかがルートにnetemを設定する場合など)
     """
-    v = tc_schema.validator
-    if not v.validate(params):
-        raise ValueError(f"Validate arguments is failed: {v.errors}")
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    key = Allocation.key(normalized)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = __run_command(
+        target=target, command=Link.probe(device), exec_mode=exec_mode
+    )
+    link = Link.parse(result.stdout)
+    tree = plan.traffic_control_tree(params=params, classifier=classifier, link=link)
+    result = __run_command(
+        target=target,
+        command=Allocation.allocate(device, key, tree),
+        exec_mode=exec_mode,
+    )
+    allocation = Allocation.parse(result.stdout, key)
     try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    params = v.normalized(params)
-    device = params["device"]
-    tc_lst = params["tc"]
-
-    # add the root qdisc and the default class
-    cmd_lst = [
-        f"sudo tc qdisc add dev {device} handle 10: root htb default 1",
-        f"sudo tc class add dev {device} parent 10: classid 10:1 htb rate 1000000kbit",
-    ]
-
-    # add network emulator rules
-    for i, tc in enumerate(tc_lst):
-        id = f"10:{10 + i}"
-        cmd_lst.append(
-            f"sudo tc class add dev {device} parent 10: classid {id} htb rate 1000000kbit"
+        cmd_lst = plan.inject_traffic_control(
+            params=params,
+            atomic=atomic,
+            ipset=ipset,
+            classifier=classifier,
+            link=link,
+            allocation=allocation,
+            ttl=ttl,
         )
-
-        netem_cmd = (
-            f"sudo tc qdisc add dev {device} parent {id} handle {100 + i}: netem"
+    except ValueError:
+        __run_command(
+            target=target, command=Allocation.release(device, key), exec_mode=exec_mode
         )
-        latency = tc["latency"]
-        if latency and latency > 0:
-            netem_cmd += f" delay {latency}ms"
-        loss = tc["loss"]
-        corrupt_flag = tc["corrupt"]
-        if loss and loss > 0:
-            netem_cmd += f" {'corrupt' if corrupt_flag else 'loss'} {loss}%"
-        cmd_lst.append(netem_cmd)
-
-        rules = __generate_traffic_control_rules(
-            IptablesAction.Append,
-            tc,
-            id,
+        raise
+    fault = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    local_journal.record(target, "traffic_control", fault, cmd_lst)
+    results = __inject_commands(target=target, command_lst=cmd_lst, exec_mode=exec_mode)
+    profile_cmd = plan.traffic_control_profile(
+        params=params, classifier=classifier, link=link, allocation=allocation
+    )
+    if profile_cmd is None:
+        return results
+    result = __run_command(target=target, command=profile_cmd, exec_mode=exec_mode)
+    return fault_profile.parse(result.stdout)
+
+
+@fan_out
+@beartype
+def update_traffic_control(
+    params: Dict,
+    new_params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """inject_traffic_controlで設定したネットワークの遅延やパケットロスの設定を,削除せずに変更する
+
+    paramsから作成した設定とnew_paramsから作成した設定の差分だけを, `tc qdisc change`, `tc class change`と
+    iptablesのルール(classifierが"flower"の場合はtcのフィルタ)の追加と削除で適用する. classifierが"nftables"の場合は分類のテーブルを1つのトランザクションで置き換える.
+    設定を削除してから再度設定する場合と異なり,変更の途中で障害が外れることや,キューに溜まったパケットが破棄されることがない.
+    deviceとtcの要素数は変更できず,qdiscの構成が変わる変更(ルートのnetemとHTBの切り替えなど)もできない.
+    inject_traffic_controlでttlを指定した場合,パラメータを変更するとタイマーは解除される.
+
+    Args:
+        params (Dict): 現在設定されているinject_traffic_controlのパラメータ群.詳細はtc_schema.pyを参照.
+        new_params (Dict): 変更後のパラメータ群. 詳細はtc_schema.pyを参照.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        atomic (bool, optional): inject_traffic_controlに指定した値. Defaults to False.
+        ipset (bool, optional): inject_traffic_controlに指定した値. Defaults to False.
+        classifier (str, optional): inject_traffic_controlに指定した値. Defaults to "iptables".
+        target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
+
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
+    Raises:
+        ValueError: 引数が不正な場合
+        ValueError: new_paramsがparamsとdeviceやtcの要素数,qdiscの構成が異なる場合
+    """
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    plan.normalize_traffic_control_params(new_params)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = __run_command(
+        target=target, command=Link.probe(device), exec_mode=exec_mode
+    )
+    link = Link.parse(result.stdout)
+    result = __run_command(
+        target=target, command=Allocation.probe(device), exec_mode=exec_mode
+    )
+    cmd_lst = plan.update_traffic_control(
+        params=params,
+        new_params=new_params,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        link=link,
+        allocation=Allocation.parse(result.stdout, Allocation.key(normalized)),
+    )
+    # the fault is recorded again when the new parameters change its ID
+    fault_id, _ = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    new_fault = plan.traffic_control_fault(new_params, atomic, ipset, classifier)
+    renamed = new_fault[0] != fault_id
+    if not renamed:
+        return __inject_commands(
+            target=target, command_lst=cmd_lst, exec_mode=exec_mode
         )
-        cmd_lst.extend(rules)
-    __inject_commands(target=target, command_lst=cmd_lst)
+    local_journal.record(target, "traffic_control", new_fault, cmd_lst)
+    return __rollback_commands(target, [(fault_id, cmd_lst, [])], exec_mode)
 
 
+@fan_out
 @beartype
-def rollback_traffic_control(params: Dict, target: Dict[str, str] = None):
+def rollback_traffic_control(
+    params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
     """ネットワークの遅延やパケットロスをシミュレーションするための設定を削除する
 
+    inject_traffic_controlがターゲット上に保存したqdiscとクラスの構成を読み出し,設定を削除した後に元の構成を設定し直す.
+    カーネルが作成したデフォルトのqdiscは設定を削除するとカーネルが作成し直すため,保存した構成に含めない.
+    同じデバイスにほかの障害が残っている場合は,この障害のクラスとルール(またはフィルタ)だけを削除し,共有しているHTBと保存した構成は残す.
+
     Args:
         params (Dict): ネットワーク遅延やパケットロスの設定をおこなうためのパラメータ群.詳細はtc_schema.pyを参照.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        atomic (bool, optional): Trueの場合はtcのコマンドを1つの`tc -batch`に,iptablesのルールを1つの`iptables-restore --noflush`にまとめて標準入力から適用する. ルール数によらずほぼ一定の時間で適用でき,iptablesのルールはアトミックに適用される. Defaults to False.
+        ipset (bool, optional): Trueの場合は宛先IPアドレス,宛先ポート,送信元ポートをipsetにまとめ,1つのクラスに対してプロトコルごとに1つのルールでマッチさせる. 宛先の数によらずパケットごとのマッチングが一定の時間で済む. Defaults to False.
+        classifier (str, optional): パケットをクラスに分類する方法. "iptables"の場合はiptablesのCLASSIFYルールで, "flower"の場合はHTBのルートに設定したtcのflowerフィルタで, "nftables"の場合は専用のnftablesのテーブルに`nft -f`で1つのトランザクションとして設定したルールで分類する. "flower"ではnetfilterを経由せず, "flower"と"nftables"はipsetとは併用できない. Defaults to "iptables".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
     """
-    v = tc_schema.validator
-    if not v.validate(params):
-        raise ValueError(f"Validate arguments is failed: {v.errors}")
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    params = v.normalized(params)
-    device = params["device"]
-    tc_lst = params["tc"]
-    cmd_lst = []
-    for i, tc in enumerate(tc_lst):
-        id = f"10:{10 + i}"
-        rules = __generate_traffic_control_rules(
-            IptablesAction.Delete,
-            tc,
-            id,
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    key = Allocation.key(normalized)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = __run_command(
+        target=target, command=Allocation.probe(device), exec_mode=exec_mode
+    )
+    allocation = Allocation.parse(result.stdout, key)
+    snapshot = QdiscSnapshot()
+    if not allocation.others:
+        result = __run_command(
+            target=target, command=QdiscSnapshot.probe(device), exec_mode=exec_mode
         )
-        cmd_lst.extend(rules)
-    cmd_lst.append(f"sudo tc qdisc del dev {device} handle 10: root")
-    __inject_commands(target=target, command_lst=cmd_lst)
-
-
-def __generate_traffic_control_rules(
-    action: IptablesAction,
-    tc: Dict[str],
-    id: int,
-) -> List[str]:
-    destination_ip_addresses = tc["destination_ip_addresses"]
-    destination_ports = tc["destination_ports"]
-    source_ports = tc["source_ports"]
-    tcp = "tcp" in tc["protocol"]
-    udp = "udp" in tc["protocol"]
-    icmp = "icmp" in tc["protocol"]
-    dport = (
-        f" --match multiport --dports {','.join(destination_ports)}"
-        if destination_ports
-        else ""
+        snapshot = QdiscSnapshot.parse(result.stdout)
+    cmd_lst, done_lst = plan.rollback_traffic_control(
+        params=params,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        snapshot=snapshot,
+        allocation=allocation,
+    )
+    fault_id, _ = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    return __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
+
+
+@fan_out
+@beartype
+def inject_latency_matrix(
+    matrix: Dict[str, Dict[str, Union[int, Dict]]],
+    regions: Dict[str, str],
+    device: str = "eth0",
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
+    """リージョン間の遅延の行列に従って,ホストの間の通信に遅延を設定する
+
+    ターゲットのリージョンから各リージョンへの設定を宛先のホストごとに展開し,同じ設定の宛先を1つのtcの要素にまとめてinject_traffic_controlで設定する.
+    targetにすべてのホストのリストを渡すと,ホストごとのパラメータ群を作成してすべてのホストに並列に設定する.
+    遅延は送信側のホストで設定するため,ホストAとBの往復の遅延はAからBとBからAの遅延の和になる.
+
+    Args:
+        matrix (Dict[str, Dict[str, Union[int, Dict]]]): 送信元のリージョンごとの,宛先のリージョンへの片方向の遅延(ms). 遅延の代わりにtcの要素の設定(latency, jitter, lossなど)を指定できる. 片方の向きだけが指定された場合は逆向きにも同じ値を使う. 同じリージョン内の遅延は,同じリージョンを宛先に指定した場合だけ設定する.
+        regions (Dict[str, str]): ホスト名ごとのリージョン. ホスト名はtargetのhostnameと照合し,宛先のIPアドレスとしても使う(classifierが"flower"の場合はIPアドレスを指定すること).
+        device (str, optional): 対象のネットワークデバイス名. Defaults to "eth0".
+        exec_mode, atomic, ipset, classifier, ttl: inject_traffic_controlと同様.
+        target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
+
+    Returns:
+        Optional[List[Dict]]: inject_traffic_controlの戻り値. 遅延を設定する宛先がない場合はNone.
+
+    Raises:
+        ValueError: 引数が不正な場合
+        ValueError: targetのホスト名がregionsにない場合
+    """
+    params = plan.latency_matrix_params(
+        matrix, regions, plan.to_target(target).hostname, device
     )
-    sport = (
-        f" --match multiport --sports {','.join(source_ports)}" if source_ports else ""
+    if params is None:
+        return None
+    return inject_traffic_control(
+        params=params,
+        exec_mode=exec_mode,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        ttl=ttl,
+        target=target,
     )
-    rules = []
-    protocol_lst = []
-    if tcp:
-        protocol_lst.append("tcp")
-    if udp:
-        protocol_lst.append("udp")
-    if icmp:
-        protocol_lst.append("icmp")
-    cmd_template = f"sudo iptables -{action.value} POSTROUTING -t mangle -j CLASSIFY --set-class {id} -p {{proto}}"
-    for proto in protocol_lst:
-        if proto == "icmp":
-            rules.append(cmd_template.format(proto=proto))
-            continue
-        rules.append(cmd_template.format(proto=proto) + dport + sport)
-
-    if destination_ip_addresses:
-        ip_rules = []
-        for ip_addr in destination_ip_addresses:
-            dest = f" -d {ip_addr}"
-            ip_rules.extend(map(lambda rule: rule + dest, rules))
-        rules = ip_rules
-    return rules
 
 
+@fan_out
+@beartype
+def rollback_latency_matrix(
+    matrix: Dict[str, Dict[str, Union[int, Dict]]],
+    regions: Dict[str, str],
+    device: str = "eth0",
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """inject_latency_matrixで設定した遅延を削除する
+
+    inject_latency_matrixに渡した引数と同じものを渡すことで,同じパラメータ群を作成してrollback_traffic_controlで削除する.
+
+    Args:
+        matrix, regions, device, exec_mode, atomic, ipset, classifier: inject_latency_matrixと同様.
+        target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
+
+    Returns:
+        Optional[List[Dict]]: rollback_traffic_controlの戻り値. 遅延を設定する宛先がない場合はNone.
+
+    Raises:
+        ValueError: 引数が不正な場合
+        ValueError: targetのホスト名がregionsにない場合
+    """
+    params = plan.latency_matrix_params(
+        matrix, regions, plan.to_target(target).hostname, device
+    )
+    if params is None:
+        return None
+    return rollback_traffic_control(
+        params=params,
+        exec_mode=exec_mode,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        target=target,
+    )
+
+
+@fan_out
 @beartype
 def inject_traffic_block(
     destination_ip_addresses: List[str] = None,
@@ -544,6 +737,11 @@ def inject_traffic_block(
     tcp: bool = True,
     udp: bool = True,
     icmp: bool = True,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+    ttl: Optional[int] = None,
     target: Dict[str, str] = None,
 ):
     """引数で指定した送信トラフィックをすべてドロップさせる
@@ -556,28 +754,51 @@ def inject_traffic_block(
         tcp (bool, optional): tcpプロトコルの通信を対象にするかの判定. Defaults to True.
         udp (bool, optional): udpプロトコルの通信を対象にするかの判定. Defaults to True.
         icmp (bool, optional): icmpプロトコルの通信を対象にするかの判定. Defaults to True.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        atomic (bool, optional): Trueの場合はすべてのルールを1つの`iptables-restore --noflush`にまとめて標準入力からアトミックに適用する. ルール数によらずほぼ一定の時間で適用できる. Defaults to False.
+        ipset (bool, optional): Trueの場合は宛先IPアドレス,宛先ポート,送信元ポートをipsetにまとめ,プロトコルごとに1つのルールでマッチさせる. 宛先の数によらずパケットごとのマッチングが一定の時間で済む. Defaults to False.
+        firewall (str, optional): ルールを設定する方法. "iptables"の場合はiptablesのルールを1つずつ, "nftables"の場合は専用のnftablesのテーブルに宛先IPアドレスとポートのセットとルールを`nft -f`で1つのトランザクションとして設定する. "nftables"ではatomicに関わらずアトミックに適用され,ipsetとは併用できない. Defaults to "iptables".
+        ttl (int, optional): 指定した場合, 設定の前にttl秒後に障害をロールバックするsystemdのタイマーをターゲット上に設定する. コントローラーが異常終了した場合やSSHの接続が切れた場合でも,障害はttl秒後に解除される. ロールバックするとタイマーも解除する. ターゲットにsystemdが必要. Defaults to None.
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
 
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
     """
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    rules = __generate_traffic_block_rules(
-        IptablesAction.Append,
-        destination_ip_addresses,
-        device,
-        destination_ports,
-        source_ports,
-        tcp,
-        udp,
-        icmp,
+    cmd_lst = plan.inject_traffic_block(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+        ttl=ttl,
     )
-    __inject_commands(target=target, command_lst=rules)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault = plan.traffic_block_fault(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+    )
+    local_journal.record(target, "traffic_block", fault, cmd_lst)
+    return __inject_commands(target=target, command_lst=cmd_lst, exec_mode=exec_mode)
 
 
+@fan_out
 @beartype
 def rollback_traffic_block(
     destination_ip_addresses: List[str] = None,
@@ -587,6 +808,10 @@ def rollback_traffic_block(
     tcp: bool = True,
     udp: bool = True,
     icmp: bool = True,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
     target: Dict[str, str] = None,
 ):
     """送信トラフィックをブロックする設定を取り除く
@@ -599,101 +824,247 @@ def rollback_traffic_block(
         tcp (bool, optional): tcpプロトコルを対象とする場合はTrue. Defaults to True.
         udp (bool, optional): udpプロトコルを対象とする場合はTrue. Defaults to True.
         icmp (bool, optional): icmpプロトコルを対象とする場合はTrue. Defaults to True.
+        exec_mode (str, optional): コマンドの実行方法. "exec"の場合はコマンドを1つずつ実行し, "batch"の場合はすべてのコマンドを1つのスクリプトとして1回の往復で実行し, "agent"の場合はターゲット上に常駐させたエージェント(fault_agent.py)経由で実行する. Defaults to "exec".
+        atomic (bool, optional): Trueの場合はすべてのルールを1つの`iptables-restore --noflush`にまとめて標準入力からアトミックに適用する. ルール数によらずほぼ一定の時間で適用できる. Defaults to False.
+        ipset (bool, optional): Trueの場合は宛先IPアドレス,宛先ポート,送信元ポートをipsetにまとめ,プロトコルごとに1つのルールでマッチさせる. 宛先の数によらずパケットごとのマッチングが一定の時間で済む. Defaults to False.
+        firewall (str, optional): inject_traffic_blockに指定した値. "nftables"の場合はテーブルを削除する. Defaults to "iptables".
         target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト.
+
     Raises:
         ValueError: 引数が不正な場合
     """
-    try:
-        target = Target.from_(target)
-    except KeyError as key:
-        raise ValueError(f"{key} is not found in target.")
-    rules = __generate_traffic_block_rules(
-        IptablesAction.Delete,
-        destination_ip_addresses,
-        device,
-        destination_ports,
-        source_ports,
-        tcp,
-        udp,
-        icmp,
-    )
-    __inject_commands(target=target, command_lst=rules)
-
-
-def __generate_traffic_block_rules(
-    action: IptablesAction,
-    destination_ip_addresses: List[str],
-    device: str,
-    destination_ports: List[str],
-    source_ports: List[str],
-    tcp: bool,
-    udp: bool,
-    icmp: bool,
-) -> List[str]:
-    rules = []
-    dport = (
-        f" --match multiport --dports {','.join(destination_ports)}"
-        if destination_ports
-        else ""
+    cmd_lst, done_lst = plan.rollback_traffic_block(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
     )
-    sport = (
-        f" --match multiport --sports {','.join(source_ports)}" if source_ports else ""
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault_id, _ = plan.traffic_block_fault(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
     )
-    base_cmd = f"sudo iptables -{action.value} OUTPUT -o {device} -p {{proto}}"
-    protocols = []
-    if tcp:
-        protocols.append("tcp")
-    if udp:
-        protocols.append("udp")
-    if icmp:
-        protocols.append("icmp")
-    for proto in protocols:
-        if proto == "icmp":
-            rules.append(base_cmd.format(proto=proto))
-            continue
-        rules.append(base_cmd.format(proto=proto) + dport + sport)
-
-    if destination_ip_addresses:
-        ip_rules = []
-        for ip_addr in destination_ip_addresses:
-            ip_rules.extend(map(lambda rule: rule + f" -d {ip_addr}", rules))
-        rules = ip_rules
-
-    rules = map(lambda cmd: cmd + " -j DROP", rules)
-    return rules
-
-
-def __inject_command(target: Target, command: str):
-    with paramiko.SSHClient() as ssh:
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            hostname=target.hostname,
-            username=target.username,
-            key_filename=target.key_filename,
-        )
+    return __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
+
+
+@fan_out
+@beartype
+def rollback_journal(
+    fault_id: str = None,
+    exec_mode: str = "batch",
+    target: Dict[str, str] = None,
+):
+    """ターゲット上のジャーナルに記録された障害をロールバックする
+
+    inject_traffic_control,inject_traffic_blockとinject_time_travelは設定の前に,ロールバックに必要な引数をターゲット上のジャーナルに記録する.
+    1回の往復でジャーナル,tcのレジストリとスナップショットを読み出し,記録の新しい順に各障害をロールバックするコマンドをまとめて実行する.
+    呼び出し側が引数を覚えていない場合や,設定の途中で失敗した場合でもロールバックできる.
+    ロールバックした障害の記録は削除するため,何度実行しても同じ結果になる.
+
+    Args:
+        fault_id (str, optional): ロールバックする障害のID. 指定しない場合はジャーナルに記録されたすべての障害をロールバックする. Defaults to None.
+        exec_mode (str, optional): コマンドの実行方法. 指定できる値はinject_traffic_controlと同様. Defaults to "batch".
+        target (Dict[str, str], optional): SSHに必要なホスト名,ユーザ名と鍵のパス.
+
+    Returns:
+        Optional[List[Dict]]: exec_modeが"batch"または"agent"の場合, コマンドごとの実行結果(command, exit_status, stdout, stderr, duration)のリスト. ロールバックする障害がない場合は空のリスト.
+
+    Raises:
+        ValueError: 引数が不正な場合
+    """
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = __run_command(target=target, command=Journal.probe(), exec_mode=exec_mode)
+    journal = Journal.parse(result.stdout)
+    fault_id_set = {
+        entry.fault_id
+        for entry in journal.entries
+        if fault_id is None or entry.fault_id == fault_id
+    }
+    return __rollback_journal(target, journal, fault_id_set, exec_mode)
 
-        _, stdout, stderr = ssh.exec_command(command)
 
-        for out in stdout:
-            print("[out]", out, end="")
-        for err in stderr:
-            print("[err]", err, end="")
+@beartype
+def rollback_all(exec_mode: str = "batch", concurrency: int = DEFAULT_CONCURRENCY):
+    """コントローラー上のジャーナルに記録された,ロールバックされていないすべての障害をロールバックする
+
+    inject_traffic_control,inject_traffic_blockとinject_time_travelは,コマンドを実行する前にターゲット,障害のIDと引数,
+    コマンドをコントローラー上の追記専用のジャーナル(local_journal)に記録し,ロールバック関数はロールバックを記録する.
+    コントローラーが異常終了した後でも,実験のパラメータを再現せずにすべてのターゲットの障害を並列にロールバックできる.
+    ターゲットごとにrollback_journalと同様に1回の往復でターゲット上のジャーナルを読み出し,残っている障害を1つのスクリプトでロールバックする.
+    ターゲット上のジャーナルに記録が残っていない障害は,すでにロールバックされた(またはコマンドを実行する前に中断した)ものとみなす.
 
-        del stdout, stderr
+    Args:
+        exec_mode (str, optional): コマンドの実行方法. 指定できる値はinject_traffic_controlと同様. Defaults to "batch".
+        concurrency (int, optional): 同時にロールバックするターゲット数の上限. Defaults to DEFAULT_CONCURRENCY.
 
+    Returns:
+        Dict[str, Dict]: ホスト名をキーとしたターゲットごとの結果. 値はfan_outでデコレートしたアクションと同様で,
+        成功した場合のresultはrollback_journalの戻り値. ロールバックする障害がない場合は空の辞書.
 
-def __inject_commands(target: Target, command_lst: List[str]):
-    with paramiko.SSHClient() as ssh:
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            hostname=target.hostname,
-            username=target.username,
-            key_filename=target.key_filename,
+    Raises:
+        ValueError: 引数が不正な場合
+    """
+    exec_mode = plan.to_exec_mode(exec_mode)
+    if concurrency < 1:
+        raise ValueError(
+            "The argument 'concurrency' must be greater than or equal to 1"
         )
+    if local_journal.journal is None:
+        return {}
+    outstanding = local_journal.journal.outstanding()
+    if not outstanding:
+        return {}
+
+    def run(conf: Dict[str, str]) -> Optional[List[Dict]]:
+        target = Target.from_(conf)
+        result = __run_command(
+            target=target, command=Journal.probe(), exec_mode=exec_mode
+        )
+        fault_id_set = {entry.fault_id for entry in outstanding[target]}
+        journal = Journal.parse(result.stdout)
+        return __rollback_journal(target, journal, fault_id_set, exec_mode)
+
+    return run_all(run, [asdict(target) for target in outstanding], concurrency)
+
+
+def __rollback_journal(
+    target: Target, journal: Journal, fault_id_set: Set[str], exec_mode: ExecMode
+) -> Optional[List[Dict]]:
+    step_lst = plan.rollback_journal(journal, fault_id_set)
+    recorded = {entry.fault_id for entry in journal.entries} & fault_id_set
+    # nothing of a fault without the record on the target remains applied
+    for fault_id in fault_id_set - recorded:
+        local_journal.complete(target, fault_id)
+    if not step_lst:
+        return []
+    return __rollback_commands(target, step_lst, exec_mode)
+
+
+def __rollback_commands(
+    target: Target,
+    step_lst: List[Tuple[str, List[str], List[str]]],
+    exec_mode: ExecMode,
+) -> Optional[List[Dict]]:
+    # the commands to run after a fault is removed and the completion in the
+    # local journal are skipped when one of its commands failed, so that a
+    # retried rollback finds the fault as it was
+    results = __run_commands(
+        target, [cmd for _, cmd_lst, _ in step_lst for cmd in cmd_lst], exec_mode
+    )
+    removed = set(
+        plan.succeeded(
+            [(fault_id, cmd_lst) for fault_id, cmd_lst, _ in step_lst], results
+        )
+    )
+    done_step_lst = [
+        (fault_id, done_lst)
+        for fault_id, _, done_lst in step_lst
+        if fault_id in removed
+    ]
+    done_results = []
+    if any(done_lst for _, done_lst in done_step_lst):
+        done_results = __run_commands(
+            target,
+            [cmd for _, done_lst in done_step_lst for cmd in done_lst],
+            exec_mode,
+        )
+    for fault_id in plan.succeeded(done_step_lst, done_results):
+        local_journal.complete(target, fault_id)
+    if exec_mode != ExecMode.exec:
+        return [asdict(result) for result in results + done_results]
+
+
+def __inject_kill_loop(
+    target: Target,
+    command_lst: List[str],
+    interval: Union[int, float],
+    length: Union[int, float],
+    exec_mode: ExecMode = ExecMode.exec,
+) -> int:
+    cmd = command.kill_loop(cmd_lst=command_lst, interval=interval, length=length)
+    result = __run_command(target=target, command=cmd, exec_mode=exec_mode)
+    try:
+        return int(result.stdout.split()[-1])
+    except (IndexError, ValueError):
+        raise RuntimeError(
+            f"Failed to read the number of kills from output: {result.stdout}"
+        )
+
+
+def __run_command(
+    target: Target, command: str, exec_mode: ExecMode = ExecMode.exec
+) -> CommandResult:
+    if exec_mode != ExecMode.agent:
+        return __inject_command(target=target, command=command)
+    result = agent_client.session(target).run(command)
+    result.echo()
+    return result
+
+
+def __inject_command(target: Target, command: str) -> CommandResult:
+    with ssh_pool.pool.connection(target) as ssh:
+        _, stdout, _ = ssh.exec_command(command)
+        result = channel_reader.read(stdout.channel, command)
+    result.echo()
+    return result
+
+
+def __inject_commands(
+    target: Target, command_lst: List[str], exec_mode: ExecMode = ExecMode.exec
+) -> Optional[List[Dict]]:
+    results = __run_commands(target, command_lst, exec_mode)
+    if exec_mode != ExecMode.exec:
+        return [asdict(result) for result in results]
+
+
+def __run_commands(
+    target: Target, command_lst: List[str], exec_mode: ExecMode
+) -> List[CommandResult]:
+    if exec_mode == ExecMode.batch:
+        return __inject_batch(target, command_lst)
+    if exec_mode == ExecMode.agent:
+        results = agent_client.run_commands(target, command_lst)
+        for result in results:
+            result.echo()
+        return results
+    results = []
+    with ssh_pool.pool.connection(target) as ssh:
         for cmd in command_lst:
-            _, stdout, stderr = ssh.exec_command(cmd)
-            for out in stdout:
-                print("[out]", out, end="")
-            for err in stderr:
-                print("[err]", err, end="")
-            del stdout, stderr
+            _, stdout, _ = ssh.exec_command(cmd)
+            result = channel_reader.read(stdout.channel, cmd)
+            result.echo()
+            results.append(result)
+    return results
+
+
+def __inject_batch(target: Target, command_lst: List[str]) -> List[CommandResult]:
+    command_lst = list(command_lst)
+    with ssh_pool.pool.connection(target) as ssh:
+        stdin, stdout, _ = ssh.exec_command(batch.SHELL)
+        stdin.write(batch.script(command_lst))
+        stdin.channel.shutdown_write()
+        output = channel_reader.read(stdout.channel, batch.SHELL, max_bytes=None)
+    for err in output.stderr.splitlines(keepends=True):
+        print("[err]", err, end="")
+    results = batch.parse(command_lst, output.stdout.splitlines(keepends=True))
+    for result in results:
+        result.echo()
+    return results
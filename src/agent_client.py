@@ -0,0 +1,249 @@
+"""ターゲット上のfault_agent.pyを起動し,コマンドを1つのSSHチャネル経由で実行するためのクライアント
+
+コマンドごとにsshdがセッションを作成し,sudoを起動するexec_commandと異なり,
+エージェントはroot権限で常駐しているため,コマンドの実行はJSONの1往復で済む.
+エージェントのスクリプトは内容のハッシュ値をファイル名としてターゲットに保存し,
+内容が一致するスクリプトがすでに存在する場合はアップロードを省略する.
+リクエストにはidを付け,レスポンスは受信用のスレッドがidでリクエストと対応付けるため,
+複数のスレッドから同時にリクエストを送っても,時間のかかるコマンドが他のリクエストを待たせることはない.
+"""
+
+import atexit
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import ExitStack
+from pathlib import Path
+
+from beartype.typing import Dict, List, Tuple
+
+import channel_reader
+import ssh_pool
+from command_result import CommandResult
+from target import Target
+
+SOURCE = (Path(__file__).parent / "fault_agent.py").read_bytes()
+DIGEST = hashlib.sha256(SOURCE).hexdigest()
+REMOTE_DIR = ".cache/fault-agent"
+REMOTE_PATH = f"{REMOTE_DIR}/{DIGEST}.py"
+
+
+class AgentSession:
+    """ターゲット上で起動したエージェントとのセッション
+
+    セッションが生存している間はSSH接続を利用中として保持するため,接続がプールから破棄されることはない.
+    メソッドは複数のスレッドから同時に呼び出せる.
+
+    Args:
+        target (Target): エージェントを起動するターゲット.
+
+    Raises:
+        RuntimeError: エージェントのインストールまたは起動に失敗した場合
+    """
+
+    def __init__(self, target: Target):
+        self.target = target
+        self.__lock = threading.Lock()
+        self.__next_id = 0
+        self.__pending: Dict[int, Future] = {}
+        self.__started: Dict[int, Tuple[str, float]] = {}
+        self.__error = None
+        with ExitStack() as stack:
+            ssh = stack.enter_context(ssh_pool.pool.connection(target))
+            self.__install(ssh)
+            self.__stdin, self.__stdout, self.__stderr = ssh.exec_command(
+                f"sudo python3 {REMOTE_PATH}"
+            )
+            self.__receive()
+            self.__stack = stack.pop_all()
+        threading.Thread(target=self.__dispatch, daemon=True).start()
+
+    def is_alive(self) -> bool:
+        channel = self.__stdout.channel
+        return (
+            self.__error is None
+            and not channel.closed
+            and not channel.exit_status_ready()
+        )
+
+    def run(self, command: str) -> CommandResult:
+        """エージェント上でコマンドを実行する
+
+        エージェントはroot権限で動作しているため,先頭のsudoは取り除いて実行する.
+
+        Args:
+            command (str): 実行するコマンド.
+
+        Returns:
+            CommandResult: コマンドの実行結果.
+        """
+        start = time.monotonic()
+        res = self.request("run", command=self.__as_root(command))
+        return CommandResult(
+            command=command,
+            exit_status=res["exit_status"],
+            stdout=res["stdout"],
+            stderr=res["stderr"],
+            duration=time.monotonic() - start,
+        )
+
+    def start(self, command: str) -> int:
+        """エージェント上でコマンドをバックグラウンドで起動する
+
+        Args:
+            command (str): 起動するコマンド.
+
+        Returns:
+            int: AgentSession.stop()に渡すハンドル.
+        """
+        res = self.request("start", command=self.__as_root(command))
+        if res["exit_status"] != 0:
+            raise RuntimeError(f"Failed to start {command}: {res['stderr']}")
+        with self.__lock:
+            self.__started[res["handle"]] = (command, time.monotonic())
+        return res["handle"]
+
+    def stop(self, handle: int) -> CommandResult:
+        """AgentSession.start()で起動したコマンドを停止する
+
+        コマンドが子プロセスを起動していた場合は,子プロセスもあわせて停止する.
+
+        Args:
+            handle (int): AgentSession.start()が返したハンドル.
+
+        Returns:
+            CommandResult: 停止したコマンドの実行結果. durationは起動から停止までの時間.
+
+        Raises:
+            ValueError: ハンドルが不正な場合
+        """
+        with self.__lock:
+            if handle not in self.__started:
+                raise ValueError(f"Unknown handle: {handle}")
+            command, start = self.__started.pop(handle)
+        res = self.request("stop", handle=handle)
+        return CommandResult(
+            command=command,
+            exit_status=res["exit_status"],
+            stdout=res["stdout"],
+            stderr=res["stderr"],
+            duration=time.monotonic() - start,
+        )
+
+    def request(self, op: str, **kwargs) -> Dict:
+        """エージェントにリクエストを送り,レスポンスを返す
+
+        レスポンスを待つ間も,他のスレッドからのリクエストは並行して処理される.
+        """
+        future = Future()
+        with self.__lock:
+            if self.__error is not None:
+                raise self.__error
+            self.__next_id += 1
+            req = dict(kwargs, id=self.__next_id, op=op)
+            self.__pending[req["id"]] = future
+            self.__stdin.write(json.dumps(req) + "\n")
+            self.__stdin.flush()
+        return future.result()
+
+    def close(self):
+        """エージェントを終了し,SSH接続を解放する"""
+        try:
+            if self.is_alive():
+                self.__stdin.write(json.dumps({"op": "shutdown"}) + "\n")
+                self.__stdin.channel.shutdown_write()
+        finally:
+            self.__stdout.channel.close()
+            self.__stack.close()
+
+    def __dispatch(self):
+        # hands each response to the request of its id, until the agent exits
+        try:
+            while True:
+                res = self.__receive()
+                with self.__lock:
+                    future = self.__pending.pop(res.get("id"), None)
+                if future is None:
+                    raise RuntimeError(
+                        f"Unexpected response from the fault agent: {res}."
+                    )
+                future.set_result(res)
+        except Exception as error:
+            with self.__lock:
+                self.__error = error
+                pending = list(self.__pending.values())
+                self.__pending.clear()
+            for future in pending:
+                future.set_exception(error)
+
+    def __receive(self) -> Dict:
+        line = self.__stdout.readline()
+        if not line:
+            stderr = self.__stderr.read().decode(errors="replace")
+            raise RuntimeError(f"The fault agent exited unexpectedly: {stderr}")
+        return json.loads(line)
+
+    @staticmethod
+    def __install(ssh):
+        _, stdout, _ = ssh.exec_command(
+            f"echo '{DIGEST}  {REMOTE_PATH}' | sha256sum -c --status"
+        )
+        if stdout.channel.recv_exit_status() == 0:
+            return
+        cmd = (
+            f"umask 077 && mkdir -p {REMOTE_DIR}"
+            f" && cat > {REMOTE_PATH}.$$ && mv {REMOTE_PATH}.$$ {REMOTE_PATH}"
+        )
+        stdin, stdout, _ = ssh.exec_command(cmd)
+        stdin.write(SOURCE)
+        stdin.channel.shutdown_write()
+        result = channel_reader.read(stdout.channel, cmd)
+        if result.exit_status != 0:
+            raise RuntimeError(f"Failed to install the fault agent: {result.stderr}")
+
+    @staticmethod
+    def __as_root(command: str) -> str:
+        return command[len("sudo ") :] if command.startswith("sudo ") else command
+
+
+__sessions: Dict[Target, AgentSession] = {}
+__locks: Dict[Target, threading.Lock] = {}
+__lock = threading.Lock()
+
+
+def session(target: Target) -> AgentSession:
+    """ターゲット上のエージェントとのセッションを取得する
+
+    生存しているセッションがあればそれを返し,なければエージェントを起動する.
+    """
+    with __lock:
+        lock = __locks.setdefault(target, threading.Lock())
+    with lock:
+        current = __sessions.get(target)
+        if current is not None and current.is_alive():
+            return current
+        if current is not None:
+            current.close()
+        current = AgentSession(target)
+        __sessions[target] = current
+        return current
+
+
+def run_commands(target: Target, command_lst: List[str]) -> List[CommandResult]:
+    """ターゲット上のエージェントでコマンドを順に実行する"""
+    agent = session(target)
+    return [agent.run(cmd) for cmd in command_lst]
+
+
+def close_all():
+    """すべてのエージェントを終了する"""
+    with __lock:
+        sessions = list(__sessions.values())
+        __sessions.clear()
+    for agent in sessions:
+        agent.close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,649 @@
+"""action.pyの各アクションの非同期版
+
+コマンドの作成はaction.pyと同じくplan.pyでおこない,実行にはasync_transportを利用する.
+引数と戻り値は対応するaction.pyのアクションと同様で,targetにターゲットのリストを渡した場合は
+1つのイベントループ上ですべてのターゲットに対して並列に実行する.
+"""
+
+import asyncio
+import time
+from dataclasses import asdict
+
+from beartype import beartype
+from beartype.typing import Dict, List, Optional, Set, Tuple, Union
+
+import async_transport
+import command
+import fault_profile
+import local_journal
+import plan
+from exec_mode import ExecMode
+from fan_out import DEFAULT_ASYNC_CONCURRENCY, fan_out_async, run_all_async
+from fault_journal import Journal
+from link import Link
+from qdisc_snapshot import QdiscSnapshot
+from target import Target
+from tc_registry import Allocation
+
+
+@fan_out_async
+@beartype
+async def inject_cpu_stress(
+    cores: int = 1,
+    percent: int = 100,
+    length: int = 60,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_cpu_stressの非同期版"""
+    cmd_lst = plan.inject_cpu_stress(cores=cores, percent=percent, length=length)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await async_transport.run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_memory_stress(
+    mb: int = None,
+    gb: int = None,
+    percentage: int = 100,
+    length: int = 60,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_memory_stressの非同期版"""
+    cmd_lst = plan.inject_memory_stress(
+        mb=mb, gb=gb, percentage=percentage, length=length
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await async_transport.run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_disk_stress(
+    dir: str = "/tmp",
+    workers: int = 1,
+    block_size: int = 64,
+    volume_percentage: int = 100,
+    length: int = 60,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_disk_stressの非同期版"""
+    cmd_lst = plan.inject_disk_stress(
+        dir=dir,
+        workers=workers,
+        block_size=block_size,
+        volume_percentage=volume_percentage,
+        length=length,
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await async_transport.run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_io_stress(
+    dir: str = "/tmp",
+    workers: int = 1,
+    mode: str = "rw",
+    block_size: int = 4,
+    block_count: int = 1,
+    length: int = 60,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_io_stressの非同期版"""
+    cmd_lst = plan.inject_io_stress(
+        dir=dir,
+        workers=workers,
+        mode=mode,
+        block_size=block_size,
+        block_count=block_count,
+        length=length,
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await async_transport.run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_os_shutdown(
+    delay: int = 1,
+    reboot: bool = True,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_os_shutdownの非同期版"""
+    cmd_lst = plan.inject_os_shutdown(delay=delay, reboot=reboot)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await async_transport.run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_time_travel(
+    disable_ntp: bool = False,
+    offset: int = 86400,
+    exec_mode: str = "exec",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
+    """action.inject_time_travelの非同期版"""
+    cmd_lst = plan.inject_time_travel(disable_ntp=disable_ntp, offset=offset, ttl=ttl)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    await __record(target, "time_travel", plan.time_travel_fault(disable_ntp), cmd_lst)
+    return await __run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def rollback_time_travel(
+    enable_ntp: bool = False,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.rollback_time_travelの非同期版"""
+    cmd_lst, done_lst = plan.rollback_time_travel(enable_ntp=enable_ntp)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault_id, _ = plan.time_travel_fault(enable_ntp)
+    return await __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_process_kill(
+    pid_lst: List[int],
+    signal: str = "KILL",
+    interval: Union[int, float] = 0,
+    kill_children: bool = False,
+    length: Union[int, float] = -1,
+    remote_loop: bool = False,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_process_killの非同期版"""
+    exec_mode = plan.to_exec_mode(exec_mode)
+    cmd_lst = plan.inject_process_kill(
+        pid_lst=pid_lst,
+        signal=signal,
+        kill_children=kill_children,
+        sudo=not remote_loop and exec_mode != ExecMode.agent,
+        count=remote_loop,
+    )
+    target = plan.to_target(target)
+    return await __run_kill(target, cmd_lst, interval, length, remote_loop, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_process_pkill(
+    process_name_lst: List[str],
+    signal: str = "KILL",
+    interval: Union[int, float] = 0,
+    group: str = None,
+    user: str = None,
+    newest: bool = False,
+    oldest: bool = False,
+    exact: bool = False,
+    kill_children: bool = False,
+    full_match: bool = False,
+    length: Union[int, float] = -1,
+    remote_loop: bool = False,
+    exec_mode: str = "exec",
+    target: Dict[str, str] = None,
+):
+    """action.inject_process_pkillの非同期版"""
+    exec_mode = plan.to_exec_mode(exec_mode)
+    cmd_lst = plan.inject_process_pkill(
+        process_name_lst=process_name_lst,
+        signal=signal,
+        group=group,
+        user=user,
+        newest=newest,
+        oldest=oldest,
+        exact=exact,
+        full_match=full_match,
+        kill_children=kill_children,
+        sudo=not remote_loop and exec_mode != ExecMode.agent,
+        count=remote_loop,
+    )
+    target = plan.to_target(target)
+    return await __run_kill(target, cmd_lst, interval, length, remote_loop, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_traffic_control(
+    params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
+    """action.inject_traffic_controlの非同期版"""
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    key = Allocation.key(normalized)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = await async_transport.run_command(target, Link.probe(device), exec_mode)
+    link = Link.parse(result.stdout)
+    tree = plan.traffic_control_tree(params=params, classifier=classifier, link=link)
+    result = await async_transport.run_command(
+        target, Allocation.allocate(device, key, tree), exec_mode
+    )
+    allocation = Allocation.parse(result.stdout, key)
+    try:
+        cmd_lst = plan.inject_traffic_control(
+            params=params,
+            atomic=atomic,
+            ipset=ipset,
+            classifier=classifier,
+            link=link,
+            allocation=allocation,
+            ttl=ttl,
+        )
+    except ValueError:
+        await async_transport.run_command(
+            target, Allocation.release(device, key), exec_mode
+        )
+        raise
+    fault = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    await __record(target, "traffic_control", fault, cmd_lst)
+    results = await __run_commands(target, cmd_lst, exec_mode)
+    profile_cmd = plan.traffic_control_profile(
+        params=params, classifier=classifier, link=link, allocation=allocation
+    )
+    if profile_cmd is None:
+        return results
+    result = await async_transport.run_command(target, profile_cmd, exec_mode)
+    return fault_profile.parse(result.stdout)
+
+
+@fan_out_async
+@beartype
+async def update_traffic_control(
+    params: Dict,
+    new_params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """action.update_traffic_controlの非同期版"""
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    plan.normalize_traffic_control_params(new_params)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = await async_transport.run_command(target, Link.probe(device), exec_mode)
+    link = Link.parse(result.stdout)
+    result = await async_transport.run_command(
+        target, Allocation.probe(device), exec_mode
+    )
+    cmd_lst = plan.update_traffic_control(
+        params=params,
+        new_params=new_params,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        link=link,
+        allocation=Allocation.parse(result.stdout, Allocation.key(normalized)),
+    )
+    # the fault is recorded again when the new parameters change its ID
+    fault_id, _ = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    new_fault = plan.traffic_control_fault(new_params, atomic, ipset, classifier)
+    renamed = new_fault[0] != fault_id
+    if not renamed:
+        return await __run_commands(target, cmd_lst, exec_mode)
+    await __record(target, "traffic_control", new_fault, cmd_lst)
+    return await __rollback_commands(target, [(fault_id, cmd_lst, [])], exec_mode)
+
+
+@fan_out_async
+@beartype
+async def rollback_traffic_control(
+    params: Dict,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """action.rollback_traffic_controlの非同期版"""
+    normalized = plan.normalize_traffic_control_params(params)
+    device = normalized["device"]
+    key = Allocation.key(normalized)
+    plan.to_classifier(classifier, ipset)
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = await async_transport.run_command(
+        target, Allocation.probe(device), exec_mode
+    )
+    allocation = Allocation.parse(result.stdout, key)
+    snapshot = QdiscSnapshot()
+    if not allocation.others:
+        result = await async_transport.run_command(
+            target, QdiscSnapshot.probe(device), exec_mode
+        )
+        snapshot = QdiscSnapshot.parse(result.stdout)
+    cmd_lst, done_lst = plan.rollback_traffic_control(
+        params=params,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        snapshot=snapshot,
+        allocation=allocation,
+    )
+    fault_id, _ = plan.traffic_control_fault(params, atomic, ipset, classifier)
+    return await __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
+
+
+@fan_out_async
+@beartype
+async def inject_latency_matrix(
+    matrix: Dict[str, Dict[str, Union[int, Dict]]],
+    regions: Dict[str, str],
+    device: str = "eth0",
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
+    """action.inject_latency_matrixの非同期版"""
+    params = plan.latency_matrix_params(
+        matrix, regions, plan.to_target(target).hostname, device
+    )
+    if params is None:
+        return None
+    return await inject_traffic_control(
+        params=params,
+        exec_mode=exec_mode,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        ttl=ttl,
+        target=target,
+    )
+
+
+@fan_out_async
+@beartype
+async def rollback_latency_matrix(
+    matrix: Dict[str, Dict[str, Union[int, Dict]]],
+    regions: Dict[str, str],
+    device: str = "eth0",
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """action.rollback_latency_matrixの非同期版"""
+    params = plan.latency_matrix_params(
+        matrix, regions, plan.to_target(target).hostname, device
+    )
+    if params is None:
+        return None
+    return await rollback_traffic_control(
+        params=params,
+        exec_mode=exec_mode,
+        atomic=atomic,
+        ipset=ipset,
+        classifier=classifier,
+        target=target,
+    )
+
+
+@fan_out_async
+@beartype
+async def inject_traffic_block(
+    destination_ip_addresses: List[str] = None,
+    device: str = "eth0",
+    destination_ports: List[str] = None,
+    source_ports: List[str] = None,
+    tcp: bool = True,
+    udp: bool = True,
+    icmp: bool = True,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+    ttl: Optional[int] = None,
+    target: Dict[str, str] = None,
+):
+    """action.inject_traffic_blockの非同期版"""
+    cmd_lst = plan.inject_traffic_block(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+        ttl=ttl,
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault = plan.traffic_block_fault(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+    )
+    await __record(target, "traffic_block", fault, cmd_lst)
+    return await __run_commands(target, cmd_lst, exec_mode)
+
+
+@fan_out_async
+@beartype
+async def rollback_traffic_block(
+    destination_ip_addresses: List[str] = None,
+    device: str = "eth0",
+    destination_ports: List[str] = None,
+    source_ports: List[str] = None,
+    tcp: bool = True,
+    udp: bool = True,
+    icmp: bool = True,
+    exec_mode: str = "exec",
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+    target: Dict[str, str] = None,
+):
+    """action.rollback_traffic_blockの非同期版"""
+    cmd_lst, done_lst = plan.rollback_traffic_block(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+    )
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    fault_id, _ = plan.traffic_block_fault(
+        destination_ip_addresses=destination_ip_addresses,
+        device=device,
+        destination_ports=destination_ports,
+        source_ports=source_ports,
+        tcp=tcp,
+        udp=udp,
+        icmp=icmp,
+        atomic=atomic,
+        ipset=ipset,
+        firewall=firewall,
+    )
+    return await __rollback_commands(target, [(fault_id, cmd_lst, done_lst)], exec_mode)
+
+
+@fan_out_async
+@beartype
+async def rollback_journal(
+    fault_id: str = None,
+    exec_mode: str = "batch",
+    target: Dict[str, str] = None,
+):
+    """action.rollback_journalの非同期版"""
+    target = plan.to_target(target)
+    exec_mode = plan.to_exec_mode(exec_mode)
+    result = await async_transport.run_command(target, Journal.probe(), exec_mode)
+    journal = Journal.parse(result.stdout)
+    fault_id_set = {
+        entry.fault_id
+        for entry in journal.entries
+        if fault_id is None or entry.fault_id == fault_id
+    }
+    return await __rollback_journal(target, journal, fault_id_set, exec_mode)
+
+
+@beartype
+async def rollback_all(
+    exec_mode: str = "batch", concurrency: int = DEFAULT_ASYNC_CONCURRENCY
+):
+    """action.rollback_allの非同期版"""
+    exec_mode = plan.to_exec_mode(exec_mode)
+    if concurrency < 1:
+        raise ValueError(
+            "The argument 'concurrency' must be greater than or equal to 1"
+        )
+    if local_journal.journal is None:
+        return {}
+    outstanding = await asyncio.get_running_loop().run_in_executor(
+        None, local_journal.journal.outstanding
+    )
+    if not outstanding:
+        return {}
+
+    async def run(conf: Dict[str, str]) -> Optional[List[Dict]]:
+        target = Target.from_(conf)
+        result = await async_transport.run_command(target, Journal.probe(), exec_mode)
+        fault_id_set = {entry.fault_id for entry in outstanding[target]}
+        journal = Journal.parse(result.stdout)
+        return await __rollback_journal(target, journal, fault_id_set, exec_mode)
+
+    return await run_all_async(
+        run, [asdict(target) for target in outstanding], concurrency
+    )
+
+
+async def __rollback_journal(
+    target: Target, journal: Journal, fault_id_set: Set[str], exec_mode: ExecMode
+) -> Optional[List[Dict]]:
+    step_lst = plan.rollback_journal(journal, fault_id_set)
+    recorded = {entry.fault_id for entry in journal.entries} & fault_id_set
+    # nothing of a fault without the record on the target remains applied
+    await __complete(target, sorted(fault_id_set - recorded))
+    if not step_lst:
+        return []
+    return await __rollback_commands(target, step_lst, exec_mode)
+
+
+async def __rollback_commands(
+    target: Target,
+    step_lst: List[Tuple[str, List[str], List[str]]],
+    exec_mode: ExecMode,
+) -> Optional[List[Dict]]:
+    # the commands to run after a fault is removed and the completion in the
+    # local journal are skipped when one of its commands failed, so that a
+    # retried rollback finds the fault as it was
+    results = await async_transport.run_commands(
+        target, [cmd for _, cmd_lst, _ in step_lst for cmd in cmd_lst], exec_mode
+    )
+    removed = set(
+        plan.succeeded(
+            [(fault_id, cmd_lst) for fault_id, cmd_lst, _ in step_lst], results
+        )
+    )
+    done_step_lst = [
+        (fault_id, done_lst)
+        for fault_id, _, done_lst in step_lst
+        if fault_id in removed
+    ]
+    done_results = []
+    if any(done_lst for _, done_lst in done_step_lst):
+        done_results = await async_transport.run_commands(
+            target,
+            [cmd for _, done_lst in done_step_lst for cmd in done_lst],
+            exec_mode,
+        )
+    await __complete(target, plan.succeeded(done_step_lst, done_results))
+    if exec_mode in (ExecMode.batch, ExecMode.agent):
+        return [asdict(result) for result in results + done_results]
+
+
+async def __record(
+    target: Target, action: str, fault: Tuple[str, Dict], command_lst: List[str]
+) -> None:
+    # the local journal fsyncs every line, so it is written off the event loop
+    await asyncio.get_running_loop().run_in_executor(
+        None, local_journal.record, target, action, fault, command_lst
+    )
+
+
+async def __complete(target: Target, fault_id_lst: List[str]) -> None:
+    loop = asyncio.get_running_loop()
+    for fault_id in fault_id_lst:
+        await loop.run_in_executor(None, local_journal.complete, target, fault_id)
+
+
+async def __run_commands(
+    target: Target, command_lst: List[str], exec_mode: ExecMode
+) -> Optional[List[Dict]]:
+    results = await async_transport.run_commands(target, command_lst, exec_mode)
+    if exec_mode in (ExecMode.batch, ExecMode.agent):
+        return [asdict(result) for result in results]
+
+
+async def __run_kill(
+    target: Target,
+    command_lst: List[str],
+    interval: Union[int, float],
+    length: Union[int, float],
+    remote_loop: bool,
+    exec_mode: ExecMode,
+) -> Optional[int]:
+    if remote_loop:
+        cmd = command.kill_loop(cmd_lst=command_lst, interval=interval, length=length)
+        result = await async_transport.run_command(target, cmd, exec_mode)
+        try:
+            return int(result.stdout.split()[-1])
+        except (IndexError, ValueError):
+            raise RuntimeError(
+                f"Failed to read the number of kills from output: {result.stdout}"
+            )
+    start_time = time.time()
+    while True:
+        await asyncio.sleep(interval)
+        await async_transport.run_commands(target, command_lst, exec_mode)
+        if time.time() - start_time > length:
+            break
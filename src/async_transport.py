@@ -0,0 +1,162 @@
+"""asyncioでターゲット上のコマンドを実行するためのトランスポート
+
+asyncsshを利用し,1つのイベントループ上で多数のターゲットへのハンドシェイクとチャネルのI/Oを多重化する.
+接続はSSHConnectionPoolと同様にTargetごとに保持して再利用する.
+exec_modeが"agent"の場合はagent_clientのセッションをスレッドプール上で利用する.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import asyncssh
+from beartype.typing import AsyncIterator, Dict, List
+
+import agent_client
+import batch
+from command_result import CommandResult
+from exec_mode import ExecMode
+from target import Target
+
+
+class AsyncSSHConnectionPool:
+    """認証済みのasyncsshの接続をターゲットごとに保持するプール
+
+    接続はそれを作成したイベントループに属するため,異なるイベントループから利用された場合は保持している接続を破棄する.
+
+    Args:
+        max_size (int, optional): 保持する接続数の上限. 超えた場合は最も長く使われていない接続から破棄する. Defaults to 4096.
+        idle_timeout (float, optional): 最後に利用されてから破棄されるまでの時間(秒). Defaults to 300.
+        keepalive (int, optional): keepaliveパケットの送信間隔(秒). 0の場合は送信しない. Defaults to 30.
+    """
+
+    def __init__(
+        self, max_size: int = 4096, idle_timeout: float = 300, keepalive: int = 30
+    ):
+        if max_size < 1:
+            raise ValueError(
+                "The argument 'max_size' must be greater than or equal to 1"
+            )
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.__loop = None
+        self.__conns: Dict[Target, asyncssh.SSHClientConnection] = {}
+        self.__last_used: Dict[Target, float] = {}
+        self.__locks: Dict[Target, asyncio.Lock] = {}
+        self.__in_use: Dict[Target, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.__conns)
+
+    @asynccontextmanager
+    async def connection(
+        self, target: Target
+    ) -> AsyncIterator[asyncssh.SSHClientConnection]:
+        """ターゲットへの認証済みの接続を取得する
+
+        ブロック内で接続に起因する例外が発生した場合,その接続はプールから破棄される.
+        """
+        loop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            self.__conns.clear()
+            self.__last_used.clear()
+            self.__locks.clear()
+            self.__in_use.clear()
+            self.__loop = loop
+        self.__evict()
+        lock = self.__locks.setdefault(target, asyncio.Lock())
+        async with lock:
+            conn = self.__conns.get(target)
+            if conn is None or conn.is_closed():
+                conn = await self.__connect(target)
+                self.__conns[target] = conn
+        self.__last_used[target] = time.monotonic()
+        self.__in_use[target] = self.__in_use.get(target, 0) + 1
+        try:
+            yield conn
+        except (asyncssh.Error, OSError):
+            self.discard(target)
+            raise
+        finally:
+            self.__in_use[target] -= 1
+            if target in self.__last_used:
+                self.__last_used[target] = time.monotonic()
+
+    def discard(self, target: Target):
+        """ターゲットへの接続をプールから取り除き,切断する"""
+        conn = self.__conns.pop(target, None)
+        self.__last_used.pop(target, None)
+        if conn is not None:
+            conn.close()
+
+    def close_all(self):
+        """プール内のすべての接続を切断する"""
+        for target in list(self.__conns):
+            self.discard(target)
+
+    def __evict(self):
+        now = time.monotonic()
+        idle = [t for t in self.__last_used if not self.__in_use.get(t)]
+        for target in idle:
+            if now - self.__last_used[target] > self.idle_timeout:
+                self.discard(target)
+        idle = sorted(
+            (t for t in self.__last_used if not self.__in_use.get(t)),
+            key=self.__last_used.get,
+        )
+        for target in idle[: max(0, len(self.__conns) - self.max_size + 1)]:
+            self.discard(target)
+
+    async def __connect(self, target: Target) -> asyncssh.SSHClientConnection:
+        return await asyncssh.connect(
+            target.hostname,
+            username=target.username,
+            client_keys=[target.key_filename],
+            known_hosts=None,
+            keepalive_interval=self.keepalive,
+        )
+
+
+pool = AsyncSSHConnectionPool()
+
+
+async def run_command(
+    target: Target, command: str, exec_mode: ExecMode = ExecMode.exec
+) -> CommandResult:
+    if exec_mode == ExecMode.agent:
+        results = await run_commands(target, [command], exec_mode)
+        return results[0]
+    async with pool.connection(target) as conn:
+        start = time.monotonic()
+        completed = await conn.run(command)
+    result = CommandResult(
+        command=command,
+        exit_status=completed.exit_status,
+        stdout=completed.stdout,
+        stderr=completed.stderr,
+        duration=time.monotonic() - start,
+    )
+    result.echo()
+    return result
+
+
+async def run_commands(
+    target: Target, command_lst: List[str], exec_mode: ExecMode = ExecMode.exec
+) -> List[CommandResult]:
+    if exec_mode == ExecMode.agent:
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None, agent_client.run_commands, target, command_lst
+        )
+        for result in results:
+            result.echo()
+        return results
+    if exec_mode != ExecMode.batch:
+        return [await run_command(target, cmd) for cmd in command_lst]
+    async with pool.connection(target) as conn:
+        completed = await conn.run(batch.SHELL, input=batch.script(command_lst))
+    results = batch.parse(command_lst, completed.stdout.splitlines(keepends=True))
+    for result in results:
+        result.echo()
+    return results
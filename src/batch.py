@@ -0,0 +1,60 @@
+"""コマンドのリストを1つのシェルスクリプトとして1回の往復で実行するためのモジュール
+
+script()で組み立てたスクリプトを`sh -s`の標準入力に渡して実行し,その標準出力をparse()に渡すと
+コマンドごとの終了ステータス,標準出力,標準エラー出力,実行時間が得られる.
+"""
+
+import base64
+from typing import List
+
+from command_result import CommandResult
+
+SHELL = "sh -s"
+
+__MARKER = "@@fit"
+
+
+def script(command_lst: List[str]) -> str:
+    lines = [
+        "d=$(mktemp -d) || exit 1",
+        "trap 'rm -rf \"$d\"' EXIT",
+    ]
+    for i, cmd in enumerate(command_lst):
+        lines.extend(
+            [
+                "s=$(date +%s%N)",
+                "{",
+                cmd,
+                '} >"$d/out" 2>"$d/err" </dev/null',
+                "rc=$?",
+                "e=$(date +%s%N)",
+                (
+                    f'printf \'{__MARKER}\\t%d\\t%d\\t%d\\t%s\\t%s\\n\' {i} "$rc" "$((e-s))"'
+                    ' "$(base64 -w0 <"$d/out")" "$(base64 -w0 <"$d/err")"'
+                ),
+            ]
+        )
+    return "\n".join(lines) + "\n"
+
+
+def parse(command_lst: List[str], out_lst: List[str]) -> List[CommandResult]:
+    results = []
+    for line in out_lst:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != 6 or fields[0] != __MARKER:
+            continue
+        i, exit_status, duration, stdout, stderr = fields[1:]
+        results.append(
+            CommandResult(
+                command=command_lst[int(i)],
+                exit_status=int(exit_status),
+                stdout=base64.b64decode(stdout).decode(errors="replace"),
+                stderr=base64.b64decode(stderr).decode(errors="replace"),
+                duration=int(duration) / 1e9,
+            )
+        )
+    if len(results) != len(command_lst):
+        raise RuntimeError(
+            f"Batch execution was interrupted: {len(results)} of {len(command_lst)} commands were completed."
+        )
+    return results
@@ -0,0 +1,100 @@
+"""tcとiptablesのコマンドのリストを,それぞれ1回のコマンド実行で適用できる形にまとめるためのモジュール
+
+iptablesはコマンドごとにルールセット全体をxtablesのロックを取得したうえで読み書きするため,
+ルール数に比例して時間がかかり,途中で失敗した場合は一部のルールだけが適用された状態になる.
+bundle()はiptablesのルールを1つの`iptables-restore --noflush`の入力に,tcのコマンドを1つの`tc -batch`の入力にまとめ,
+ヒアドキュメントで標準入力から渡すコマンドに変換する. iptables-restoreはテーブルごとにルールをアトミックに適用する.
+"""
+
+import shlex
+from collections import OrderedDict
+
+from beartype.typing import Dict, List, Optional, Tuple
+
+__EOF = "__FIT_EOF__"
+
+
+def bundle(command_lst: List[str], force: bool = False) -> List[str]:
+    """tcとiptablesのコマンドをそれぞれ1つのコマンドにまとめる
+
+    まとめたコマンドは,元のリストでそれぞれのツールが最初に現れた位置に置く.
+    tcとiptables以外のコマンドはまとめずにそのままの順序で残す.
+
+    Args:
+        command_lst (List[str]): コマンドのリスト.
+        force (bool, optional): Trueの場合は`tc -force -batch`で,失敗した行があっても残りの行を実行する.
+            iptables-restoreが失敗した場合は,ルールを1つずつiptablesで適用し直す.
+            一部だけ適用された障害のロールバックのように,すでに削除されたものに対するコマンドが失敗しうる場合に指定する. Defaults to False.
+
+    Returns:
+        List[str]: まとめたコマンドのリスト.
+    """
+    groups: List[Tuple[Optional[str], List[str]]] = []
+    lines_by_tool: Dict[str, List[str]] = {}
+    for cmd in command_lst:
+        words = cmd.split()
+        tool = words[1] if words[0] == "sudo" else words[0]
+        if tool not in ("tc", "iptables"):
+            groups.append((None, [cmd]))
+            continue
+        if tool not in lines_by_tool:
+            lines_by_tool[tool] = []
+            groups.append((tool, lines_by_tool[tool]))
+        argv = shlex.split(cmd)
+        lines_by_tool[tool].append(shlex.join(argv[argv.index(tool) + 1 :]))
+
+    bundled = []
+    for tool, lines in groups:
+        if tool == "tc":
+            cmd = "sudo tc -force -batch -" if force else "sudo tc -batch -"
+            bundled.append(heredoc(cmd, lines))
+        elif tool == "iptables":
+            cmd = "sudo iptables-restore --noflush"
+            if not force:
+                bundled.append(heredoc(cmd, __restore_lines(lines)))
+                continue
+            # iptables-restore fails as a whole when one rule is already gone,
+            # so the rules are then applied one by one and only the errors of
+            # the rules that failed are left
+            bundled.append(
+                "\n".join(
+                    [
+                        f"{cmd} <<'{__EOF}' 2>/dev/null || {__one_by_one(lines)}",
+                        *__restore_lines(lines),
+                        __EOF,
+                    ]
+                )
+            )
+        else:
+            bundled.extend(lines)
+    return bundled
+
+
+def __one_by_one(rule_lst: List[str]) -> str:
+    script = "; ".join(
+        ["r=0", *(f"iptables {rule} || r=1" for rule in rule_lst), "exit $r"]
+    )
+    return f"sudo sh -c {shlex.quote(script)}"
+
+
+def __restore_lines(rule_lst: List[str]) -> List[str]:
+    tables: Dict[str, List[str]] = OrderedDict()
+    for rule in rule_lst:
+        argv = shlex.split(rule)
+        table = "filter"
+        if "-t" in argv:
+            i = argv.index("-t")
+            table = argv[i + 1]
+            del argv[i : i + 2]
+        tables.setdefault(table, []).append(shlex.join(argv))
+    lines = []
+    for table, rules in tables.items():
+        lines.append(f"*{table}")
+        lines.extend(rules)
+        lines.append("COMMIT")
+    return lines
+
+
+def heredoc(cmd: str, lines: List[str]) -> str:
+    """linesをヒアドキュメントでcmdの標準入力に渡すコマンドを返す"""
+    return "\n".join([f"{cmd} <<'{__EOF}'", *lines, __EOF])
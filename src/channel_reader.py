@@ -0,0 +1,117 @@
+"""SSHチャネルの標準出力と標準エラー出力を同時に読み出すためのモジュール
+
+標準出力を読み切ってから標準エラー出力を読むと,標準エラー出力がチャネルのウィンドウを埋めた時点で
+リモートのコマンドが停止してしまうため,両方のストリームを到着した順に読み出す.
+終了ステータスは出力の残りより先に届くことがあるため,終了ステータスを受け取った後もEOFまで両方のストリームを読み出す.
+読み出した出力はサイズの上限を持つリングバッファに保持し,上限を超えた場合は古い出力から破棄する.
+"""
+
+import select
+import time
+from collections import deque
+
+import paramiko
+from beartype.typing import Optional
+
+from command_result import CommandResult
+
+DEFAULT_MAX_BYTES = 1024 * 1024
+
+__CHUNK_SIZE = 32768
+__POLL_INTERVAL = 0.1
+
+
+class RingBuffer:
+    """保持するバイト数の上限を持つバッファ
+
+    上限を超えて書き込まれた場合は古いデータから破棄し,末尾のmax_bytesバイトを保持する.
+
+    Args:
+        max_bytes (Optional[int]): 保持するバイト数の上限. Noneの場合は上限を設けない.
+    """
+
+    def __init__(self, max_bytes: Optional[int]):
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.__chunks = deque()
+        self.__size = 0
+
+    def write(self, data: bytes):
+        self.__chunks.append(data)
+        self.__size += len(data)
+        if self.max_bytes is None:
+            return
+        while self.__size > self.max_bytes:
+            excess = self.__size - self.max_bytes
+            head = self.__chunks[0]
+            if len(head) <= excess:
+                self.__chunks.popleft()
+                self.__size -= len(head)
+                self.dropped += len(head)
+            else:
+                self.__chunks[0] = head[excess:]
+                self.__size -= excess
+                self.dropped += excess
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.__chunks)
+
+
+def read(
+    channel: paramiko.Channel,
+    command: str,
+    max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+) -> CommandResult:
+    """コマンドが終了するまでチャネルの標準出力と標準エラー出力を読み出し,実行結果を返す
+
+    Args:
+        channel (paramiko.Channel): コマンドを実行したチャネル.
+        command (str): 実行したコマンド.
+        max_bytes (Optional[int], optional): ストリームごとに保持する出力のバイト数の上限. Noneの場合は上限を設けない. Defaults to DEFAULT_MAX_BYTES.
+
+    Returns:
+        CommandResult: コマンドの実行結果. 上限を超えて出力が破棄された場合はtruncatedがTrueになる.
+    """
+    start = time.monotonic()
+    stdout = RingBuffer(max_bytes)
+    stderr = RingBuffer(max_bytes)
+    while True:
+        if __receive(channel, stdout, stderr):
+            continue
+        if channel.exit_status_ready() or channel.eof_received:
+            break
+        select.select([channel], [], [], __POLL_INTERVAL)
+    exit_status = channel.recv_exit_status()
+    # the exit status can arrive before the last of the output, so both
+    # streams are read until EOF, where they return nothing. Waiting for the
+    # readiness of either keeps a full window of one from stalling the other
+    while not (channel.eof_received or channel.closed):
+        if not __receive(channel, stdout, stderr):
+            select.select([channel], [], [], __POLL_INTERVAL)
+    for recv, buffer in ((channel.recv, stdout), (channel.recv_stderr, stderr)):
+        data = recv(__CHUNK_SIZE)
+        while data:
+            buffer.write(data)
+            data = recv(__CHUNK_SIZE)
+    return CommandResult(
+        command=command,
+        exit_status=exit_status,
+        stdout=stdout.getvalue().decode(errors="replace"),
+        stderr=stderr.getvalue().decode(errors="replace"),
+        duration=time.monotonic() - start,
+        truncated=stdout.dropped > 0 or stderr.dropped > 0,
+    )
+
+
+def __receive(
+    channel: paramiko.Channel, stdout: RingBuffer, stderr: RingBuffer
+) -> bool:
+    # reads what has arrived on both streams without blocking
+    received = False
+    while channel.recv_ready():
+        stdout.write(channel.recv(__CHUNK_SIZE))
+        received = True
+    while channel.recv_stderr_ready():
+        stderr.write(channel.recv_stderr(__CHUNK_SIZE))
+        received = True
+    return received
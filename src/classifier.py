@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class Classifier(Enum):
+    iptables = "iptables"
+    flower = "flower"
+    nftables = "nftables"
@@ -1,4 +1,5 @@
-from typing import List
+import shlex
+from typing import List, Union
 
 from io_mode import IOMode
 from signal_ import Signal
@@ -59,12 +60,20 @@ def time_travel(offset: int) -> str:
     return f"sudo date -s `date --date='{offset} seconds' +@%s`"
 
 
-def kill(signal: Signal, pid_lst: int) -> str:
-    return f"sudo kill -{signal.value} {' '.join(map(str, pid_lst))}"
+def kill(signal: Signal, pid_lst: int, sudo: bool = True, count: bool = False) -> str:
+    prefix = "sudo " if sudo else ""
+    if count:
+        # kill_loopで合計するため,シグナルを送れたプロセスごとに1を出力する
+        return (
+            f"for pid in {' '.join(map(str, pid_lst))};"
+            f" do {prefix}kill -{signal.value} $pid && echo 1; done"
+        )
+    return f"{prefix}kill -{signal.value} {' '.join(map(str, pid_lst))}"
 
 
-def kill_children_by_pid(signal: Signal, pid_lst: List[int]) -> str:
-    return f"sudo pkill -{signal.value} -P {','.join(map(str, pid_lst))}"
+def kill_children_by_pid(signal: Signal, pid_lst: List[int], sudo: bool = True) -> str:
+    prefix = "sudo " if sudo else ""
+    return f"{prefix}pkill -{signal.value} -P {','.join(map(str, pid_lst))}"
 
 
 def pkill(
@@ -77,7 +86,12 @@ def pkill(
     exact: bool = False,
     full_match: bool = False,
     kill_children: bool = False,
+    sudo: bool = True,
+    count: bool = False,
 ) -> List[str]:
+    prefix = "sudo " if sudo else ""
+    # -cはプロセス名ごとにシグナルを送ったプロセスの数を出力させる
+    count_opt = " -c" if count else ""
     opt_lst = []
     if group:
         opt_lst.append("-G")
@@ -95,7 +109,7 @@ def pkill(
         opt_lst.append("-f")
     opts_str = " ".join(["", *opt_lst]) if opt_lst else ""
     cmd_lst = [
-        f"for pname in {' '.join(process_name_lst)}; do sudo pkill -{signal.value} $pname{opts_str}; done"
+        f"for pname in {' '.join(process_name_lst)}; do {prefix}pkill -{signal.value}{count_opt} $pname{opts_str}; done"
     ]
     if kill_children:
         cmd_lst.insert(
@@ -103,7 +117,27 @@ def pkill(
             (
                 f"for pname in {' '.join(process_name_lst)};"
                 f" do for pid in $(pgrep $pname{opts_str});"
-                f" do sudo pkill -{signal.value} -P $pid; done; done"
+                f" do {prefix}pkill -{signal.value} -P $pid; done; done"
             ),
         )
     return cmd_lst
+
+
+def kill_loop(
+    cmd_lst: List[str], interval: Union[int, float], length: Union[int, float]
+) -> str:
+    """プロセスキルをターゲット上でlength秒間繰り返すシェルを1つのコマンドとして組み立てる
+
+    cmd_lstの最後のコマンドが出力した数を合計し,ループの終了後に標準出力へ出力する.
+    cmd_lstにはsudoを付けず,count=Trueで作成したコマンドを渡すこと.
+    """
+    now_ms = "$(($(date +%s%N)/1000000))"
+    sleep = f"sleep {interval}; " if interval > 0 else ""
+    body = "".join(f"{cmd} 2>/dev/null; " for cmd in cmd_lst[:-1])
+    script = (
+        f"n=0; end=$(({now_ms}+{int(length * 1000)}));"
+        f" while :; do {sleep}{body}for c in $({cmd_lst[-1]} 2>/dev/null);"
+        " do n=$((n+c)); done;"
+        f" [ {now_ms} -ge $end ] && break; done; echo $n"
+    )
+    return f"sudo sh -c {shlex.quote(script)}"
@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class CommandResult:
+    """ターゲット上で実行したコマンドの結果
+
+    Attributes:
+        command (str): 実行したコマンド.
+        exit_status (int): 終了ステータス.
+        stdout (str): 標準出力.
+        stderr (str): 標準エラー出力.
+        duration (float): 実行にかかった時間(秒).
+        truncated (bool): 出力がサイズの上限を超え,古い出力が破棄された場合はTrue.
+    """
+
+    command: str
+    exit_status: int
+    stdout: str
+    stderr: str
+    duration: float
+    truncated: bool = False
+
+    def echo(self):
+        """標準出力と標準エラー出力を行ごとに[out]と[err]を付けて出力する"""
+        for out in self.stdout.splitlines(keepends=True):
+            print("[out]", out, end="")
+        for err in self.stderr.splitlines(keepends=True):
+            print("[err]", err, end="")
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class ExecMode(Enum):
+    exec = "exec"
+    batch = "batch"
+    agent = "agent"
@@ -0,0 +1,236 @@
+"""アクションを複数のターゲットへ並列に実行するためのデコレータ
+
+fan_outでデコレートしたアクションは,targetに単一のターゲットの代わりにターゲットのリストを渡すか,
+inventoryにインベントリファイルのパスを渡すことで,すべてのターゲットに対して並列に実行される.
+同時に実行するターゲット数はconcurrencyで制限でき,戻り値はホスト名をキーとしたホストごとの結果となる.
+ターゲットの不足やホスト名の重複は実行前に検証してValueErrorを送出し,実行中の例外はValueErrorを含めてそのホストの失敗として返す.
+
+インベントリファイルは以下のいずれかの形式のJSONファイル.
+ - ターゲットのリスト: [{"hostname": "host1", "username": "user", "key_filename": "/path/to/key"}, ...]
+ - defaultsとhostsを持つ辞書: {"defaults": {"username": "user", "key_filename": "/path/to/key"}, "hosts": ["host1", {"hostname": "host2", "username": "admin"}]}
+   hostsの要素がホスト名の文字列の場合はdefaultsにホスト名を加えたものが,辞書の場合はdefaultsを上書きしたものがターゲットになる.
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from beartype.typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+import plan
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_ASYNC_CONCURRENCY = 256
+
+
+def fan_out(func: Callable) -> Callable:
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        inventory = kwargs.pop("inventory", None)
+        concurrency = kwargs.pop("concurrency", DEFAULT_CONCURRENCY)
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        target = arguments.get("target")
+        if inventory is None and not isinstance(target, list):
+            return func(*args, **kwargs)
+        target_lst = __collect_targets(target, inventory, concurrency)
+
+        def run(target: Dict[str, str]):
+            return func(**{**arguments, "target": target})
+
+        return run_all(run, target_lst, concurrency)
+
+    wrapper.__signature__ = __extend_signature(signature, DEFAULT_CONCURRENCY)
+    return wrapper
+
+
+def fan_out_async(func: Callable) -> Callable:
+    """fan_outの非同期版
+
+    ターゲットごとのコルーチンを1つのイベントループ上で並列に実行するため,スレッドを必要としない.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        inventory = kwargs.pop("inventory", None)
+        concurrency = kwargs.pop("concurrency", DEFAULT_ASYNC_CONCURRENCY)
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        target = arguments.get("target")
+        if inventory is None and not isinstance(target, list):
+            return await func(*args, **kwargs)
+        target_lst = __collect_targets(target, inventory, concurrency)
+
+        async def run(target: Dict[str, str]):
+            return await func(**{**arguments, "target": target})
+
+        return await run_all_async(run, target_lst, concurrency)
+
+    wrapper.__signature__ = __extend_signature(signature, DEFAULT_ASYNC_CONCURRENCY)
+    return wrapper
+
+
+def run_all(
+    func: Callable[[Dict[str, str]], Any],
+    target_lst: List[Dict[str, str]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> Dict[str, Dict]:
+    """ターゲットごとにfuncを並列に実行し,ホスト名をキーとした結果を返す
+
+    funcが送出した例外はValueErrorを含めてそのターゲットの失敗として結果に記録し,他のターゲットの実行は続ける.
+    一部のターゲットで障害を設定できなかった場合でも,設定できたターゲットの結果を呼び出し側が参照してロールバックできる.
+
+    Args:
+        func (Callable[[Dict[str, str]], Any]): ターゲットを受け取って実行する関数.
+        target_lst (List[Dict[str, str]]): ターゲットのリスト.
+        concurrency (int, optional): 同時に実行するターゲット数の上限. Defaults to DEFAULT_CONCURRENCY.
+
+    Returns:
+        Dict[str, Dict]: ホスト名をキーとし,成功した場合は{"status": "succeeded", "result": 戻り値},
+        失敗した場合は{"status": "failed", "error": エラーメッセージ}を値とする辞書.
+
+    Raises:
+        ValueError: target_lstにホスト名が重複したターゲットがある場合
+    """
+    __check_hostnames(target_lst)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(target_lst))) as executor:
+        futures = {executor.submit(func, target): target for target in target_lst}
+
+    results = {}
+    for future, target in futures.items():
+        hostname = target.get("hostname", "")
+        error = future.exception()
+        if error is None:
+            results[hostname] = {"status": "succeeded", "result": future.result()}
+        else:
+            results[hostname] = {
+                "status": "failed",
+                "error": f"{type(error).__name__}: {error}",
+            }
+    return results
+
+
+async def run_all_async(
+    func: Callable[[Dict[str, str]], Awaitable],
+    target_lst: List[Dict[str, str]],
+    concurrency: int = DEFAULT_ASYNC_CONCURRENCY,
+) -> Dict[str, Dict]:
+    """run_allの非同期版
+
+    同時に実行するターゲット数はセマフォで制限する. 戻り値と例外の扱いはrun_allと同様.
+    """
+    __check_hostnames(target_lst)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(target: Dict[str, str]):
+        async with semaphore:
+            return await func(target)
+
+    tasks = [asyncio.ensure_future(run(target)) for target in target_lst]
+    try:
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    results = {}
+    for outcome, target in zip(outcomes, target_lst):
+        hostname = target.get("hostname", "")
+        if isinstance(outcome, BaseException):
+            results[hostname] = {
+                "status": "failed",
+                "error": f"{type(outcome).__name__}: {outcome}",
+            }
+        else:
+            results[hostname] = {"status": "succeeded", "result": outcome}
+    return results
+
+
+def load_inventory(path: str) -> List[Dict[str, str]]:
+    """インベントリファイルを読み込み,ターゲットのリストを返す
+
+    Args:
+        path (str): インベントリファイルのパス.
+
+    Raises:
+        ValueError: インベントリファイルの形式が不正な場合
+    """
+    with open(path) as f:
+        inventory = json.load(f)
+    if isinstance(inventory, list):
+        return inventory
+    if not isinstance(inventory, dict) or not isinstance(inventory.get("hosts"), list):
+        raise ValueError(f"Invalid inventory: {path}. 'hosts' must be a list.")
+    defaults = inventory.get("defaults", {})
+    target_lst = []
+    for host in inventory["hosts"]:
+        if isinstance(host, str):
+            target_lst.append({**defaults, "hostname": host})
+        else:
+            target_lst.append({**defaults, **host})
+    return target_lst
+
+
+def __collect_targets(
+    target: Union[Dict[str, str], List[Dict[str, str]], None],
+    inventory: Optional[str],
+    concurrency: int,
+) -> List[Dict[str, str]]:
+    if concurrency < 1:
+        raise ValueError(
+            "The argument 'concurrency' must be greater than or equal to 1"
+        )
+    target_lst = load_inventory(inventory) if inventory is not None else []
+    if isinstance(target, list):
+        target_lst.extend(target)
+    elif target is not None:
+        target_lst.append(target)
+    if not target_lst:
+        raise ValueError("The argument 'target' must not be empty.")
+    # fail before any target is touched rather than on some of them
+    for target in target_lst:
+        plan.to_target(target)
+    return target_lst
+
+
+def __check_hostnames(target_lst: List[Dict[str, str]]) -> None:
+    # the results are keyed by hostname
+    hostnames = set()
+    for target in target_lst:
+        hostname = target.get("hostname", "")
+        if hostname in hostnames:
+            raise ValueError(f"The hostname '{hostname}' is duplicated in targets.")
+        hostnames.add(hostname)
+
+
+def __extend_signature(
+    signature: inspect.Signature, concurrency: int
+) -> inspect.Signature:
+    params = [
+        (
+            p.replace(annotation=Union[Dict[str, str], List[Dict[str, str]]])
+            if p.name == "target"
+            else p
+        )
+        for p in signature.parameters.values()
+    ]
+    params.extend(
+        [
+            inspect.Parameter(
+                "inventory",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=None,
+                annotation=str,
+            ),
+            inspect.Parameter(
+                "concurrency",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=concurrency,
+                annotation=int,
+            ),
+        ]
+    )
+    return signature.replace(parameters=params)
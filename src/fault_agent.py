@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""ターゲット上でroot権限で動作し,障害を注入するコマンドを1つのSSHチャネル経由で受け付けるエージェント
+
+agent_client.pyによってターゲットへアップロードされ,`sudo python3 <path>`で起動される.
+ターゲットのpython3(3.6以上)の標準ライブラリのみで動作するよう,このファイルは他のモジュールをimportしない.
+
+標準入力から1行に1つのJSONのリクエストを受け取り,標準出力へ1行に1つのJSONのレスポンスを返す.
+リクエストはそれぞれ別のスレッドで処理するため,時間のかかるコマンドの実行中も他のリクエストに応答する.
+レスポンスは処理が終わった順に返すため,クライアントはidでリクエストと対応付ける.
+ - {"id": 1, "op": "run", "command": "tc qdisc show"}: /bin/sh -cでコマンドを実行し,exit_status, stdout, stderrを返す.
+ - {"id": 2, "op": "start", "command": "stress-ng -c 1"}: コマンドをバックグラウンドで起動し,停止に使うhandleを返す.
+ - {"id": 3, "op": "stop", "handle": 1234}: startで起動したコマンドをプロセスグループごと停止し,exit_status, stdout, stderrを返す.
+ - {"id": 4, "op": "ping"}: 何もせずに応答する.
+ - {"op": "shutdown"}: エージェントを終了する. 標準入力が閉じられた場合も同様に終了する.
+   startで起動したコマンドのうち,停止していないものは終了時に停止する.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+# seconds to wait for a stopped command to exit before it is killed
+STOP_TIMEOUT = 5
+
+PROCESSES = {}
+LOCK = threading.Lock()
+OUTPUT_LOCK = threading.Lock()
+
+
+def run(req):
+    proc = subprocess.Popen(
+        ["/bin/sh", "-c", req["command"]],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = proc.communicate()
+    return {
+        "exit_status": proc.returncode,
+        "stdout": stdout.decode(errors="replace"),
+        "stderr": stderr.decode(errors="replace"),
+    }
+
+
+def start(req):
+    # the output goes to files, so that a command writing a lot never blocks
+    # on a pipe nobody reads until it is stopped
+    stdout, stderr = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        ["/bin/sh", "-c", req["command"]],
+        stdin=subprocess.DEVNULL,
+        stdout=stdout,
+        stderr=stderr,
+        start_new_session=True,
+    )
+    with LOCK:
+        PROCESSES[proc.pid] = (proc, stdout, stderr)
+    return {"exit_status": 0, "stdout": "", "stderr": "", "handle": proc.pid}
+
+
+def stop(req):
+    with LOCK:
+        entry = PROCESSES.pop(req["handle"], None)
+    if entry is None:
+        raise ValueError("Unknown handle: {}".format(req["handle"]))
+    proc, stdout, stderr = entry
+    terminate(proc)
+    return {
+        "exit_status": proc.returncode,
+        "stdout": read(stdout),
+        "stderr": read(stderr),
+    }
+
+
+def ping(req):
+    return {"exit_status": 0, "stdout": "", "stderr": ""}
+
+
+HANDLERS = {"run": run, "start": start, "stop": stop, "ping": ping}
+
+
+def terminate(proc):
+    # the command was started in its own session, so the whole process group
+    # is signalled and no child of the shell is left behind
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if proc.poll() is not None:
+            return
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            proc.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def read(file):
+    file.seek(0)
+    data = file.read().decode(errors="replace")
+    file.close()
+    return data
+
+
+def handle(req):
+    try:
+        res = HANDLERS[req["op"]](req)
+    except Exception as error:
+        res = {"exit_status": -1, "stdout": "", "stderr": repr(error) + "\n"}
+    res["id"] = req.get("id")
+    respond(res)
+
+
+def main():
+    respond({"ready": True, "pid": os.getpid()})
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        req = json.loads(line)
+        if req.get("op") == "shutdown":
+            break
+        threading.Thread(target=handle, args=(req,), daemon=True).start()
+    with LOCK:
+        entries = list(PROCESSES.values())
+        PROCESSES.clear()
+    for proc, _, _ in entries:
+        terminate(proc)
+
+
+def respond(res):
+    with OUTPUT_LOCK:
+        sys.stdout.write(json.dumps(res) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
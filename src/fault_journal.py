@@ -0,0 +1,245 @@
+"""設定した障害をターゲット上のジャーナルに記録し,呼び出し側が引数を覚えていなくてもロールバックできるようにするためのモジュール
+
+障害を設定するコマンドの前にJournal.record()で作成したコマンドを実行し,ロールバックに必要な引数を
+ターゲット上のファイル(JOURNAL_DIR/<障害のID>)に書き込む(先行書き込み). 障害のロールバックはJournal.discard()で記録を削除する.
+設定の途中でコマンドが失敗した場合や呼び出し側が異常終了した場合でも記録は残るため,
+Journal.probe()で作成したコマンドの標準出力をJournal.parse()に渡せば,残っている障害とその引数がわかる.
+probe()はtcのレジストリとqdiscのスナップショットも同時に出力するため,1回の往復でロールバックに必要な情報がそろう.
+Journal.lease()で作成したコマンドは,指定した秒数の後に障害をロールバックするsystemdのタイマーをターゲット上に設定する.
+タイマーは記録と同じく障害のIDで識別し,Journal.discard()で記録とともに解除する.
+タイマーの期限はLEASE_DIR/<障害のID>に記録し,障害のIDが変わる場合はJournal.rearm()で残りの時間のタイマーを新しいIDで設定し直す.
+記録の削除はロールバックのコマンドが成功した場合だけおこなう. すでに削除されたものに対するエラー(GONE_ERRORS)は成功とみなすため,
+途中まで進んだロールバックを再び実行できる. Journal.gone()は実行結果の,Journal.gate()はターゲット上のスクリプトの判定に使う.
+"""
+
+import hashlib
+import json
+import shlex
+from dataclasses import dataclass, field
+
+from beartype.typing import Dict, List, Tuple
+from typing_extensions import Self
+
+from qdisc_snapshot import SNAPSHOT_DIR
+
+JOURNAL_DIR = f"{SNAPSHOT_DIR}/journal"
+# the deadline (epoch seconds) of each timer set by Journal.lease()
+LEASE_DIR = f"{SNAPSHOT_DIR}/lease"
+
+# marks the start of each file printed by Journal.probe()
+FILE_MARKER = "@@fit-file"
+
+# the errors of the rollback commands on what is already removed. They are
+# matched line by line as fixed strings, both here and by grep -F on the target
+GONE_ERRORS = (
+    "RTNETLINK answers: No such file or directory",
+    "We have an error talking to the kernel",
+    "Cannot delete qdisc with handle of zero",
+    "Cannot find specified qdisc",
+    "Specified class not found",
+    "Filter with specified priority/protocol not found",
+    'Cannot find device "',
+    "Command failed -:",
+    "Bad rule (does a matching rule exist in that chain?)",
+)
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """ジャーナルに記録した障害
+
+    Attributes:
+        fault_id (str): 障害のID. アクションの名前と引数から計算する.
+        time (int): ターゲット上で記録した時刻(ns).
+        action (str): 障害を設定したアクションの名前(traffic_control, traffic_block, time_travel).
+        arguments (Dict): ロールバックに必要なアクションの引数.
+    """
+
+    fault_id: str
+    time: int
+    action: str
+    arguments: Dict
+
+
+@dataclass(frozen=True)
+class Journal:
+    """ターゲット上のジャーナル
+
+    Attributes:
+        entries (Tuple[JournalEntry, ...]): 記録した時刻の新しい順に並べた障害.
+        files (Dict[str, str]): SNAPSHOT_DIRにあるtcのレジストリとスナップショットの,パスごとの内容.
+    """
+
+    entries: Tuple[JournalEntry, ...] = ()
+    files: Dict[str, str] = field(default_factory=dict)
+
+    @staticmethod
+    def fault_id(action: str, arguments: Dict) -> str:
+        """アクションの名前と引数から障害のIDを計算する"""
+        data = json.dumps(arguments, sort_keys=True).encode()
+        return f"{action}-{hashlib.sha1(data).hexdigest()[:16]}"
+
+    @staticmethod
+    def path(fault_id: str) -> str:
+        """障害の記録のターゲット上のパスを返す"""
+        return f"{JOURNAL_DIR}/{fault_id}"
+
+    @staticmethod
+    def record(fault_id: str, action: str, arguments: Dict) -> str:
+        """障害をジャーナルに記録するコマンドを返す
+
+        記録は一時ファイルに書き込んでから置き換えるため,途中で中断しても壊れた記録は残らない.
+        """
+        path = Journal.path(fault_id)
+        entry = json.dumps(
+            {"action": action, "arguments": arguments},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        script = (
+            f"mkdir -p {JOURNAL_DIR};"
+            f' printf "%s %s\\n" "$(date +%s%N)" {shlex.quote(entry)} > {path}.tmp'
+            f" && mv {path}.tmp {path}"
+        )
+        return f"sudo sh -c {shlex.quote(script)}"
+
+    @staticmethod
+    def unit(fault_id: str) -> str:
+        """障害をロールバックするsystemdのタイマーのユニット名を返す"""
+        return f"fit-lease-{fault_id}"
+
+    @staticmethod
+    def lease(fault_id: str, ttl: int, cmd_lst: List[str], done_lst: List[str]) -> str:
+        """ttl秒後にターゲット上でcmd_lstを実行して障害をロールバックするタイマーを設定するコマンドを返す
+
+        コントローラーとの接続が切れてもタイマーは動作する. 同じ障害のタイマーがすでにある場合は置き換える.
+        done_lst(記録の削除など)はcmd_lstがすべて成功した場合だけ実行する.
+        """
+        script = f"d=$(($(date +%s) + {ttl})); t={ttl}; " + Journal.__arm(
+            fault_id, cmd_lst, done_lst
+        )
+        return f"sudo sh -c {shlex.quote(script)}"
+
+    @staticmethod
+    def rearm(
+        fault_id: str, new_fault_id: str, cmd_lst: List[str], done_lst: List[str]
+    ) -> str:
+        """fault_idの障害のタイマーがある場合に,残りの時間の後にcmd_lstを実行するタイマーをnew_fault_idで設定するコマンドを返す
+
+        古いタイマーは解除しないため,続けてJournal.discard(fault_id)を実行する.
+        """
+        script = (
+            f"if [ -f {LEASE_DIR}/{fault_id} ]; then d=$(cat {LEASE_DIR}/{fault_id});"
+            ' t=$((d - $(date +%s))); [ "$t" -ge 1 ] || t=1; '
+            + Journal.__arm(new_fault_id, cmd_lst, done_lst)
+            + "; fi; true"
+        )
+        return f"sudo sh -c {shlex.quote(script)}"
+
+    @staticmethod
+    def gate(cmd_lst: List[str]) -> str:
+        """cmd_lstを実行し,GONE_ERRORS以外の理由で失敗したコマンドがあった場合はexit 1で終了するシェルスクリプトを返す
+
+        失敗したコマンドの標準エラー出力は最後にまとめて出力する. 後に続けたコマンドはすべて成功した場合だけ実行される.
+        """
+        lines = ["fit_err=$(mktemp); fit_out=$(mktemp)"]
+        for cmd in cmd_lst:
+            lines.extend(
+                [
+                    "{",
+                    cmd,
+                    '} 2>"$fit_out" || { fit_rc=$?; cat "$fit_out";'
+                    ' [ -s "$fit_out" ] || echo "exit status $fit_rc"; } >>"$fit_err"',
+                ]
+            )
+        patterns = " ".join(f"-e {shlex.quote(error)}" for error in GONE_ERRORS)
+        lines.extend(
+            [
+                'cat "$fit_err" >&2',
+                f'if grep -v -F {patterns} "$fit_err" | grep -q .; then',
+                'rm -f "$fit_err" "$fit_out"; exit 1',
+                "fi",
+                'rm -f "$fit_err" "$fit_out"',
+            ]
+        )
+        return "\n".join(lines)
+
+    @staticmethod
+    def gone(stderr: str) -> bool:
+        """失敗したロールバックのコマンドの標準エラー出力が,すでに削除されたものに対するエラーだけの場合にTrueを返す"""
+        lines = [line for line in stderr.splitlines() if line.strip()]
+        return bool(lines) and all(
+            any(error in line for error in GONE_ERRORS) for line in lines
+        )
+
+    @staticmethod
+    def __arm(fault_id: str, cmd_lst: List[str], done_lst: List[str]) -> str:
+        # sets the timer to fire after $t seconds, at the deadline $d
+        unit = Journal.unit(fault_id)
+        rollback = shlex.quote("\n".join([Journal.gate(cmd_lst), *done_lst]))
+        return (
+            f"systemctl stop {unit}.timer 2>/dev/null;"
+            f' mkdir -p {LEASE_DIR}; echo "$d" > {LEASE_DIR}/{fault_id};'
+            f" systemd-run --quiet --collect --unit={unit} --on-active=${{t}}s"
+            f" --timer-property=AccuracySec=1s /bin/sh -c {rollback}"
+        )
+
+    @staticmethod
+    def discard(fault_id: str) -> str:
+        """障害の記録を削除し,ロールバックのタイマーを解除するコマンドを返す"""
+        return (
+            f"sudo sh -c 'rm -f {Journal.path(fault_id)} {LEASE_DIR}/{fault_id};"
+            f" systemctl stop {Journal.unit(fault_id)}.timer 2>/dev/null; true'"
+        )
+
+    @staticmethod
+    def probe() -> str:
+        """ジャーナル,tcのレジストリとスナップショットを出力するコマンドを返す"""
+        return (
+            f"sudo sh -c 'for f in {JOURNAL_DIR}/* {SNAPSHOT_DIR}/tc-*; do"
+            f' [ -f "$f" ] && echo "{FILE_MARKER} $f" && cat "$f"; done; true\''
+        )
+
+    @staticmethod
+    def parse(output: str) -> Self:
+        """probe()で作成したコマンドの標準出力からジャーナルを作成する"""
+        files: Dict[str, str] = {}
+        path = None
+        for line in output.splitlines(keepends=True):
+            if line.startswith(f"{FILE_MARKER} "):
+                path = line[len(FILE_MARKER) + 1 :].strip()
+                files[path] = ""
+            elif path is not None:
+                files[path] += line
+        entries = []
+        for path, content in files.items():
+            if not path.startswith(f"{JOURNAL_DIR}/") or path.endswith(".tmp"):
+                continue
+            time, _, data = content.strip().partition(" ")
+            try:
+                entry = json.loads(data)
+                time = int(time)
+            except ValueError:
+                # an entry that is not written completely is left as it is
+                continue
+            entries.append(
+                JournalEntry(
+                    fault_id=path[len(JOURNAL_DIR) + 1 :],
+                    time=time,
+                    action=entry["action"],
+                    arguments=entry["arguments"],
+                )
+            )
+        entries.sort(key=lambda entry: entry.time, reverse=True)
+        return Journal(
+            entries=tuple(entries),
+            files={
+                path: content
+                for path, content in files.items()
+                if not path.startswith(f"{JOURNAL_DIR}/")
+            },
+        )
+
+    def file(self, path: str) -> str:
+        """probe()で出力したファイルの内容を返す. ファイルがない場合は空文字列を返す"""
+        return self.files.get(path, "")
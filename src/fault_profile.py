@@ -0,0 +1,122 @@
+"""時間とともに変化するネットワーク障害(プロファイル)をターゲット上で実行するためのモジュール
+
+loop()は各プロファイルの値の変化をawkで生成し,その時刻にtc qdisc changeでnetemの設定を変更するシェルを1つのコマンドとして組み立てる.
+変更ごとに1回SSHの往復をする必要がないため,1秒未満の間隔で値を変化させることができる.
+コマンドは変更ごとに経過時間(ms),tcの要素の番号,変化させるパラメータ,値,tcの終了ステータスを1行ずつ出力し,
+その標準出力をparse()に渡すと適用した値のタイムラインが得られる.
+
+プロファイルの形状(shape):
+    ramp: startからendまでlength秒かけて線形に変化する.
+    step: startからendまでsteps段階で階段状に変化する.
+    sine: startとendの間をperiod秒周期で正弦波状に往復する. startから始まり,周期の半分でendに達する.
+    random_walk: startから始まり,intervalごとにstep_size以内の値だけランダムに増減する. startとendの間に収まるよう制限する.
+"""
+
+import shlex
+
+from beartype.typing import Dict, List
+
+__FORMATS = {"latency": "%d", "loss": "%.3f"}
+
+
+def schedule(i: int, profile: Dict) -> str:
+    """i番目のtcの要素のプロファイルの値を時刻順に出力するawkの文を返す
+
+    Args:
+        i (int): tcの要素の番号.
+        profile (Dict): tc_schema.pyで正規化したプロファイル.
+
+    Returns:
+        str: "経過時間(ms) i パラメータ 値"の形式で1行ずつ出力するawkの文.
+    """
+    start = profile["start"]
+    end = profile["end"]
+    length = profile["length"]
+    interval = profile["interval"]
+    shape = profile["shape"]
+    init = f"srand({profile['seed']}); " if profile["seed"] is not None else "srand(); "
+    if shape == "ramp":
+        value = f"v = {start} + ({end} - {start}) * t / {length}"
+    elif shape == "step":
+        steps = profile["steps"]
+        value = (
+            f"k = int(t * {steps} / {length}); if (k > {steps - 1}) k = {steps - 1};"
+            f" v = {start} + ({end} - {start}) * k / {steps - 1}"
+        )
+    elif shape == "sine":
+        period = profile["period"] or length
+        value = (
+            f"v = {start} + ({end} - {start})"
+            f" * (1 - cos(2 * 3.141592653589793 * t / {period})) / 2"
+        )
+    else:
+        low, high = sorted((start, end))
+        step_size = profile["step_size"]
+        if step_size is None:
+            step_size = (high - low) / 10
+        init += f"v = {start}; "
+        value = (
+            f"if (n > 0) v += (2 * rand() - 1) * {step_size};"
+            f" if (v < {low}) v = {low}; if (v > {high}) v = {high}"
+        )
+    field = profile["field"]
+    if field == "latency":
+        value += "; v = int(v + 0.5)"
+    return (
+        f"{init}for (n = 0; n <= int({length} / {interval} + 1e-9); n++)"
+        f" {{ t = n * {interval}; {value};"
+        f' printf "%d {i} {field} {__FORMATS[field]}\\n", int(t * 1000 + 0.5), v }}'
+    )
+
+
+def loop(schedule_lst: List[str], changes: Dict[int, List[str]]) -> str:
+    """プロファイルの値をその時刻にtcで適用するシェルを1つのコマンドとして組み立てる
+
+    Args:
+        schedule_lst (List[str]): schedule()で作成したawkの文のリスト.
+        changes (Dict[int, List[str]]): tcの要素の番号ごとの,値を適用するコマンドのリスト. 値は${v}で参照する. sudoを付けないこと.
+
+    Returns:
+        str: ターゲット上で実行するコマンド.
+    """
+    now_ms = "$((($(date +%s%N) - start) / 1000000))"
+    cases = " ".join(
+        f"{i}) {'; '.join(f'{cmd} || rc=$?' for cmd in cmd_lst)};;"
+        for i, cmd_lst in changes.items()
+    )
+    script = (
+        f"start=$(date +%s%N); awk 'BEGIN {{ {' '.join(s + ';' for s in schedule_lst)} }}'"
+        " | sort -n -s -k1,1 | while read t i f v; do"
+        f" d=$((t - {now_ms}));"
+        " [ $d -gt 0 ] && sleep $((d / 1000)).$(printf %03d $((d % 1000)));"
+        f" rc=0; case $i in {cases} esac;"
+        f' echo "{now_ms} $i $f $v $rc"; done'
+    )
+    return f"sudo sh -c {shlex.quote(script)}"
+
+
+def parse(output: str) -> List[Dict]:
+    """loop()で作成したコマンドの標準出力をタイムラインに変換する
+
+    Args:
+        output (str): loop()で作成したコマンドの標準出力.
+
+    Returns:
+        List[Dict]: 値を適用した経過時間(time, 秒),tcの要素の番号(tc),パラメータ(field),値(value)とtcの終了ステータス(exit_status)のリスト.
+    """
+    timeline = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 5:
+            continue
+        time, i, field, value, exit_status = fields
+        timeline.append(
+            {
+                "time": int(time) / 1000,
+                "tc": int(i),
+                "field": field,
+                "value": float(value) if "." in value else int(value),
+                "exit_status": int(exit_status),
+            }
+        )
+    return timeline
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class Firewall(Enum):
+    iptables = "iptables"
+    nftables = "nftables"
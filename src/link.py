@@ -0,0 +1,64 @@
+"""ターゲットのネットワークデバイスのリンク速度,送信キュー数と平均パケットサイズを取得するためのモジュール
+
+Link.probe()で作成したコマンドをターゲット上で実行し,その標準出力をLink.parse()に渡して利用する.
+"""
+
+from dataclasses import dataclass
+
+from beartype.typing import Optional
+from typing_extensions import Self
+
+FALLBACK_RATE = "100gbit"
+DEFAULT_PACKET_SIZE = 1500
+
+
+@dataclass(frozen=True)
+class Link:
+    """ネットワークデバイスのリンク情報
+
+    Attributes:
+        speed (Optional[int]): リンク速度(Mbit/s). 取得できなかった場合はNone.
+        tx_queues (int): 送信キューの数.
+        packet_size (int): 送信済みのバイト数をパケット数で割った平均パケットサイズ(バイト). 送信済みのパケットがない場合はDEFAULT_PACKET_SIZE.
+    """
+
+    speed: Optional[int] = None
+    tx_queues: int = 1
+    packet_size: int = DEFAULT_PACKET_SIZE
+
+    @property
+    def rate(self) -> str:
+        """tcのrateに指定する値. リンク速度が不明な場合はFALLBACK_RATE"""
+        return f"{self.speed}mbit" if self.speed else FALLBACK_RATE
+
+    @staticmethod
+    def probe(device: str) -> str:
+        """リンク速度,送信キュー数,送信済みのバイト数とパケット数を空白区切りで出力するコマンドを返す"""
+        path = f"/sys/class/net/{device}"
+        return (
+            f'echo "$(cat {path}/speed 2>/dev/null || echo -1)'
+            f" $(ls -d {path}/queues/tx-* 2>/dev/null | wc -l)"
+            f' $(cat {path}/statistics/tx_bytes {path}/statistics/tx_packets 2>/dev/null)"'
+        )
+
+    @staticmethod
+    def parse(output: str) -> Self:
+        """probe()で作成したコマンドの標準出力からリンク情報を作成する"""
+        fields = output.split()
+        try:
+            speed = int(fields[0])
+        except (IndexError, ValueError):
+            speed = None
+        try:
+            tx_queues = int(fields[1])
+        except (IndexError, ValueError):
+            tx_queues = 1
+        try:
+            packet_size = int(fields[2]) // int(fields[3])
+        except (IndexError, ValueError, ZeroDivisionError):
+            packet_size = DEFAULT_PACKET_SIZE
+        return Link(
+            speed=speed if speed and speed > 0 else None,
+            tx_queues=max(tx_queues, 1),
+            packet_size=packet_size if packet_size > 0 else DEFAULT_PACKET_SIZE,
+        )
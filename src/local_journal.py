@@ -0,0 +1,128 @@
+"""設定した障害をコントローラー上の追記専用のジャーナルに記録するためのモジュール
+
+ターゲット上のジャーナル(fault_journal)と異なり,すべてのターゲットの障害を1つのファイルに記録するため,
+コントローラーが異常終了した場合でも,ロールバックされていない障害とそのターゲットをファイルから一覧できる.
+各行は1つのイベント(障害の設定またはロールバック)のJSONで,障害を設定するコマンドを実行する前に追記し,fsyncする.
+アクションはモジュール変数journalに記録する. journalを置き換えるとファイルのパスを変更でき,Noneにすると記録しない.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+
+from beartype.typing import Dict, List, Optional, Tuple
+
+from fault_journal import JournalEntry
+from target import Target
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".fit", "journal.jsonl")
+
+
+class LocalJournal:
+    """コントローラー上の追記専用のジャーナル
+
+    スレッドセーフであり,複数のスレッドから同時に記録できる.
+
+    Args:
+        path (str, optional): ジャーナルのファイルのパス. Defaults to DEFAULT_PATH.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.__lock = threading.Lock()
+
+    def record(
+        self,
+        target: Target,
+        action: str,
+        fault_id: str,
+        arguments: Dict,
+        cmd_lst: List[str],
+    ) -> None:
+        """障害の設定を記録する
+
+        Args:
+            target (Target): 障害を設定するターゲット.
+            action (str): 障害を設定するアクションの名前(traffic_control, traffic_block, time_travel).
+            fault_id (str): 障害のID.
+            arguments (Dict): ロールバックに必要なアクションの引数.
+            cmd_lst (List[str]): 障害を設定するコマンドのリスト.
+        """
+        self.__append(
+            {
+                "event": "inject",
+                "target": asdict(target),
+                "action": action,
+                "fault_id": fault_id,
+                "arguments": arguments,
+                "commands": cmd_lst,
+            }
+        )
+
+    def complete(self, target: Target, fault_id: str) -> None:
+        """障害のロールバックを記録する"""
+        self.__append(
+            {"event": "rollback", "target": asdict(target), "fault_id": fault_id}
+        )
+
+    def outstanding(self) -> Dict[Target, Tuple[JournalEntry, ...]]:
+        """ロールバックされていない障害を,ターゲットごとに記録した時刻の新しい順に返す
+
+        書き込みの途中で中断した行は読み飛ばす.
+        """
+        faults: Dict[Tuple[Target, str], JournalEntry] = {}
+        with self.__lock:
+            if not os.path.exists(self.path):
+                return {}
+            with open(self.path) as f:
+                lines = f.readlines()
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            key = (Target.from_(event["target"]), event["fault_id"])
+            # a fault injected again is rolled back once
+            faults.pop(key, None)
+            if event["event"] == "inject":
+                faults[key] = JournalEntry(
+                    fault_id=event["fault_id"],
+                    time=event["time"],
+                    action=event["action"],
+                    arguments=event["arguments"],
+                )
+        outstanding: Dict[Target, List[JournalEntry]] = {}
+        for (target, _), entry in faults.items():
+            outstanding.setdefault(target, []).append(entry)
+        return {
+            target: tuple(sorted(entries, key=lambda e: e.time, reverse=True))
+            for target, entries in outstanding.items()
+        }
+
+    def __append(self, event: Dict) -> None:
+        line = json.dumps({"time": time.time_ns(), **event}, separators=(",", ":"))
+        with self.__lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+journal: Optional[LocalJournal] = LocalJournal()
+
+
+def record(
+    target: Target, action: str, fault: Tuple[str, Dict], cmd_lst: List[str]
+) -> None:
+    """journalに障害の設定を記録する. faultは障害のIDと引数の組"""
+    if journal is not None:
+        journal.record(target, action, *fault, cmd_lst)
+
+
+def complete(target: Target, fault_id: str) -> None:
+    """journalに障害のロールバックを記録する"""
+    if journal is not None:
+        journal.complete(target, fault_id)
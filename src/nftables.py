@@ -0,0 +1,65 @@
+"""障害ごとの専用のnftablesのテーブルにルールを1つのトランザクションで設定するためのモジュール
+
+replace()は`nft -f`の入力でテーブルを作り直し,宛先IPアドレスやポートのセットとルールをまとめて設定する.
+nftは入力全体を1つのトランザクションとして適用するため,ルールの一部だけが適用された状態にならず,
+設定中の障害のルールを置き換える場合もパケットがどちらのルールにもマッチしない瞬間がない.
+セットはinterval型とするため,CIDRやポートの範囲を要素にでき,要素の数によらずパケットごとのマッチングが一定の時間で済む.
+ロールバックはdelete()でテーブルを削除するだけで,セットとルールも同時に削除される.
+"""
+
+from beartype.typing import Dict, List, Tuple
+
+import bulk
+
+FAMILY = "inet"
+
+
+def replace(
+    table: str,
+    hook: str,
+    priority: int,
+    sets: Dict[str, Tuple[str, List[str]]],
+    rules: List[str],
+) -> str:
+    """テーブルを作り直してセットとルールを設定するコマンドを返す
+
+    Args:
+        table (str): テーブルの名前.
+        hook (str): ルールを設定するチェインのフック. チェインの名前にも使う.
+        priority (int): チェインの優先度.
+        sets (Dict[str, Tuple[str, List[str]]]): セットの名前ごとの,要素の型と要素のリスト.
+        rules (List[str]): チェインに設定するルールのリスト.
+
+    Returns:
+        str: ターゲット上で実行するコマンド.
+    """
+    # adding the table first lets the delete succeed when it does not exist
+    lines = [
+        f"add table {FAMILY} {table}",
+        f"delete table {FAMILY} {table}",
+        f"table {FAMILY} {table} {{",
+    ]
+    for name, (type, elements) in sets.items():
+        lines.append(
+            f"  set {name} {{ type {type}; flags interval; auto-merge;"
+            f" elements = {{ {', '.join(elements)} }} }}"
+        )
+    lines.append(f"  chain {hook} {{")
+    lines.append(f"    type filter hook {hook} priority {priority}; policy accept;")
+    lines.extend(f"    {rule}" for rule in rules)
+    lines.append("  }")
+    lines.append("}")
+    return bulk.heredoc("sudo nft -f -", lines)
+
+
+def delete(table: str) -> str:
+    """テーブルをセットとルールごと削除するコマンドを返す
+
+    テーブルがすでに削除されている場合も失敗しない.
+    """
+    # as in replace(), adding the table first lets the delete succeed when it
+    # is already gone
+    return bulk.heredoc(
+        "sudo nft -f -",
+        [f"add table {FAMILY} {table}", f"delete table {FAMILY} {table}"],
+    )
@@ -0,0 +1,1708 @@
+"""アクションの引数を検証し,ターゲット上で実行するコマンドのリストを作成するためのモジュール
+
+同期版のaction.pyと非同期版のasync_action.pyはこのモジュールで作成したコマンドを実行する.
+各関数は対応するアクションと同じ名前を持ち,引数が不正な場合はValueErrorを送出する.
+"""
+
+import bisect
+import ipaddress
+import json
+import math
+import threading
+
+from beartype.typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+import bulk
+import command
+import fault_profile
+import nftables
+import tc_schema
+from classifier import Classifier
+from command_result import CommandResult
+from exec_mode import ExecMode
+from fault_journal import Journal
+from firewall import Firewall
+from io_mode import IOMode
+from iptables_action import IptablesAction
+from link import Link
+from qdisc_snapshot import QdiscSnapshot
+from signal_ import Signal
+from target import Target
+from tc_registry import Allocation
+
+# the limit netem uses when none is given
+__NETEM_DEFAULT_LIMIT = 1000
+
+# fields of a tc entry that only make sense together with another field
+__TC_DEPENDENCIES = {
+    "ceil": "rate",
+    "burst": "rate",
+    "jitter": "latency",
+    "distribution": "jitter",
+    "correlation": "jitter",
+    "reorder": "latency",
+}
+
+# faults on one device get slots 0 to 98 and every slot has its own range of
+# 100 class minors, netem handles and filter prios. The IDs are written as
+# decimal digits, which tc reads as hex, so they stay below ffff.
+__MAX_SLOTS = 99
+
+# the validator keeps the document it is working on in its own state, so the
+# actions fanned out to several targets must not use it at the same time
+__VALIDATOR_LOCK = threading.Lock()
+
+# the number of ports a single multiport match accepts, a range counting as two
+__MULTIPORT_MAX = 15
+
+# the priority of the netfilter mangle hooks, which CLASSIFY runs at. The
+# chain of a later slot runs after the earlier ones, so that its class wins
+# like an appended CLASSIFY rule does.
+__NFT_MANGLE_PRIORITY = -150
+
+# values that never appear in a rendered netem otherwise
+__PROFILE_PLACEHOLDERS = {"latency": 86400000, "loss": 99.999999}
+
+# bits per second of each rate unit accepted by tc
+__RATE_UNITS = {
+    "bit": 1,
+    "kbit": 1e3,
+    "mbit": 1e6,
+    "gbit": 1e9,
+    "tbit": 1e12,
+    "bps": 8,
+    "kbps": 8e3,
+    "mbps": 8e6,
+    "gbps": 8e9,
+    "tbps": 8e12,
+}
+
+
+def to_target(target: Dict[str, str]) -> Target:
+    try:
+        return Target.from_(target)
+    except KeyError as key:
+        raise ValueError(f"{key} is not found in target.")
+
+
+def to_exec_mode(exec_mode: str) -> ExecMode:
+    try:
+        return ExecMode(exec_mode)
+    except ValueError as error:
+        raise ValueError(
+            f"{error}. The argument 'exec_mode' must be chosen between {[m.value for m in ExecMode]}."
+        )
+
+
+def to_classifier(classifier: str, ipset: bool = False) -> Classifier:
+    try:
+        classifier = Classifier(classifier)
+    except ValueError as error:
+        raise ValueError(
+            f"{error}. The argument 'classifier' must be chosen between {[c.value for c in Classifier]}."
+        )
+    if ipset and classifier != Classifier.iptables:
+        raise ValueError(
+            f"The argument 'ipset' cannot be used with the classifier '{classifier.value}'."
+        )
+    return classifier
+
+
+def to_firewall(firewall: str, ipset: bool = False) -> Firewall:
+    try:
+        firewall = Firewall(firewall)
+    except ValueError as error:
+        raise ValueError(
+            f"{error}. The argument 'firewall' must be chosen between {[f.value for f in Firewall]}."
+        )
+    if ipset and firewall != Firewall.iptables:
+        raise ValueError(
+            f"The argument 'ipset' cannot be used with the firewall '{firewall.value}'."
+        )
+    return firewall
+
+
+def to_signal(signal: str) -> Signal:
+    try:
+        return Signal(signal)
+    except ValueError as error:
+        raise ValueError(
+            f"{error}. The argument 'signal' must be chosen between {[s.value for s in Signal]}."
+        )
+
+
+def inject_cpu_stress(cores: int, percent: int, length: int) -> List[str]:
+    if cores < 1:
+        raise ValueError("The argument 'cores' must be greater than or equal to 1")
+    if percent not in range(0, 101):
+        raise ValueError("The argument 'percent' must be between 0 and 100")
+    return [command.cpu_stress(cores=cores, percent=percent, length=length)]
+
+
+def inject_memory_stress(mb: int, gb: int, percentage: int, length: int) -> List[str]:
+    if mb is not None:
+        if mb < 1:
+            raise ValueError("The argument 'mb' must be greater than or equal to 1")
+        cmd = command.memory_stress(size=f"{mb}m", length=length)
+    elif gb is not None:
+        if gb < 1:
+            raise ValueError("The argument 'gb' must be greater than or equal to 1")
+        cmd = command.memory_stress(size=f"{gb}g", length=length)
+    elif percentage:
+        if percentage not in range(0, 101):
+            raise ValueError("The argument 'percentage' must be between 0 and 100")
+        cmd = command.memory_stress(size=f"{percentage}%", length=length)
+    return [cmd]
+
+
+def inject_disk_stress(
+    dir: str, workers: int, block_size: int, volume_percentage: int, length: int
+) -> List[str]:
+    if workers < 1:
+        raise ValueError("The argument 'workers' must be greater than or equal to 1")
+    if block_size < 1:
+        raise ValueError("The argument 'block_size' must be greater than or equal to 1")
+    if volume_percentage not in range(1, 101):
+        raise ValueError("The argument 'volume_percentage' must be between 1 and 100")
+    return [
+        command.disk_stress(
+            dir=dir,
+            workers=workers,
+            block_size=block_size,
+            volume_percentage=volume_percentage,
+            length=length,
+        )
+    ]
+
+
+def inject_io_stress(
+    dir: str, workers: int, mode: str, block_size: int, block_count: int, length: int
+) -> List[str]:
+    if workers < 1:
+        raise ValueError("The argument 'workers' must be greater than or equal to 1")
+    try:
+        mode = IOMode[mode]
+    except KeyError as key:
+        msg = (
+            f"Invalid input: {key}."
+            f" The argument 'mode' must be chosen between {[s.name for s in IOMode]}."
+        )
+        raise ValueError(msg)
+    if block_size < 1:
+        raise ValueError("The argument 'block_size' must be greater than or equal to 1")
+    if block_count < 1:
+        raise ValueError(
+            "The argument 'block_count' must be greater than or equal to 1"
+        )
+    return [
+        command.io_stress(
+            dir=dir,
+            workers=workers,
+            mode=mode,
+            block_size=block_size,
+            block_count=block_count,
+            length=length,
+        )
+    ]
+
+
+def inject_os_shutdown(delay: int, reboot: bool) -> List[str]:
+    if delay < 0:
+        raise ValueError("The argument 'delay' must be greater than or equal to 0")
+    return [command.os_shutdown(delay=delay, reboot=reboot)]
+
+
+def inject_time_travel(
+    disable_ntp: bool, offset: int, ttl: Optional[int] = None
+) -> List[str]:
+    cmd_lst = [command.time_travel(offset=offset)]
+    if disable_ntp:
+        cmd_lst.insert(0, "sudo iptables -A OUTPUT -p udp --dport 123 -j DROP")
+    fault_id, arguments = time_travel_fault(disable_ntp)
+    record = Journal.record(fault_id, "time_travel", arguments)
+    lease_lst = __lease(fault_id, ttl, *rollback_time_travel(disable_ntp))
+    return [record] + lease_lst + cmd_lst
+
+
+def time_travel_fault(disable_ntp: bool) -> Tuple[str, Dict]:
+    # the clock of a host can only be moved once, so the fault has a fixed ID
+    return "time_travel", {"disable_ntp": disable_ntp}
+
+
+def __lease(
+    fault_id: str, ttl: Optional[int], cmd_lst: List[str], done_lst: List[str]
+) -> List[str]:
+    if ttl is None:
+        return []
+    if ttl < 1:
+        raise ValueError("The argument 'ttl' must be greater than or equal to 1")
+    # the timer is set before the fault is applied, so that it also reverts
+    # a fault whose injection was interrupted
+    return [Journal.lease(fault_id, ttl, cmd_lst, done_lst)]
+
+
+def rollback_time_travel(enable_ntp: bool) -> Tuple[List[str], List[str]]:
+    # the commands to roll the fault back, and the commands to run once they
+    # all succeeded. The record is kept when the rollback failed, so that the
+    # fault can be rolled back again from the journal
+    cmd_lst = ["sudo chronyc -a makestep"]
+    if enable_ntp:
+        cmd_lst.insert(0, "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP")
+    return cmd_lst, [Journal.discard("time_travel")]
+
+
+def inject_process_kill(
+    pid_lst: List[int],
+    signal: str,
+    kill_children: bool,
+    sudo: bool = True,
+    count: bool = False,
+) -> List[str]:
+    if not pid_lst:
+        raise ValueError("The argument 'pid_lst' must not be empty.")
+    signal = to_signal(signal)
+    cmd_lst = [command.kill(signal=signal, pid_lst=pid_lst, sudo=sudo, count=count)]
+    if kill_children:
+        cmd_lst.insert(
+            0, command.kill_children_by_pid(signal=signal, pid_lst=pid_lst, sudo=sudo)
+        )
+    return cmd_lst
+
+
+def inject_process_pkill(
+    process_name_lst: List[str],
+    signal: str,
+    group: str,
+    user: str,
+    newest: bool,
+    oldest: bool,
+    exact: bool,
+    kill_children: bool,
+    full_match: bool,
+    sudo: bool = True,
+    count: bool = False,
+) -> List[str]:
+    if not process_name_lst:
+        raise ValueError("The argument 'process_name_lst' must not be empty.")
+    if newest and oldest:
+        raise ValueError("'newest' flag cannot be used with 'oldest' flag.")
+    return command.pkill(
+        signal=to_signal(signal),
+        process_name_lst=process_name_lst,
+        group=group,
+        user=user,
+        newest=newest,
+        oldest=oldest,
+        exact=exact,
+        full_match=full_match,
+        kill_children=kill_children,
+        sudo=sudo,
+        count=count,
+    )
+
+
+def normalize_traffic_control_params(params: Dict) -> Dict:
+    v = tc_schema.validator
+    with __VALIDATOR_LOCK:
+        if not v.validate(params):
+            raise ValueError(f"Validate arguments is failed: {v.errors}")
+        params = v.normalized(params)
+    for i, tc in enumerate(params["tc"]):
+        profile = tc["profile"]
+        if profile:
+            # the fault starts from the first value of the profile
+            tc[profile["field"]] = profile["start"]
+        __validate_tc(i, tc)
+    return params
+
+
+def __validate_tc(i: int, tc: Dict):
+    for key, required in __TC_DEPENDENCIES.items():
+        if tc[key] is not None and not tc[required]:
+            raise ValueError(f"The field '{key}' of tc[{i}] requires '{required}'.")
+    if tc["ceil"] and __to_bps(tc["ceil"]) < __to_bps(tc["rate"]):
+        raise ValueError(
+            f"The field 'ceil' of tc[{i}] must be greater than or equal to 'rate'."
+        )
+    profile = tc["profile"]
+    if profile and profile["field"] == "loss":
+        if max(profile["start"], profile["end"]) > 100:
+            raise ValueError(
+                f"The field 'profile' of tc[{i}] must stay within 100% of loss."
+            )
+    slot = tc["slot"]
+    if slot and (slot.get("max_delay") or slot["min_delay"]) < slot["min_delay"]:
+        raise ValueError(
+            f"The field 'slot.max_delay' of tc[{i}] must be greater than or equal to 'slot.min_delay'."
+        )
+
+
+def __to_bps(rate: str) -> float:
+    number = rate.rstrip("kmgtbitps")
+    return float(number) * __RATE_UNITS[rate[len(number) :]]
+
+
+def inject_traffic_control(
+    params: Dict,
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    link: Link = Link(),
+    allocation: Allocation = Allocation(),
+    ttl: Optional[int] = None,
+) -> List[str]:
+    classifier = to_classifier(classifier, ipset)
+    params = normalize_traffic_control_params(params)
+    # the fault is recorded before any of it is applied, so that a partial
+    # injection can be rolled back from the journal as well
+    record = __traffic_control_record(params, atomic, ipset, classifier)
+    fault_id = Journal.fault_id("traffic_control", params)
+    lease_lst = __lease(
+        fault_id,
+        ttl,
+        *__traffic_control_expiry(params, atomic, ipset, classifier, allocation),
+    )
+    return (
+        [record]
+        + lease_lst
+        + __inject_traffic_control(params, atomic, classifier, link, allocation, ipset)
+    )
+
+
+def traffic_control_fault(
+    params: Dict,
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+) -> Tuple[str, Dict]:
+    classifier = to_classifier(classifier, ipset)
+    params = normalize_traffic_control_params(params)
+    return __traffic_control_fault(params, atomic, ipset, classifier)
+
+
+def __traffic_control_fault(
+    params: Dict, atomic: bool, ipset: bool, classifier: Classifier
+) -> Tuple[str, Dict]:
+    arguments = {
+        "params": params,
+        "atomic": atomic,
+        "ipset": ipset,
+        "classifier": classifier.value,
+    }
+    return Journal.fault_id("traffic_control", params), arguments
+
+
+def __traffic_control_expiry(
+    params: Dict,
+    atomic: bool,
+    ipset: bool,
+    classifier: Classifier,
+    allocation: Allocation,
+) -> Tuple[List[str], List[str]]:
+    # the commands of the timer. Other faults may be injected or rolled back
+    # before it fires, so whether this fault is the last one on the device is
+    # decided on the target from the registry then. The saved qdiscs cannot
+    # be parsed on the target, so the last fault leaves the default qdisc of
+    # the kernel
+    device = params["device"]
+    return (
+        [
+            Allocation.release_with(
+                device,
+                Allocation.key(params),
+                __rollback_shared(params, atomic, ipset, classifier, allocation),
+                __rollback_last(
+                    params, atomic, ipset, classifier, QdiscSnapshot(), allocation.slot
+                ),
+            )
+        ],
+        [Journal.discard(Journal.fault_id("traffic_control", params))],
+    )
+
+
+def __traffic_control_record(
+    params: Dict, atomic: bool, ipset: bool, classifier: Classifier
+) -> str:
+    fault_id, arguments = __traffic_control_fault(params, atomic, ipset, classifier)
+    return Journal.record(fault_id, "traffic_control", arguments)
+
+
+def __inject_traffic_control(
+    params: Dict,
+    atomic: bool,
+    classifier: Classifier,
+    link: Link,
+    allocation: Allocation,
+    ipset: bool,
+) -> List[str]:
+    device = params["device"]
+    tc_lst = params["tc"]
+    trees = __htb_trees(tc_lst, classifier, link)
+    __check_allocation(device, __tree_name(trees), allocation)
+    slot = allocation.slot
+    fault_id = Journal.fault_id("traffic_control", params)
+    if not trees:
+        # every packet is affected, so netem can be the root qdisc without
+        # any classification
+        netem = __netem(tc_lst[0], link)
+        cmd_lst = [QdiscSnapshot.save(device)]
+        if link.tx_queues == 1:
+            cmd_lst.append(f"sudo tc qdisc add dev {device} handle 10: root {netem}")
+        else:
+            cmd_lst.append(f"sudo tc qdisc add dev {device} handle 10: root mq")
+            cmd_lst.extend(
+                f"sudo tc qdisc add dev {device} parent 10:{q:x} {netem}"
+                for q in range(1, link.tx_queues + 1)
+            )
+        return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+    set_lines = []
+    nft_sets = {}
+    nft_rules = []
+
+    def classify(i: int, tc: Dict, id: str) -> List[str]:
+        if classifier == Classifier.flower:
+            prio = __prio(slot, tc_lst, i)
+            return __generate_traffic_control_filters(device, tc, id, prio)
+        if classifier == Classifier.nftables:
+            # the rules of all entries are applied together once the classes
+            # exist
+            sets, rules = __nft_classify_rules(device, i, tc, id)
+            nft_sets.update(sets)
+            nft_rules.extend(rules)
+            return []
+        set_name = __set_name(fault_id, i) if ipset else None
+        if set_name:
+            set_lines.extend(
+                __ipset_create_lines(
+                    set_name,
+                    tc["destination_ip_addresses"],
+                    tc["destination_ports"],
+                    tc["source_ports"],
+                )
+            )
+        return __generate_traffic_control_rules(
+            IptablesAction.Append,
+            tc,
+            id,
+            set_name,
+        )
+
+    # the root qdiscs and the default classes are shared by all faults on
+    # the device and built by the first one
+    shared = bool(allocation.others)
+    cmd_lst = []
+    if not shared and trees[0][0] != "root":
+        cmd_lst.append(f"sudo tc qdisc add dev {device} handle 10: root mq")
+    for parent, major in trees:
+        cmd_lst.extend(
+            __htb_tree(
+                device, tc_lst, parent, major, link, classify, slot, root=not shared
+            )
+        )
+    if nft_rules:
+        cmd_lst.append(__nft_classify_table(device, slot, nft_sets, nft_rules))
+    if set_lines:
+        cmd_lst.insert(0, __ipset_restore(set_lines))
+    if not shared:
+        cmd_lst.insert(0, QdiscSnapshot.save(device))
+    return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+
+def traffic_control_tree(
+    params: Dict, classifier: str = "iptables", link: Link = Link()
+) -> str:
+    classifier = to_classifier(classifier)
+    tc_lst = normalize_traffic_control_params(params)["tc"]
+    return __tree_name(__htb_trees(tc_lst, classifier, link))
+
+
+def __tree_name(trees: List[Tuple[str, str]]) -> str:
+    # the name recorded in the registry: the majors of the HTBs, or "root"
+    # when netem is the root qdisc
+    return ",".join(major for _, major in trees) or "root"
+
+
+def __check_allocation(device: str, tree: str, allocation: Allocation):
+    if allocation.slot >= __MAX_SLOTS:
+        raise ValueError(
+            f"The device '{device}' cannot have more than {__MAX_SLOTS} traffic control faults."
+        )
+    if allocation.others and (
+        tree == "root" or any(other != tree for other in allocation.others)
+    ):
+        raise ValueError(
+            f"The device '{device}' already has a traffic control fault that cannot share its qdisc tree."
+        )
+
+
+def __class_minor(slot: int, i: int) -> str:
+    return str(10 + 100 * slot + i)
+
+
+def __netem_handle(slot: int, i: int) -> str:
+    return str(100 + 100 * slot + i)
+
+
+def __prio(slot: int, tc_lst: List[Dict], i: int) -> int:
+    # tc filters are matched in ascending order of prio and the first match
+    # wins, whereas the last matching CLASSIFY rule wins. The prios are even,
+    # so that the odd one below each is free while its filters are replaced
+    return 2 * (100 * slot + len(tc_lst) - i)
+
+
+def __set_name(fault_id: str, i: int) -> str:
+    # the ID of the fault is derived from its parameters including the
+    # device, so the sets of faults on different devices never collide
+    return f"fit-tc-{__fault_digest(fault_id)}-{i}"
+
+
+def __htb_trees(
+    tc_lst: List[Dict], classifier: Classifier, link: Link
+) -> List[Tuple[str, str]]:
+    # the parent and the major number of each HTB, or none when netem is the
+    # root qdisc
+    if __is_single_unfiltered(tc_lst):
+        return []
+    shaped = any(tc["rate"] for tc in tc_lst)
+    if classifier == Classifier.flower and link.tx_queues > 1 and not shaped:
+        # give every TX queue its own HTB so that the queues do not contend
+        # for the lock of a single root qdisc. CLASSIFY can only address one
+        # qdisc, so the iptables classifier keeps a single HTB root, and a
+        # bandwidth limit has to be shared by all queues in a single HTB.
+        return [
+            (f"parent 10:{q:x}", f"{0x100 + q:x}") for q in range(1, link.tx_queues + 1)
+        ]
+    return [("root", "10")]
+
+
+def __htb_tree(
+    device: str,
+    tc_lst: List[Dict],
+    parent: str,
+    major: str,
+    link: Link,
+    classify: Callable[[int, Dict, str], List[str]],
+    slot: int = 0,
+    root: bool = True,
+) -> List[str]:
+    # add the root qdisc and the default class
+    cmd_lst = []
+    if root:
+        cmd_lst = [
+            f"sudo tc qdisc add dev {device} handle {major}: {parent} htb default 1",
+            f"sudo tc class add dev {device} parent {major}: classid {major}:1 htb rate {link.rate}",
+        ]
+
+    # add network emulator rules
+    for i, tc in enumerate(tc_lst):
+        id = f"{major}:{__class_minor(slot, i)}"
+        cmd_lst.append(
+            f"sudo tc class add dev {device} parent {major}: classid {id} {__htb(tc, link)}"
+        )
+        # netem qdiscs under a per-queue HTB are not referenced later, so the
+        # kernel is left to choose their handles
+        handle = f" handle {__netem_handle(slot, i)}:" if major == "10" else ""
+        cmd_lst.append(
+            f"sudo tc qdisc add dev {device} parent {id}{handle} {__netem(tc, link)}"
+        )
+        cmd_lst.extend(classify(i, tc, id))
+    return cmd_lst
+
+
+def update_traffic_control(
+    params: Dict,
+    new_params: Dict,
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    link: Link = Link(),
+    allocation: Allocation = Allocation(),
+) -> List[str]:
+    classifier = to_classifier(classifier, ipset)
+    params = normalize_traffic_control_params(params)
+    new_params = normalize_traffic_control_params(new_params)
+    slot = allocation.slot
+    device = params["device"]
+    old_lst = params["tc"]
+    new_lst = new_params["tc"]
+    if new_params["device"] != device or len(new_lst) != len(old_lst):
+        raise ValueError(
+            "The argument 'new_params' must have the same device and the same number of tc entries as 'params'."
+        )
+    trees = __htb_trees(old_lst, classifier, link)
+    if __htb_trees(new_lst, classifier, link) != trees:
+        raise ValueError(
+            "The argument 'new_params' cannot change the qdisc tree built for 'params'."
+        )
+    # the registry has to find the fault by the new parameters afterwards
+    key, new_key = Allocation.key(params), Allocation.key(new_params)
+    fault_id = Journal.fault_id("traffic_control", params)
+    new_fault_id = Journal.fault_id("traffic_control", new_params)
+    rename_lst = []
+    if key != new_key:
+        expiry = __traffic_control_expiry(
+            new_params, atomic, ipset, classifier, allocation
+        )
+        rename_lst = [
+            Allocation.rename(device, key, new_key),
+            __traffic_control_record(new_params, atomic, ipset, classifier),
+            # the timer of the old ID is stopped by discarding it
+            Journal.rearm(fault_id, new_fault_id, *expiry),
+            Journal.discard(fault_id),
+        ]
+    if not trees:
+        netem = __netem(new_lst[0], link)
+        if netem == __netem(old_lst[0], link):
+            return rename_lst
+        cmd_lst = __netem_changes(device, trees, link, slot, 0, netem) + rename_lst
+        return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+    cmd_lst = []
+    for _, major in trees:
+        for i, (old, new) in enumerate(zip(old_lst, new_lst)):
+            id = f"{major}:{__class_minor(slot, i)}"
+            htb = __htb(new, link)
+            if htb != __htb(old, link):
+                cmd_lst.append(
+                    f"sudo tc class change dev {device} parent {major}: classid {id} {htb}"
+                )
+            netem = __netem(new, link)
+            if netem != __netem(old, link):
+                cmd_lst.extend(
+                    __netem_changes(device, [(None, major)], link, slot, i, netem)
+                )
+            if classifier != Classifier.flower:
+                continue
+            prio = __prio(slot, old_lst, i)
+            filters = __generate_traffic_control_filters(device, new, id, prio)
+            if filters != __generate_traffic_control_filters(device, old, id, prio):
+                # the filters of an entry share one prio, so they are replaced
+                # together. The new ones are added at the free prio matched
+                # just before it first, so the traffic is never unclassified
+                cmd_lst.extend(
+                    __generate_traffic_control_filters(device, new, id, prio - 1)
+                )
+                cmd_lst.append(
+                    f"sudo tc filter del dev {device} parent {major}: prio {prio}"
+                )
+                cmd_lst.extend(filters)
+                cmd_lst.append(
+                    f"sudo tc filter del dev {device} parent {major}: prio {prio - 1}"
+                )
+    if classifier == Classifier.flower:
+        cmd_lst.extend(rename_lst)
+        return bulk.bundle(cmd_lst) if atomic else cmd_lst
+    if classifier == Classifier.nftables:
+        # the table is replaced in one transaction, so the traffic which
+        # stays matched is never left unclassified
+        table = __nft_classify_table(
+            device, slot, *__nft_classify_all(device, new_lst, slot)
+        )
+        if table != __nft_classify_table(
+            device, slot, *__nft_classify_all(device, old_lst, slot)
+        ):
+            cmd_lst.append(table)
+        cmd_lst.extend(rename_lst)
+        return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+    set_lines = []
+    destroy_lines = []
+    append_lst = []
+    delete_lst = []
+    for i, (old, new) in enumerate(zip(old_lst, new_lst)):
+        id = f"10:{__class_minor(slot, i)}"
+        set_name = __set_name(fault_id, i) if ipset else None
+        new_set_name = __set_name(new_fault_id, i) if ipset else None
+        if set_name and new_set_name != set_name:
+            # the sets are named after the fault, so the new ones are filled
+            # before the rules switch to them and the old ones are destroyed
+            # once no rule references them
+            set_lines.extend(__ipset_create_lines(new_set_name, *__set_values(new)))
+            destroy_lines.extend(__ipset_destroy_lines(set_name, *__set_values(old)))
+        old_rules = __generate_traffic_control_rules(
+            IptablesAction.Append, old, id, set_name
+        )
+        new_rules = __generate_traffic_control_rules(
+            IptablesAction.Append, new, id, new_set_name
+        )
+        append_lst.extend(rule for rule in new_rules if rule not in old_rules)
+        delete_lst.extend(
+            rule
+            for rule, appended in zip(
+                __generate_traffic_control_rules(
+                    IptablesAction.Delete, old, id, set_name
+                ),
+                old_rules,
+            )
+            if appended not in new_rules
+        )
+    # the new rules are appended before the stale ones are deleted so that
+    # the traffic which stays matched is never left unclassified
+    cmd_lst.extend(append_lst)
+    cmd_lst.extend(delete_lst)
+    if set_lines:
+        cmd_lst.insert(0, __ipset_restore(set_lines))
+    if destroy_lines:
+        cmd_lst.append(__ipset_restore(destroy_lines))
+    cmd_lst.extend(rename_lst)
+    return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+
+def traffic_control_profile(
+    params: Dict,
+    classifier: str = "iptables",
+    link: Link = Link(),
+    allocation: Allocation = Allocation(),
+) -> Optional[str]:
+    classifier = to_classifier(classifier)
+    params = normalize_traffic_control_params(params)
+    device = params["device"]
+    tc_lst = params["tc"]
+    trees = __htb_trees(tc_lst, classifier, link)
+    schedule_lst = []
+    changes = {}
+    for i, tc in enumerate(tc_lst):
+        profile = tc["profile"]
+        if not profile:
+            continue
+        field = profile["field"]
+        # render the netem of the entry with a placeholder value and let the
+        # shell substitute each value of the profile
+        placeholder = __PROFILE_PLACEHOLDERS[field]
+        netem = __netem({**tc, field: placeholder}, link)
+        netem = netem.replace(str(placeholder), "${v}")
+        schedule_lst.append(fault_profile.schedule(i, profile))
+        changes[i] = __netem_changes(
+            device, trees, link, allocation.slot, i, netem, sudo=False
+        )
+    if not schedule_lst:
+        return None
+    return fault_profile.loop(schedule_lst, changes)
+
+
+def __netem_changes(
+    device: str,
+    trees: List[Tuple[str, str]],
+    link: Link,
+    slot: int,
+    i: int,
+    netem: str,
+    sudo: bool = True,
+) -> List[str]:
+    prefix = "sudo " if sudo else ""
+    if not trees:
+        if link.tx_queues == 1:
+            return [f"{prefix}tc qdisc change dev {device} handle 10: root {netem}"]
+        return [
+            f"{prefix}tc qdisc change dev {device} parent 10:{q:x} {netem}"
+            for q in range(1, link.tx_queues + 1)
+        ]
+    cmd_lst = []
+    for _, major in trees:
+        handle = f" handle {__netem_handle(slot, i)}:" if major == "10" else ""
+        cmd_lst.append(
+            f"{prefix}tc qdisc change dev {device} parent {major}:{__class_minor(slot, i)}{handle} {netem}"
+        )
+    return cmd_lst
+
+
+def rollback_traffic_control(
+    params: Dict,
+    atomic: bool = False,
+    ipset: bool = False,
+    classifier: str = "iptables",
+    snapshot: QdiscSnapshot = QdiscSnapshot(),
+    allocation: Allocation = Allocation(),
+) -> Tuple[List[str], List[str]]:
+    classifier = to_classifier(classifier, ipset)
+    params = normalize_traffic_control_params(params)
+    cmd_lst = __rollback_traffic_control(
+        params, atomic, ipset, classifier, snapshot, allocation
+    )
+    # the slot is released only once the fault is removed, so that a failed
+    # rollback is tried again with the classes and the rules of this slot
+    return cmd_lst, [
+        Allocation.release(params["device"], Allocation.key(params)),
+        Journal.discard(Journal.fault_id("traffic_control", params)),
+    ]
+
+
+def __rollback_traffic_control(
+    params: Dict,
+    atomic: bool,
+    ipset: bool,
+    classifier: Classifier,
+    snapshot: QdiscSnapshot,
+    allocation: Allocation,
+) -> List[str]:
+    if allocation.others:
+        return __rollback_shared(params, atomic, ipset, classifier, allocation)
+    return __rollback_last(params, atomic, ipset, classifier, snapshot, allocation.slot)
+
+
+def __rollback_shared(
+    params: Dict,
+    atomic: bool,
+    ipset: bool,
+    classifier: Classifier,
+    allocation: Allocation,
+) -> List[str]:
+    # the other faults keep the root qdiscs, so only the classes of this
+    # fault are removed
+    cmd_lst = __rollback_classes(
+        Journal.fault_id("traffic_control", params),
+        params["device"],
+        params["tc"],
+        ipset,
+        classifier,
+        allocation.tree,
+        allocation.slot,
+    )
+    return bulk.bundle(cmd_lst, force=True) if atomic else cmd_lst
+
+
+def __rollback_last(
+    params: Dict,
+    atomic: bool,
+    ipset: bool,
+    classifier: Classifier,
+    snapshot: QdiscSnapshot,
+    slot: int,
+) -> List[str]:
+    device = params["device"]
+    tc_lst = params["tc"]
+    fault_id = Journal.fault_id("traffic_control", params)
+    # tc filters are removed together with the root qdisc, and the nftables
+    # rules together with their table
+    if __is_single_unfiltered(tc_lst) or classifier != Classifier.iptables:
+        cmd_lst = []
+        if classifier == Classifier.nftables and not __is_single_unfiltered(tc_lst):
+            cmd_lst.append(nftables.delete(__nft_table("fit-tc", device, slot)))
+        cmd_lst.append(f"sudo tc qdisc del dev {device} handle 10: root")
+        cmd_lst.extend(snapshot.restore(device))
+        cmd_lst.append(QdiscSnapshot.discard(device))
+        return bulk.bundle(cmd_lst, force=True) if atomic else cmd_lst
+    cmd_lst = []
+    set_lines = []
+    for i, tc in enumerate(tc_lst):
+        id = f"10:{__class_minor(slot, i)}"
+        set_name = __set_name(fault_id, i) if ipset else None
+        if set_name:
+            set_lines.extend(
+                __ipset_destroy_lines(
+                    set_name,
+                    tc["destination_ip_addresses"],
+                    tc["destination_ports"],
+                    tc["source_ports"],
+                )
+            )
+        rules = __generate_traffic_control_rules(
+            IptablesAction.Delete,
+            tc,
+            id,
+            set_name,
+        )
+        cmd_lst.extend(rules)
+    cmd_lst.append(f"sudo tc qdisc del dev {device} handle 10: root")
+    cmd_lst.extend(snapshot.restore(device))
+    if set_lines:
+        cmd_lst.append(__ipset_restore(set_lines))
+    cmd_lst.append(QdiscSnapshot.discard(device))
+    return bulk.bundle(cmd_lst, force=True) if atomic else cmd_lst
+
+
+def __rollback_classes(
+    fault_id: str,
+    device: str,
+    tc_lst: List[Dict],
+    ipset: bool,
+    classifier: Classifier,
+    tree: str,
+    slot: int,
+) -> List[str]:
+    majors = tree.split(",") if tree not in ("", "root") else ["10"]
+    cmd_lst = []
+    set_lines = []
+    if classifier == Classifier.nftables:
+        cmd_lst.append(nftables.delete(__nft_table("fit-tc", device, slot)))
+    for i, tc in enumerate(tc_lst):
+        if classifier == Classifier.nftables:
+            continue
+        if classifier == Classifier.flower:
+            # a filter holds a reference to its class, so the filters are
+            # deleted first
+            prio = __prio(slot, tc_lst, i)
+            cmd_lst.extend(
+                f"sudo tc filter del dev {device} parent {major}: prio {prio}"
+                for major in majors
+            )
+            continue
+        set_name = __set_name(fault_id, i) if ipset else None
+        if set_name:
+            set_lines.extend(
+                __ipset_destroy_lines(
+                    set_name,
+                    tc["destination_ip_addresses"],
+                    tc["destination_ports"],
+                    tc["source_ports"],
+                )
+            )
+        cmd_lst.extend(
+            __generate_traffic_control_rules(
+                IptablesAction.Delete, tc, f"10:{__class_minor(slot, i)}", set_name
+            )
+        )
+    # deleting a class also deletes its netem
+    for major in majors:
+        cmd_lst.extend(
+            f"sudo tc class del dev {device} classid {major}:{__class_minor(slot, i)}"
+            for i in range(len(tc_lst))
+        )
+    if set_lines:
+        cmd_lst.append(__ipset_restore(set_lines))
+    return cmd_lst
+
+
+def latency_matrix_params(
+    matrix: Dict[str, Dict[str, Union[int, Dict]]],
+    regions: Dict[str, str],
+    hostname: str,
+    device: str = "eth0",
+) -> Optional[Dict]:
+    if hostname not in regions:
+        raise ValueError(
+            f"The host '{hostname}' is not found in the argument 'regions'."
+        )
+    source = regions[hostname]
+    # destinations sharing the same settings become one tc entry, so the
+    # number of entries grows with the latency classes, not with the hosts
+    groups: Dict[str, List[str]] = {}
+    for host, region in regions.items():
+        if host == hostname:
+            continue
+        # a pair given in one direction only is used for both directions
+        value = matrix.get(source, {}).get(region, matrix.get(region, {}).get(source))
+        if value is None:
+            continue
+        tc = {"latency": value} if isinstance(value, int) else dict(value)
+        groups.setdefault(json.dumps(tc, sort_keys=True), []).append(host)
+    if not groups:
+        return None
+    return {
+        "device": device,
+        "tc": [
+            {**json.loads(tc), "destination_ip_addresses": hosts}
+            for tc, hosts in groups.items()
+        ],
+    }
+
+
+def rollback_journal(
+    journal: Journal, fault_id_set: Optional[Set[str]] = None
+) -> List[Tuple[str, List[str], List[str]]]:
+    # the ID of each fault, the commands to roll it back and the commands to
+    # run once they succeeded, newest first. A command that fails on what is
+    # already gone does not stop the others, so a fault that was applied
+    # partially or rolled back halfway is rolled back again as a whole.
+    registries = {}
+    step_lst = []
+    for entry in journal.entries:
+        if fault_id_set is not None and entry.fault_id not in fault_id_set:
+            continue
+        arguments = entry.arguments
+        if entry.action == "traffic_control":
+            params = arguments["params"]
+            device = params["device"]
+            key = Allocation.key(params)
+            # the slots released earlier in this rollback are no longer taken
+            path = Allocation.path(device)
+            registry = registries.get(path, journal.file(path))
+            allocation = Allocation.parse(registry, key)
+            registries[path] = "".join(
+                line
+                for line in registry.splitlines(keepends=True)
+                if f" {key} " not in line
+            )
+            snapshot = QdiscSnapshot()
+            if not allocation.others:
+                snapshot = QdiscSnapshot.parse(journal.file(QdiscSnapshot.path(device)))
+            cmd_lst, done_lst = rollback_traffic_control(
+                params=params,
+                atomic=arguments["atomic"],
+                ipset=arguments["ipset"],
+                classifier=arguments["classifier"],
+                snapshot=snapshot,
+                allocation=allocation,
+            )
+            step_lst.append((entry.fault_id, cmd_lst, done_lst))
+        elif entry.action == "traffic_block":
+            step_lst.append((entry.fault_id, *rollback_traffic_block(**arguments)))
+        elif entry.action == "time_travel":
+            step_lst.append(
+                (entry.fault_id, *rollback_time_travel(arguments["disable_ntp"]))
+            )
+    return step_lst
+
+
+def succeeded(
+    step_lst: List[Tuple[str, List[str]]], results: List[CommandResult]
+) -> List[str]:
+    # the IDs of the faults all of whose commands succeeded. The results are
+    # those of the commands of all the faults in order, and a command failing
+    # on what is already removed has done its part
+    fault_id_lst = []
+    i = 0
+    for fault_id, cmd_lst in step_lst:
+        if all(
+            result.exit_status == 0 or Journal.gone(result.stderr)
+            for result in results[i : i + len(cmd_lst)]
+        ):
+            fault_id_lst.append(fault_id)
+        i += len(cmd_lst)
+    return fault_id_lst
+
+
+def __is_single_unfiltered(tc_lst: List[Dict]) -> bool:
+    if len(tc_lst) != 1:
+        return False
+    tc = tc_lst[0]
+    return (
+        not tc["destination_ip_addresses"]
+        and not tc["destination_ports"]
+        and not tc["source_ports"]
+        and {"tcp", "udp", "icmp"} <= set(tc["protocol"])
+        # bandwidth is shaped by the HTB class
+        and not tc["rate"]
+    )
+
+
+def __htb(tc: Dict, link: Link) -> str:
+    htb = f"htb rate {tc['rate'] or link.rate}"
+    if tc["ceil"]:
+        htb += f" ceil {tc['ceil']}"
+    if tc["burst"]:
+        htb += f" burst {tc['burst']}"
+    return htb
+
+
+def __netem(tc: Dict, link: Link) -> str:
+    netem = "netem"
+    latency = tc["latency"]
+    if latency and latency > 0:
+        netem += f" delay {latency}ms"
+        if tc["jitter"]:
+            netem += f" {tc['jitter']}ms"
+            if tc["correlation"]:
+                netem += f" {tc['correlation']}%"
+            if tc["distribution"]:
+                netem += f" distribution {tc['distribution']}"
+        if tc["reorder"]:
+            netem += f" reorder {tc['reorder']}%"
+    loss = tc["loss"]
+    corrupt_flag = tc["corrupt"]
+    if loss and loss > 0:
+        netem += f" {'corrupt' if corrupt_flag else 'loss'} {loss}%"
+    if tc["duplicate"]:
+        netem += f" duplicate {tc['duplicate']}%"
+    slot = tc["slot"]
+    if slot:
+        netem += f" slot {slot['min_delay']}ms"
+        if slot.get("max_delay"):
+            netem += f" {slot['max_delay']}ms"
+        if slot.get("packets"):
+            netem += f" packets {slot['packets']}"
+        if slot.get("bytes"):
+            netem += f" bytes {slot['bytes']}"
+    limit = __netem_limit(tc, link)
+    if limit:
+        netem += f" limit {limit}"
+    return netem
+
+
+def __netem_limit(tc: Dict, link: Link) -> Optional[int]:
+    if tc["limit"]:
+        return tc["limit"]
+    latency = tc["latency"]
+    profile = tc["profile"]
+    if profile and profile["field"] == "latency":
+        # keep one limit for the whole profile, sized for its peak
+        latency = max(profile["start"], profile["end"])
+    if not latency or latency <= 0:
+        return None
+    # netem holds every packet for the whole delay, so it has to queue the
+    # bandwidth-delay product or the latency turns into tail drops. The
+    # jitter is added so that the tail of the distribution still fits.
+    delay = latency + (tc["jitter"] or 0)
+    bits = __to_bps(tc["rate"] or link.rate) * delay / 1000
+    limit = math.ceil(bits / (8 * link.packet_size))
+    return limit if limit > __NETEM_DEFAULT_LIMIT else None
+
+
+def __generate_traffic_control_filters(
+    device: str, tc: Dict, id: str, prio: int
+) -> List[str]:
+    # flower keeps the filters that share a mask in one hash table, so the
+    # per-packet cost does not grow with the number of destinations
+    major = id.split(":")[0]
+    base_cmd = f"sudo tc filter add dev {device} parent {major}: protocol ip prio {prio} flower"
+    filters = []
+    for proto in [p for p in ("tcp", "udp", "icmp") if p in tc["protocol"]]:
+        port_matches = [""]
+        if proto != "icmp":
+            port_matches = [
+                dport + sport
+                for dport in __flower_ports("dst_port", tc["destination_ports"])
+                for sport in __flower_ports("src_port", tc["source_ports"])
+            ]
+        for ip_addr in __aggregate_addresses(tc["destination_ip_addresses"]) or [None]:
+            dest = f" dst_ip {ip_addr}" if ip_addr else ""
+            filters.extend(
+                f"{base_cmd} ip_proto {proto}{dest}{ports} classid {id}"
+                for ports in port_matches
+            )
+    return filters
+
+
+def __flower_ports(key: str, ports: List[str]) -> List[str]:
+    if not ports:
+        return [""]
+    return [f" {key} {port.replace(':', '-')}" for port in __compress_ports(ports)]
+
+
+def __generate_traffic_control_rules(
+    action: IptablesAction,
+    tc: Dict[str],
+    id: int,
+    set_name: Optional[str] = None,
+) -> List[str]:
+    destination_ip_addresses = tc["destination_ip_addresses"]
+    destination_ports = tc["destination_ports"]
+    source_ports = tc["source_ports"]
+    tcp = "tcp" in tc["protocol"]
+    udp = "udp" in tc["protocol"]
+    icmp = "icmp" in tc["protocol"]
+    dports, sports = __port_matches(destination_ports, source_ports, set_name)
+    rules = []
+    protocol_lst = []
+    if tcp:
+        protocol_lst.append("tcp")
+    if udp:
+        protocol_lst.append("udp")
+    if icmp:
+        protocol_lst.append("icmp")
+    cmd_template = f"sudo iptables -{action.value} POSTROUTING -t mangle -j CLASSIFY --set-class {id} -p {{proto}}"
+    for proto in protocol_lst:
+        if proto == "icmp":
+            rules.append(cmd_template.format(proto=proto))
+            continue
+        rules.extend(
+            cmd_template.format(proto=proto) + dport + sport
+            for dport in dports
+            for sport in sports
+        )
+
+    if destination_ip_addresses and set_name:
+        rules = [rule + f" -m set --match-set {set_name}-dst dst" for rule in rules]
+    elif destination_ip_addresses:
+        ip_rules = []
+        for ip_addr in __aggregate_addresses(destination_ip_addresses):
+            dest = f" -d {ip_addr}"
+            ip_rules.extend(map(lambda rule: rule + dest, rules))
+        rules = ip_rules
+    return rules
+
+
+def __nft_classify_all(
+    device: str, tc_lst: List[Dict], slot: int
+) -> Tuple[Dict[str, Tuple[str, List[str]]], List[str]]:
+    sets, rules = {}, []
+    for i, tc in enumerate(tc_lst):
+        entry_sets, entry_rules = __nft_classify_rules(
+            device, i, tc, f"10:{__class_minor(slot, i)}"
+        )
+        sets.update(entry_sets)
+        rules.extend(entry_rules)
+    return sets, rules
+
+
+def __nft_classify_rules(
+    device: str, i: int, tc: Dict, id: str
+) -> Tuple[Dict[str, Tuple[str, List[str]]], List[str]]:
+    sets, matches = __nft_matches(
+        f"tc{i}-",
+        tc["destination_ip_addresses"],
+        tc["destination_ports"],
+        tc["source_ports"],
+        "tcp" in tc["protocol"],
+        "udp" in tc["protocol"],
+        "icmp" in tc["protocol"],
+    )
+    return sets, [
+        f'oifname "{device}" {match} meta priority set {id}' for match in matches
+    ]
+
+
+def __nft_classify_table(
+    device: str,
+    slot: int,
+    sets: Dict[str, Tuple[str, List[str]]],
+    rules: List[str],
+) -> str:
+    return nftables.replace(
+        __nft_table("fit-tc", device, slot),
+        "postrouting",
+        __NFT_MANGLE_PRIORITY + slot,
+        sets,
+        rules,
+    )
+
+
+def __nft_table(prefix: str, device: str, slot: int = 0) -> str:
+    return f"{prefix}-{device}" if slot == 0 else f"{prefix}-{device}-{slot}"
+
+
+def __nft_matches(
+    prefix: str,
+    destination_ip_addresses: List[str],
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+) -> Tuple[Dict[str, Tuple[str, List[str]]], List[str]]:
+    # the sets and the matches of the rules. TCP and UDP share one rule by
+    # matching the ports of the transport header, and every address family
+    # needs a rule of its own.
+    sets = {}
+    addresses = __aggregate_addresses(destination_ip_addresses)
+    daddrs = []
+    for family, type, values in (
+        ("ip", "ipv4_addr", [a for a in addresses if ":" not in a]),
+        ("ip6", "ipv6_addr", [a for a in addresses if ":" in a]),
+    ):
+        if values:
+            name = f"{prefix}dst{family[2:] or '4'}"
+            sets[name] = (type, values)
+            daddrs.append(f" {family} daddr @{name}")
+    ports = ""
+    for key, values in (("dport", destination_ports), ("sport", source_ports)):
+        values = [port.replace(":", "-") for port in __compress_ports(values)]
+        if values:
+            sets[f"{prefix}{key}"] = ("inet_service", values)
+            ports += f" th {key} @{prefix}{key}"
+    matches = []
+    protocols = [proto for proto, on in (("tcp", tcp), ("udp", udp)) if on]
+    if len(protocols) == 1:
+        matches.append(f"meta l4proto {protocols[0]}{ports}")
+    elif protocols:
+        matches.append(f"meta l4proto {{ tcp, udp }}{ports}")
+    matches = [match + daddr for match in matches for daddr in daddrs or [""]]
+    if icmp:
+        # ICMP is an IPv4 protocol, IPv6 has ICMPv6 instead
+        matches.extend(
+            f"meta l4proto icmp{daddr}"
+            for daddr in daddrs or [""]
+            if not daddr.startswith(" ip6 ")
+        )
+    return sets, matches
+
+
+def inject_traffic_block(
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+    ttl: Optional[int] = None,
+) -> List[str]:
+    fault_id, arguments = traffic_block_fault(
+        destination_ip_addresses,
+        device,
+        destination_ports,
+        source_ports,
+        tcp,
+        udp,
+        icmp,
+        atomic,
+        ipset,
+        firewall,
+    )
+    record = Journal.record(fault_id, "traffic_block", arguments)
+    lease_lst = __lease(fault_id, ttl, *rollback_traffic_block(**arguments))
+    return [record] + lease_lst + __inject_traffic_block(fault_id, **arguments)
+
+
+def traffic_block_fault(
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+) -> Tuple[str, Dict]:
+    arguments = {
+        "destination_ip_addresses": destination_ip_addresses,
+        "device": device,
+        "destination_ports": destination_ports,
+        "source_ports": source_ports,
+        "tcp": tcp,
+        "udp": udp,
+        "icmp": icmp,
+        "atomic": atomic,
+        "ipset": ipset,
+        "firewall": firewall,
+    }
+    return Journal.fault_id("traffic_block", arguments), arguments
+
+
+def __inject_traffic_block(
+    fault_id: str,
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    atomic: bool,
+    ipset: bool,
+    firewall: str,
+) -> List[str]:
+    if to_firewall(firewall, ipset) == Firewall.nftables:
+        sets, matches = __nft_matches(
+            "",
+            destination_ip_addresses,
+            destination_ports,
+            source_ports,
+            tcp,
+            udp,
+            icmp,
+        )
+        return [
+            nftables.replace(
+                __block_table(fault_id, device),
+                "output",
+                0,
+                sets,
+                [f'oifname "{device}" {match} drop' for match in matches],
+            )
+        ]
+    set_name = __block_set_name(fault_id) if ipset else None
+    cmd_lst = __generate_traffic_block_rules(
+        IptablesAction.Append,
+        destination_ip_addresses,
+        device,
+        destination_ports,
+        source_ports,
+        tcp,
+        udp,
+        icmp,
+        set_name,
+    )
+    if ipset:
+        set_lines = __ipset_create_lines(
+            set_name, destination_ip_addresses, destination_ports, source_ports
+        )
+        if set_lines:
+            cmd_lst.insert(0, __ipset_restore(set_lines))
+    return bulk.bundle(cmd_lst) if atomic else cmd_lst
+
+
+def rollback_traffic_block(
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    atomic: bool = False,
+    ipset: bool = False,
+    firewall: str = "iptables",
+) -> Tuple[List[str], List[str]]:
+    fault_id, arguments = traffic_block_fault(
+        destination_ip_addresses,
+        device,
+        destination_ports,
+        source_ports,
+        tcp,
+        udp,
+        icmp,
+        atomic,
+        ipset,
+        firewall,
+    )
+    return __rollback_traffic_block(fault_id, **arguments), [Journal.discard(fault_id)]
+
+
+def __rollback_traffic_block(
+    fault_id: str,
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    atomic: bool,
+    ipset: bool,
+    firewall: str,
+) -> List[str]:
+    if to_firewall(firewall, ipset) == Firewall.nftables:
+        return [nftables.delete(__block_table(fault_id, device))]
+    set_name = __block_set_name(fault_id) if ipset else None
+    cmd_lst = __generate_traffic_block_rules(
+        IptablesAction.Delete,
+        destination_ip_addresses,
+        device,
+        destination_ports,
+        source_ports,
+        tcp,
+        udp,
+        icmp,
+        set_name,
+    )
+    if ipset:
+        set_lines = __ipset_destroy_lines(
+            set_name, destination_ip_addresses, destination_ports, source_ports
+        )
+        if set_lines:
+            cmd_lst.append(__ipset_restore(set_lines))
+    return bulk.bundle(cmd_lst, force=True) if atomic else cmd_lst
+
+
+def __block_table(fault_id: str, device: str) -> str:
+    # a table per fault, so that the nft -f transaction of one block does not
+    # replace another block on the same device
+    return f"fit-block-{device}-{__fault_digest(fault_id)}"
+
+
+def __block_set_name(fault_id: str) -> str:
+    # the ipsets of a block are reloaded on inject and destroyed on rollback,
+    # so each fault needs its own
+    return f"fit-block-{__fault_digest(fault_id)}"
+
+
+def __fault_digest(fault_id: str) -> str:
+    # short enough for the ipset names, which are limited to 31 characters
+    return fault_id.rsplit("-", 1)[-1][:12]
+
+
+def __generate_traffic_block_rules(
+    action: IptablesAction,
+    destination_ip_addresses: List[str],
+    device: str,
+    destination_ports: List[str],
+    source_ports: List[str],
+    tcp: bool,
+    udp: bool,
+    icmp: bool,
+    set_name: Optional[str] = None,
+) -> List[str]:
+    rules = []
+    dports, sports = __port_matches(destination_ports, source_ports, set_name)
+    base_cmd = f"sudo iptables -{action.value} OUTPUT -o {device} -p {{proto}}"
+    protocols = []
+    if tcp:
+        protocols.append("tcp")
+    if udp:
+        protocols.append("udp")
+    if icmp:
+        protocols.append("icmp")
+    for proto in protocols:
+        if proto == "icmp":
+            rules.append(base_cmd.format(proto=proto))
+            continue
+        rules.extend(
+            base_cmd.format(proto=proto) + dport + sport
+            for dport in dports
+            for sport in sports
+        )
+
+    if destination_ip_addresses and set_name:
+        rules = [rule + f" -m set --match-set {set_name}-dst dst" for rule in rules]
+    elif destination_ip_addresses:
+        ip_rules = []
+        for ip_addr in __aggregate_addresses(destination_ip_addresses):
+            ip_rules.extend(map(lambda rule: rule + f" -d {ip_addr}", rules))
+        rules = ip_rules
+
+    return [rule + " -j DROP" for rule in rules]
+
+
+def __port_matches(
+    destination_ports: List[str], source_ports: List[str], set_name: Optional[str]
+) -> Tuple[List[str], List[str]]:
+    # the destination and the source port matches. A rule is generated for
+    # every pair of them, or a single match is empty when no port is given.
+    if set_name:
+        dport = f" -m set --match-set {set_name}-dport dst" if destination_ports else ""
+        sport = f" -m set --match-set {set_name}-sport src" if source_ports else ""
+        return [dport], [sport]
+    dports = [
+        f" --match multiport --dports {chunk}"
+        for chunk in __multiport_chunks(__compress_ports(destination_ports))
+    ]
+    sports = [
+        f" --match multiport --sports {chunk}"
+        for chunk in __multiport_chunks(__compress_ports(source_ports))
+    ]
+    return dports or [""], sports or [""]
+
+
+def __multiport_chunks(ports: List[str]) -> List[str]:
+    # multiport rejects more than 15 ports, so the ports are split into
+    # chunks that each fit into one match
+    chunks = []
+    chunk, size = [], 0
+    for port in ports:
+        weight = 2 if ":" in port else 1
+        if size + weight > __MULTIPORT_MAX:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(port)
+        size += weight
+    if chunk:
+        chunks.append(chunk)
+    return [",".join(chunk) for chunk in chunks]
+
+
+def __compress_ports(ports: Optional[List[str]]) -> List[str]:
+    # merge overlapping and adjacent ports into ranges, keeping the order in
+    # which the ranges are first given. Service names are left as they are.
+    values = []
+    ranges = []
+    for index, port in enumerate(ports or []):
+        start, _, end = port.partition(":")
+        if not start.isdigit() or not (end or start).isdigit():
+            values.append((index, port))
+            continue
+        ranges.append((int(start), int(end or start), index))
+    merged = []
+    for start, end, index in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            last = merged[-1]
+            merged[-1] = (last[0], max(last[1], end), min(last[2], index))
+        else:
+            merged.append((start, end, index))
+    values.extend(
+        (index, str(start) if start == end else f"{start}:{end}")
+        for start, end, index in merged
+    )
+    return [value for _, value in sorted(values)]
+
+
+def __aggregate_addresses(addresses: Optional[List[str]]) -> List[str]:
+    # merge the addresses into the fewest CIDR blocks, keeping the order in
+    # which the blocks are first given. Host names are left as they are.
+    values = []
+    networks = {}
+    for index, address in enumerate(addresses or []):
+        try:
+            network = ipaddress.ip_network(address, strict=False)
+        except ValueError:
+            values.append((index, address))
+            continue
+        networks.setdefault(network.version, []).append((index, network))
+    for items in networks.values():
+        merged = list(ipaddress.collapse_addresses(network for _, network in items))
+        starts = [int(network.network_address) for network in merged]
+        first = {}
+        for index, network in items:
+            i = bisect.bisect_right(starts, int(network.network_address)) - 1
+            first[i] = min(first.get(i, index), index)
+        values.extend(
+            (
+                first[i],
+                (
+                    str(network.network_address)
+                    if network.prefixlen == network.max_prefixlen
+                    else network.with_prefixlen
+                ),
+            )
+            for i, network in enumerate(merged)
+        )
+    return [value for _, value in sorted(values)]
+
+
+def __ipset_create_lines(
+    set_name: str,
+    destination_ip_addresses: List[str],
+    destination_ports: List[str],
+    source_ports: List[str],
+) -> List[str]:
+    lines = []
+    for suffix, members in __ipset_members(
+        destination_ip_addresses, destination_ports, source_ports
+    ).items():
+        if members:
+            lines.extend(__ipset_fill_lines(f"{set_name}-{suffix}", suffix, members))
+    return lines
+
+
+def __ipset_fill_lines(name: str, suffix: str, members: List[str]) -> List[str]:
+    return [
+        f"create {name} {__ipset_type(suffix)}",
+        f"flush {name}",
+        *(f"add {name} {member}" for member in members),
+    ]
+
+
+def __ipset_type(suffix: str) -> str:
+    # hash:net accepts both addresses and CIDR blocks, and bitmap:port covers
+    # the whole port space so that membership is a single lookup per packet
+    return "hash:net" if suffix == "dst" else "bitmap:port range 0-65535"
+
+
+def __ipset_members(
+    destination_ip_addresses: List[str],
+    destination_ports: List[str],
+    source_ports: List[str],
+) -> Dict[str, List[str]]:
+    return {
+        "dst": __aggregate_addresses(destination_ip_addresses or []),
+        "dport": [
+            port.replace(":", "-") for port in __compress_ports(destination_ports or [])
+        ],
+        "sport": [
+            port.replace(":", "-") for port in __compress_ports(source_ports or [])
+        ],
+    }
+
+
+def __set_values(tc: Dict) -> Tuple[List[str], List[str], List[str]]:
+    return tc["destination_ip_addresses"], tc["destination_ports"], tc["source_ports"]
+
+
+def __ipset_destroy_lines(
+    set_name: str,
+    destination_ip_addresses: List[str],
+    destination_ports: List[str],
+    source_ports: List[str],
+) -> List[str]:
+    # creating a set that exists is ignored with -exist, so the set is created
+    # first and destroying it does not fail when it is already gone
+    lines = []
+    for suffix, values in (
+        ("dst", destination_ip_addresses),
+        ("dport", destination_ports),
+        ("sport", source_ports),
+    ):
+        if values:
+            lines.append(f"create {set_name}-{suffix} {__ipset_type(suffix)}")
+            lines.append(f"destroy {set_name}-{suffix}")
+    return lines
+
+
+def __ipset_restore(lines: List[str]) -> str:
+    return bulk.heredoc("sudo ipset restore -exist", lines)
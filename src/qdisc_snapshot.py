@@ -0,0 +1,205 @@
+"""障害を設定する前のネットワークデバイスのqdiscとクラスの構成を保存し,ロールバック時に復元するためのモジュール
+
+QdiscSnapshot.save()で作成したコマンドを障害の設定前にターゲット上で実行すると,`tc qdisc show`と`tc class show`の出力を
+ターゲット上のファイルに保存したうえで,既存のルートのqdiscを削除する. ロールバック時はQdiscSnapshot.probe()で作成したコマンドで
+保存した出力を読み出してQdiscSnapshot.parse()に渡し,QdiscSnapshot.restore()で作成したコマンドで元の構成を設定し直す.
+
+ハンドルが0:のqdisc(カーネルが作成したデフォルトのqdisc)はルートのqdiscを削除するとカーネルが作成し直すため復元しない.
+ingressとclsactはルートのqdiscを削除しても残るため復元しない.
+クラスは明示的に作成するqdisc(CLASSFUL_KINDS)のものだけを復元し,mqやprioのようにqdiscと同時に作成されるクラスは復元しない.
+tcのフィルタは`tc filter show`の出力を`tc filter add`の引数として使えないため保存しない.
+`tc qdisc show`が単位を付けて出力するパケット数やサイズ(limit 10000p, quantum 3028b)のうち,`tc qdisc add`が整数として読む値は単位を取り除いて復元する.
+"""
+
+import re
+from dataclasses import dataclass
+
+from beartype.typing import Dict, List, Optional, Tuple
+from typing_extensions import Self
+
+SNAPSHOT_DIR = "/run/fit"
+# qdiscs whose classes are added one by one with tc class add
+CLASSFUL_KINDS = ("htb", "hfsc", "drr", "qfq")
+# counters printed by tc show that are not options of tc qdisc/class add
+STATISTICS = ("refcnt", "direct_packets_stat")
+# options that tc show prints with a unit ("10000p", "3028b") but tc qdisc add
+# reads as a plain integer
+INTEGER_OPTIONS = {
+    "fq": ("limit", "flow_limit", "quantum", "initial_quantum"),
+    "fq_codel": ("limit", "quantum", "drop_batch"),
+    "fq_pie": ("limit", "quantum"),
+    "codel": ("limit",),
+    "pie": ("limit",),
+    "sfq": ("limit",),
+    "pfifo": ("limit",),
+}
+# units of the packet counts and sizes printed by tc show
+UNITS = {"p": 1, "b": 1, "Kb": 1024, "Mb": 1024**2, "Gb": 1024**3}
+
+
+@dataclass(frozen=True)
+class QdiscSnapshot:
+    """障害を設定する前のqdiscとクラスの構成
+
+    Attributes:
+        entries (Tuple[str, ...]): 親から順に並べた"qdisc handle 8001: root mq"や"class parent 1: classid 1:1 htb rate 1Gbit"の形式のqdiscとクラスの設定.
+    """
+
+    entries: Tuple[str, ...] = ()
+
+    @staticmethod
+    def path(device: str) -> str:
+        """スナップショットを保存するターゲット上のファイルのパスを返す"""
+        return f"{SNAPSHOT_DIR}/tc-{device}"
+
+    @staticmethod
+    def save(device: str) -> str:
+        """qdiscとクラスの構成を保存し,既存のルートのqdiscを削除するコマンドを返す
+
+        スナップショットがすでに保存されている場合(前回の障害をロールバックしていない場合)は何もしない.
+        """
+        path = QdiscSnapshot.path(device)
+        return (
+            f"sudo sh -c 'mkdir -p {SNAPSHOT_DIR}; if [ ! -s {path} ]; then"
+            f" {{ tc qdisc show dev {device}; tc class show dev {device}; }} > {path};"
+            f" tc qdisc del dev {device} root 2>/dev/null; fi; true'"
+        )
+
+    @staticmethod
+    def probe(device: str) -> str:
+        """保存したスナップショットを出力するコマンドを返す"""
+        return f"cat {QdiscSnapshot.path(device)} 2>/dev/null"
+
+    @staticmethod
+    def discard(device: str) -> str:
+        """保存したスナップショットを削除するコマンドを返す"""
+        return f"sudo rm -f {QdiscSnapshot.path(device)}"
+
+    @staticmethod
+    def parse(output: str) -> Self:
+        """probe()で作成したコマンドの標準出力からスナップショットを作成する"""
+        items = []
+        for line in output.splitlines():
+            words = line.split()
+            if len(words) < 4 or words[0] not in ("qdisc", "class"):
+                continue
+            if words[0] == "qdisc":
+                item = QdiscSnapshot.__qdisc(words)
+            else:
+                item = QdiscSnapshot.__class(words)
+            if item is not None:
+                items.append(item)
+        return QdiscSnapshot(entries=tuple(QdiscSnapshot.__ordered(items)))
+
+    def restore(self, device: str) -> List[str]:
+        """スナップショットのqdiscとクラスを親から順に設定し直すコマンドを返す"""
+        cmd_lst = []
+        for entry in self.entries:
+            kind, rest = entry.split(" ", 1)
+            cmd_lst.append(f"sudo tc {kind} replace dev {device} {rest}")
+        return cmd_lst
+
+    @staticmethod
+    def __qdisc(words: List[str]) -> Optional[Dict]:
+        # qdisc fq 8002: parent 8001:1 limit 10000p flow_limit 100p ...
+        kind, handle = words[1], words[2]
+        if words[3] == "root":
+            parent, options = "root", words[4:]
+        else:
+            parent, options = words[4], words[5:]
+        if handle == "0:" or kind in ("ingress", "clsact"):
+            return None
+        return {
+            "type": "qdisc",
+            "id": handle,
+            "parent": parent,
+            "entry": " ".join(
+                ["qdisc", "handle", handle]
+                + (["root"] if parent == "root" else ["parent", parent])
+                + [kind]
+                + QdiscSnapshot.__options(kind, options)
+            ),
+        }
+
+    @staticmethod
+    def __class(words: List[str]) -> Optional[Dict]:
+        # class htb 1:10 parent 1:1 leaf 10: prio 0 rate 100Mbit ceil 100Mbit ...
+        kind, classid = words[1], words[2]
+        if kind not in CLASSFUL_KINDS:
+            return None
+        if words[3] == "root":
+            parent, options = classid.split(":")[0] + ":", words[4:]
+        else:
+            parent, options = words[4], words[5:]
+        return {
+            "type": "class",
+            "id": classid,
+            "parent": parent,
+            "entry": " ".join(
+                ["class", "parent", parent, "classid", classid, kind]
+                + QdiscSnapshot.__options(kind, options)
+            ),
+        }
+
+    @staticmethod
+    def __options(kind: str, words: List[str]) -> List[str]:
+        options = []
+        skip = False
+        for i, word in enumerate(words):
+            if skip:
+                skip = False
+            elif word in STATISTICS + ("leaf",) and i + 1 < len(words):
+                skip = True
+            elif word in INTEGER_OPTIONS.get(kind, ()) and i + 1 < len(words):
+                options += [word, QdiscSnapshot.__integer(words[i + 1])]
+                skip = True
+            else:
+                options.append(word)
+        return options
+
+    @staticmethod
+    def __integer(value: str) -> str:
+        # 10000p -> 10000, 3028b -> 3028, 15Kb -> 15360
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)(p|b|Kb|Mb|Gb)?", value)
+        if match is None:
+            return value
+        return str(round(float(match.group(1)) * UNITS.get(match.group(2), 1)))
+
+    @staticmethod
+    def __ordered(items: List[Dict]) -> List[str]:
+        # tc show does not guarantee that a parent is listed before its
+        # children, so add each entry once its parent qdisc or class exists.
+        # The kernel recreates the default root qdisc (handle 0:) by itself.
+        qdiscs = {"0"}
+        classes = set()
+        class_ids = {item["id"] for item in items if item["type"] == "class"}
+        ordered = []
+        pending = list(items)
+        while pending:
+            ready = []
+            for item in pending:
+                parent = item["parent"]
+                major = parent.split(":")[0] or "0"
+                if parent == "root":
+                    ok = True
+                elif item["type"] == "class" and parent.endswith(":"):
+                    ok = major in qdiscs
+                elif item["type"] == "class":
+                    ok = parent in classes
+                else:
+                    ok = major in qdiscs and (
+                        parent in classes or parent not in class_ids
+                    )
+                if ok:
+                    ready.append(item)
+            if not ready:
+                # keep the order of tc show for entries whose parent is unknown
+                ready = pending
+            for item in ready:
+                ordered.append(item["entry"])
+                if item["type"] == "qdisc":
+                    qdiscs.add(item["id"].split(":")[0] or "0")
+                else:
+                    classes.add(item["id"])
+            pending = [item for item in pending if item not in ready]
+        return ordered
@@ -0,0 +1,188 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import paramiko
+from beartype.typing import Dict, Iterator, List, Optional
+
+from target import Target
+
+
+@dataclass
+class _Entry:
+    client: Optional[paramiko.SSHClient]
+    last_used: float
+    in_use: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class SSHConnectionPool:
+    """認証済みのSSH接続をターゲットごとに保持し,アクションの呼び出し間で再利用するためのプール
+
+    同じターゲットに対するinject_*/rollback_*の呼び出しごとにTCP接続,鍵交換,公開鍵認証をやり直さずに済むよう,
+    接続をTarget(ホスト名,ユーザ名,鍵のパス)をキーとして保持する.
+    スレッドセーフであり,複数のスレッドから同じ接続を同時に利用できる.
+
+    Args:
+        max_size (int, optional): 保持する接続数の上限. 超えた場合は利用中でない接続のうち最も長く使われていないものから破棄する. Defaults to 32.
+        idle_timeout (float, optional): 最後に利用されてから破棄されるまでの時間(秒). Defaults to 300.
+        keepalive (int, optional): 接続を維持するためのkeepaliveパケットの送信間隔(秒). 0の場合は送信しない. Defaults to 30.
+    """
+
+    def __init__(
+        self, max_size: int = 32, idle_timeout: float = 300, keepalive: int = 30
+    ):
+        if max_size < 1:
+            raise ValueError(
+                "The argument 'max_size' must be greater than or equal to 1"
+            )
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.__entries: Dict[Target, _Entry] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__entries)
+
+    @contextmanager
+    def connection(self, target: Target) -> Iterator[paramiko.SSHClient]:
+        """ターゲットへの認証済みのSSH接続を取得する
+
+        プール内に生存している接続があればそれを返し,なければ新たに接続する.
+        ブロック内でSSH接続に起因する例外が発生した場合,その接続はプールから破棄される.
+
+        Args:
+            target (Target): 接続先のターゲット.
+
+        Yields:
+            paramiko.SSHClient: 接続済みのSSHクライアント.
+        """
+        entry = self.__checkout(target)
+        try:
+            yield entry.client
+        except (paramiko.SSHException, EOFError, OSError):
+            self.__release(target, entry, broken=True)
+            raise
+        except BaseException:
+            self.__release(target, entry)
+            raise
+        self.__release(target, entry)
+
+    def discard(self, target: Target):
+        """ターゲットへの接続をプールから取り除き,切断する"""
+        with self.__lock:
+            entry = self.__entries.pop(target, None)
+        if entry is not None and entry.client is not None:
+            entry.client.close()
+
+    def close_all(self):
+        """プール内のすべての接続を切断する"""
+        with self.__lock:
+            entries = list(self.__entries.values())
+            self.__entries.clear()
+        for entry in entries:
+            if entry.client is not None:
+                entry.client.close()
+
+    def __checkout(self, target: Target) -> _Entry:
+        while True:
+            with self.__lock:
+                expired = self.__evict_idle()
+                entry = self.__entries.get(target)
+                if entry is None:
+                    entry = _Entry(client=None, last_used=time.monotonic())
+                    self.__entries[target] = entry
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+                self.__entries.move_to_end(target)
+            for client in expired:
+                client.close()
+
+            # connect outside of the pool lock so that handshakes to different
+            # hosts can proceed concurrently
+            with entry.lock:
+                if entry.client is not None and self.__is_alive(entry.client):
+                    return entry
+                if entry.client is not None:
+                    entry.client.close()
+                    entry.client = None
+                try:
+                    entry.client = self.__connect(target)
+                except BaseException:
+                    self.__release(target, entry, broken=True)
+                    raise
+            with self.__lock:
+                if self.__entries.get(target) is not entry:
+                    # the entry was discarded while connecting
+                    entry.in_use -= 1
+                    entry.client.close()
+                    continue
+                overflow = self.__evict_overflow()
+            for client in overflow:
+                client.close()
+            return entry
+
+    def __release(self, target: Target, entry: _Entry, broken: bool = False):
+        with self.__lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if broken and self.__entries.get(target) is entry:
+                del self.__entries[target]
+            else:
+                broken = False
+            overflow = self.__evict_overflow()
+        if broken and entry.client is not None:
+            entry.client.close()
+        for client in overflow:
+            client.close()
+
+    def __evict_idle(self) -> List[paramiko.SSHClient]:
+        now = time.monotonic()
+        expired = [
+            key
+            for key, entry in self.__entries.items()
+            if entry.in_use == 0 and now - entry.last_used > self.idle_timeout
+        ]
+        return [
+            client
+            for client in (self.__entries.pop(key).client for key in expired)
+            if client is not None
+        ]
+
+    def __evict_overflow(self) -> List[paramiko.SSHClient]:
+        overflow = []
+        for key in list(self.__entries):
+            if len(self.__entries) <= self.max_size:
+                break
+            if self.__entries[key].in_use == 0:
+                client = self.__entries.pop(key).client
+                if client is not None:
+                    overflow.append(client)
+        return overflow
+
+    def __connect(self, target: Target) -> paramiko.SSHClient:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=target.hostname,
+            username=target.username,
+            key_filename=target.key_filename,
+        )
+        transport = client.get_transport()
+        if transport is not None and self.keepalive > 0:
+            transport.set_keepalive(self.keepalive)
+        return client
+
+    @staticmethod
+    def __is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+
+pool = SSHConnectionPool()
+atexit.register(pool.close_all)
@@ -4,7 +4,7 @@ from typing import Dict
 from typing_extensions import Self
 
 
-@dataclass
+@dataclass(frozen=True)
 class Target:
     hostname: str
     username: str
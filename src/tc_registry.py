@@ -0,0 +1,136 @@
+"""同じネットワークデバイスに設定したtcの障害ごとにスロットを割り当てるためのモジュール
+
+障害ごとにターゲット上のレジストリ(SNAPSHOT_DIR/tc-<device>.registry)に"スロット キー qdiscの構成"の行を1行ずつ記録する.
+qdiscの構成はHTBのメジャー番号をカンマ区切りにしたもの(netemをルートのqdiscとする場合は"root")で,同じデバイスの障害は同じ構成のHTBを共有する.
+キーはパラメータ群から計算するため,inject_traffic_controlとrollback_traffic_controlに同じパラメータ群を渡せば同じ障害を指す.
+Allocation.allocate()はflockでレジストリをロックしたうえで空いている最小のスロットを割り当て,
+Allocation.release()は障害の行をレジストリから削除する. どちらも変更前のレジストリを出力し,その標準出力をAllocation.parse()に渡して利用する.
+Allocation.release_with()は後からターゲット上で実行するタイマー向けに,ロックしたまま
+ほかの障害が残っているかどうかで実行するコマンドを選び,コマンドが成功した場合に障害の行を削除する.
+"""
+
+import hashlib
+import json
+import shlex
+from dataclasses import dataclass
+
+from beartype.typing import Dict, List, Tuple
+from typing_extensions import Self
+
+from fault_journal import Journal
+from qdisc_snapshot import SNAPSHOT_DIR
+
+
+@dataclass(frozen=True)
+class Allocation:
+    """tcの障害に割り当てたスロット
+
+    Attributes:
+        slot (int): 障害に割り当てたスロット. クラスID,netemのハンドルとtcのフィルタのprioはスロットごとに重ならない範囲を使う.
+        tree (str): 障害のqdiscの構成. HTBのメジャー番号をカンマ区切りにしたもの, netemをルートのqdiscとする場合は"root". 記録されていない場合は"".
+        others (Tuple[str, ...]): 同じデバイスに設定されているほかの障害のqdiscの構成.
+    """
+
+    slot: int = 0
+    tree: str = ""
+    others: Tuple[str, ...] = ()
+
+    @staticmethod
+    def key(params: Dict) -> str:
+        """正規化したパラメータ群から障害のキーを計算する"""
+        data = json.dumps(params, sort_keys=True).encode()
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    @staticmethod
+    def path(device: str) -> str:
+        """レジストリのターゲット上のパスを返す"""
+        return f"{SNAPSHOT_DIR}/tc-{device}.registry"
+
+    @staticmethod
+    def allocate(device: str, key: str, tree: str) -> str:
+        """空いている最小のスロットを障害に割り当ててレジストリを出力するコマンドを返す
+
+        キーがすでに記録されている場合はスロットを割り当て直さない.
+        """
+        path = Allocation.path(device)
+        return Allocation.__locked(
+            device,
+            f'touch {path}; if ! grep -q " {key} " {path}; then s=0;'
+            f' while grep -q "^$s " {path}; do s=$((s + 1)); done;'
+            f' echo "$s {key} {tree}" >> {path}; fi; cat {path}',
+        )
+
+    @staticmethod
+    def release(device: str, key: str) -> str:
+        """レジストリを出力してから障害の行を削除するコマンドを返す"""
+        path = Allocation.path(device)
+        return Allocation.__locked(
+            device,
+            f'touch {path}; cat {path}; grep -v " {key} " {path} > {path}.tmp;'
+            f" mv {path}.tmp {path}",
+        )
+
+    @staticmethod
+    def release_with(
+        device: str, key: str, shared_lst: List[str], last_lst: List[str]
+    ) -> str:
+        """ほかの障害が残っている場合はshared_lstを,最後の障害の場合はlast_lstを実行し,成功した場合に障害の行をレジストリから削除するコマンドを返す
+
+        判定から障害の行の削除まで,レジストリをロックしたままおこなう. そのためshared_lstとlast_lstにはレジストリをロックするコマンドを含めない.
+        コマンドの成否はJournal.gate()で判定し,失敗した場合は障害の行を残して終了ステータス1で終了する.
+        """
+        path = Allocation.path(device)
+        script = "\n".join(
+            [
+                f"mkdir -p {SNAPSHOT_DIR}; exec 9>>{Allocation.__lock(device)}; flock 9",
+                f'touch {path}; if grep -v " {key} " {path} | grep -q .; then',
+                Journal.gate(shared_lst),
+                "else",
+                Journal.gate(last_lst),
+                "fi",
+                f'grep -v " {key} " {path} > {path}.tmp; mv {path}.tmp {path}',
+            ]
+        )
+        return f"sudo sh -c {shlex.quote(script)}"
+
+    @staticmethod
+    def rename(device: str, key: str, new_key: str) -> str:
+        """障害のキーを変更するコマンドを返す"""
+        return Allocation.__locked(
+            device, f'sed -i "s/ {key} / {new_key} /" {Allocation.path(device)}'
+        )
+
+    @staticmethod
+    def probe(device: str) -> str:
+        """レジストリを出力するコマンドを返す"""
+        return f"cat {Allocation.path(device)} 2>/dev/null"
+
+    @staticmethod
+    def parse(output: str, key: str) -> Self:
+        """allocate(),release()またはprobe()で作成したコマンドの標準出力から,keyの障害に割り当てたスロットを作成する
+
+        keyの障害が記録されていない場合(レジストリを導入する前に設定した障害など)はスロット0とする.
+        """
+        slot = 0
+        tree = ""
+        others = []
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) != 3 or not fields[0].isdigit():
+                continue
+            if fields[1] == key:
+                slot, tree = int(fields[0]), fields[2]
+            else:
+                others.append(fields[2])
+        return Allocation(slot=slot, tree=tree, others=tuple(others))
+
+    @staticmethod
+    def __locked(device: str, script: str) -> str:
+        lock = Allocation.__lock(device)
+        return (
+            f"sudo sh -c 'mkdir -p {SNAPSHOT_DIR}; exec 9>>{lock}; flock 9; {script}'"
+        )
+
+    @staticmethod
+    def __lock(device: str) -> str:
+        return f"{SNAPSHOT_DIR}/tc-{device}.lock"
@@ -4,7 +4,7 @@ from cerberus import Validator
 
 __root_schema:
     device (str, optional): 対象のネットワークデバイス名. Defaults to eth0.
-    tc (List): シミュレーション設定のリスト. 各要素のスキーマは__tc_schemaで定義.
+    tc (List): シミュレーション設定のリスト. 90要素まで. 各要素のスキーマは__tc_schemaで定義.
 
 __tc_schema:
     destination_ip_addresses (List[str], optional): 設定したIPアドレスにのみ影響を与える. 指定がない場合はすべてのIPアドレスへの送信トラフィックに影響を与える. Defaults to [].
@@ -14,8 +14,36 @@ __tc_schema:
     loss (float, optional): パケットをロスさせる割合. 単位は%. 値の設定がない場合はパケットロスは設定されない. Defaults to None.
     corrupt (bool, optional): Trueの場合パケットロスの代わりに指定した割合のパケット破損を発生させる. Defaults to False.
     protocol (List[str], optional): 指定したプロトコル(tcp, udp, icmp)の通信に対してのみ影響を与える. 何も指定がない場合はすべてのプロトコル(tcp, udp, icmp)に対して影響を与える. Defaults to ["tcp", "udp", "icmp"].
+    rate (str, optional): 帯域幅の保証値. tcの単位(bit, kbit, mbit, gbit, tbit, bps, kbps, mbps, gbps, tbps)付きで指定する. 値の設定がない場合は帯域を制限しない. Defaults to None.
+    ceil (str, optional): 帯域幅の上限. rateと同じ形式で,rate以上の値を指定する. rateの指定が必要. 値の設定がない場合はrateと同じ値になる. Defaults to None.
+    burst (str, optional): rateを超えて一度に送信できるバイト数. 単位(b, kb, mb, gb)付きまたは単位なし(バイト)で指定する. rateの指定が必要. Defaults to None.
+    limit (int, optional): netemのキューに保持できるパケット数. 値の設定がない場合は遅延と帯域幅(rateまたはリンク速度)の積から,遅延中のパケットを保持できる値を計算する. Defaults to None.
+    jitter (int, optional): 遅延のゆらぎ. 単位はms. latencyの指定が必要. Defaults to None.
+    distribution (str, optional): ゆらぎの分布(normal, pareto, paretonormal). jitterの指定が必要. 値の設定がない場合は一様分布になる. Defaults to None.
+    correlation (float, optional): 直前のパケットの遅延との相関. 単位は%. jitterの指定が必要. Defaults to None.
+    reorder (float, optional): 遅延させずに先に送信するパケットの割合. 単位は%. latencyの指定が必要. Defaults to None.
+    duplicate (float, optional): パケットを複製する割合. 単位は%. Defaults to None.
+    slot (Dict, optional): パケットをまとめて送信するスロットの設定. 無線やDOCSISのような断続的な送信をシミュレーションする. Defaults to None.
+     - min_delay (int): スロットの間隔の最小値. 単位はms.
+     - max_delay (int, optional): スロットの間隔の最大値. 単位はms. 指定した場合は間隔がmin_delayとmax_delayの間で一様に分布する. Defaults to None.
+     - packets (int, optional): 1つのスロットで送信する最大パケット数. Defaults to None.
+     - bytes (int, optional): 1つのスロットで送信する最大バイト数. Defaults to None.
+    profile (Dict, optional): latencyまたはlossを時間とともに変化させるプロファイル. 指定した場合はlatencyまたはlossの代わりにstartの値で設定し,ターゲット上でlength秒間値を変化させる. 形状の詳細はfault_profile.pyを参照. Defaults to None.
+     - field (str, optional): 変化させるパラメータ(latency, loss). Defaults to "latency".
+     - shape (str): 変化の形状(ramp, step, sine, random_walk).
+     - start (float): 開始時の値. 単位はfieldと同じ.
+     - end (float): 終了時の値(sineとrandom_walkでは範囲の端). 単位はfieldと同じ.
+     - length (float): 値を変化させる時間(秒). 0.01以上.
+     - interval (float, optional): 値を変更する間隔(秒). 0.01以上. Defaults to 1.
+     - steps (int, optional): stepの段数. 2以上. Defaults to 5.
+     - period (float, optional): sineの周期(秒). 値の設定がない場合はlength. Defaults to None.
+     - step_size (float, optional): random_walkで1回に増減する値の上限. 値の設定がない場合はstartとendの差の1/10. Defaults to None.
+     - seed (int, optional): random_walkの乱数のシード. Defaults to None.
 """
 
+RATE_REGEX = r"[0-9]+(\.[0-9]+)?([kmgt]?bit|[kmgt]?bps)"
+BURST_REGEX = r"[0-9]+([kmg]?b|[kmg])?"
+
 __tc_schema = {
     "destination_ip_addresses": {
         "type": "list",
@@ -33,6 +61,94 @@ __tc_schema = {
         "allowed": ["tcp", "udp", "icmp"],
         "default": ["tcp", "udp", "icmp"],
     },
+    "rate": {"type": "string", "regex": RATE_REGEX, "nullable": True, "default": None},
+    "ceil": {
+        "type": "string",
+        "regex": RATE_REGEX,
+        "nullable": True,
+        "default": None,
+    },
+    "burst": {
+        "type": "string",
+        "regex": BURST_REGEX,
+        "nullable": True,
+        "default": None,
+    },
+    "limit": {"type": "integer", "min": 1, "nullable": True, "default": None},
+    "jitter": {"type": "integer", "min": 0, "nullable": True, "default": None},
+    "distribution": {
+        "type": "string",
+        "allowed": ["normal", "pareto", "paretonormal"],
+        "nullable": True,
+        "default": None,
+    },
+    "correlation": {
+        "type": "number",
+        "min": 0,
+        "max": 100,
+        "nullable": True,
+        "default": None,
+    },
+    "reorder": {
+        "type": "number",
+        "min": 0,
+        "max": 100,
+        "nullable": True,
+        "default": None,
+    },
+    "duplicate": {
+        "type": "number",
+        "min": 0,
+        "max": 100,
+        "nullable": True,
+        "default": None,
+    },
+    "slot": {
+        "type": "dict",
+        "nullable": True,
+        "default": None,
+        "schema": {
+            "min_delay": {"type": "integer", "min": 0, "required": True},
+            "max_delay": {"type": "integer", "min": 0, "nullable": True},
+            "packets": {"type": "integer", "min": 1, "nullable": True},
+            "bytes": {"type": "integer", "min": 1, "nullable": True},
+        },
+    },
+    "profile": {
+        "type": "dict",
+        "nullable": True,
+        "default": None,
+        "schema": {
+            "field": {
+                "type": "string",
+                "allowed": ["latency", "loss"],
+                "default": "latency",
+            },
+            "shape": {
+                "type": "string",
+                "allowed": ["ramp", "step", "sine", "random_walk"],
+                "required": True,
+            },
+            "start": {"type": "number", "min": 0, "required": True},
+            "end": {"type": "number", "min": 0, "required": True},
+            "length": {"type": "number", "min": 0.01, "required": True},
+            "interval": {"type": "number", "min": 0.01, "default": 1},
+            "steps": {"type": "integer", "min": 2, "default": 5},
+            "period": {
+                "type": "number",
+                "min": 0.01,
+                "nullable": True,
+                "default": None,
+            },
+            "step_size": {
+                "type": "number",
+                "min": 0,
+                "nullable": True,
+                "default": None,
+            },
+            "seed": {"type": "integer", "nullable": True, "default": None},
+        },
+    },
 }
 
 
@@ -41,6 +157,7 @@ __root_schema = {
     "tc": {
         "type": "list",
         "empty": False,
+        "maxlength": 90,
         "schema": {"type": "dict", "schema": __tc_schema},
     },
 }
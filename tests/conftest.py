@@ -1,8 +1,13 @@
 from typing import Dict
 
+import asyncssh
 import paramiko
 import pytest
 
+import agent_client
+import local_journal
+import ssh_pool
+
 
 class MockSSHClient:
     def __init__(self) -> None:
@@ -23,8 +28,19 @@ class MockSSHClient:
     def connect(self, hostname, username, key_filename):
         pass
 
+    def get_transport(self):
+        return MockTransport()
+
     def exec_command(self, command):
-        return None, MockStdout(), MockStderr()
+        return mock_exec_result()
+
+
+class MockTransport:
+    def is_active(self):
+        return True
+
+    def set_keepalive(self, interval):
+        pass
 
 
 class MockAutoAddPolicy:
@@ -32,7 +48,50 @@ class MockAutoAddPolicy:
         pass
 
 
+class MockChannel:
+    def __init__(self, stdout=b"", stderr=b"", exit_status=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+        self.eof_received = True
+        self.closed = False
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, nbytes):
+        data, self.stdout = self.stdout[:nbytes], self.stdout[nbytes:]
+        return data
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, nbytes):
+        data, self.stderr = self.stderr[:nbytes], self.stderr[nbytes:]
+        return data
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def shutdown_write(self):
+        pass
+
+
+class MockStdin:
+    def __init__(self, channel=None):
+        self.channel = channel or MockChannel()
+
+    def write(self, data):
+        pass
+
+
 class MockStdout:
+    def __init__(self, channel=None):
+        self.channel = channel or MockChannel()
+
     def __iter__(self):
         return self
 
@@ -41,6 +100,9 @@ class MockStdout:
 
 
 class MockStderr:
+    def __init__(self, channel=None):
+        self.channel = channel or MockChannel()
+
     def __iter__(self):
         return self
 
@@ -48,6 +110,12 @@ class MockStderr:
         raise StopIteration
 
 
+def mock_exec_result(stdout="", stderr="", exit_status=0, stdin=None):
+    """exec_commandの戻り値として,指定した出力と終了ステータスを返すチャネルを持つ組を作成する"""
+    channel = MockChannel(stdout.encode(), stderr.encode(), exit_status)
+    return stdin or MockStdin(channel), MockStdout(channel), MockStderr(channel)
+
+
 @pytest.fixture
 def mock_ssh_client(monkeypatch: pytest.MonkeyPatch) -> MockSSHClient:
     ssh_client = MockSSHClient
@@ -56,6 +124,52 @@ def mock_ssh_client(monkeypatch: pytest.MonkeyPatch) -> MockSSHClient:
     return ssh_client
 
 
+class MockCompletedProcess:
+    def __init__(self, stdout="", stderr="", exit_status=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+
+
+class MockAsyncSSHConnection:
+    def __init__(self, host, username, client_keys, known_hosts, keepalive_interval):
+        self.host = host
+        self.closed = False
+
+    async def run(self, command, input=None):
+        return MockCompletedProcess()
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def mock_asyncssh_connect(monkeypatch: pytest.MonkeyPatch) -> MockAsyncSSHConnection:
+    async def connect(host, **kwargs):
+        return MockAsyncSSHConnection(host, **kwargs)
+
+    monkeypatch.setattr(asyncssh, "connect", connect)
+    return MockAsyncSSHConnection
+
+
+@pytest.fixture(autouse=True)
+def clear_ssh_pool():
+    yield
+    agent_client.close_all()
+    ssh_pool.pool.close_all()
+
+
+@pytest.fixture(autouse=True)
+def local_journal_path(monkeypatch: pytest.MonkeyPatch, tmp_path) -> str:
+    """アクションがホームディレクトリのジャーナルに記録しないようにする"""
+    path = str(tmp_path / "fit" / "journal.jsonl")
+    monkeypatch.setattr(local_journal, "journal", local_journal.LocalJournal(path))
+    return path
+
+
 @pytest.fixture
 def target() -> Dict[str, str]:
     return {
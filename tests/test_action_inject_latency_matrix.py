@@ -0,0 +1,148 @@
+import pytest
+from pytest_mock import MockerFixture
+
+from src.action import inject_latency_matrix, rollback_latency_matrix
+from src.plan import latency_matrix_params
+from tests.conftest import mock_ssh_client, target
+
+REGIONS = {
+    "10.0.0.1": "tokyo",
+    "10.0.0.2": "tokyo",
+    "10.0.1.1": "osaka",
+    "10.0.2.1": "virginia",
+    "10.0.2.2": "virginia",
+}
+
+
+@pytest.mark.parametrize(
+    argnames="matrix,hostname,expected",
+    argvalues=[
+        # 0:同じ遅延の宛先は1つのtcの要素にまとめ,片方の向きだけの指定は逆向きにも使う
+        (
+            {"tokyo": {"osaka": 10, "virginia": 80}, "osaka": {"virginia": 80}},
+            "10.0.0.1",
+            [
+                {"latency": 10, "destination_ip_addresses": ["10.0.1.1"]},
+                {
+                    "latency": 80,
+                    "destination_ip_addresses": ["10.0.2.1", "10.0.2.2"],
+                },
+            ],
+        ),
+        (
+            {"tokyo": {"osaka": 10, "virginia": 80}, "osaka": {"virginia": 80}},
+            "10.0.2.1",
+            [
+                {
+                    "latency": 80,
+                    "destination_ip_addresses": ["10.0.0.1", "10.0.0.2", "10.0.1.1"],
+                },
+            ],
+        ),
+        # 1:逆向きが指定された場合はその値を使い,同じリージョン内は指定した場合だけ設定する
+        (
+            {
+                "tokyo": {"tokyo": 1, "virginia": 80},
+                "virginia": {"tokyo": 90},
+            },
+            "10.0.2.2",
+            [{"latency": 90, "destination_ip_addresses": ["10.0.0.1", "10.0.0.2"]}],
+        ),
+        (
+            {
+                "tokyo": {"tokyo": 1, "virginia": 80},
+                "virginia": {"tokyo": 90},
+            },
+            "10.0.0.2",
+            [
+                {"latency": 1, "destination_ip_addresses": ["10.0.0.1"]},
+                {"latency": 80, "destination_ip_addresses": ["10.0.2.1", "10.0.2.2"]},
+            ],
+        ),
+        # 2:遅延の代わりにtcの要素の設定を指定できる
+        (
+            {"osaka": {"virginia": {"latency": 80, "jitter": 5, "loss": 0.1}}},
+            "10.0.1.1",
+            [
+                {
+                    "jitter": 5,
+                    "latency": 80,
+                    "loss": 0.1,
+                    "destination_ip_addresses": ["10.0.2.1", "10.0.2.2"],
+                }
+            ],
+        ),
+    ],
+)
+def test_latency_matrix_params_should_group_destinations_by_their_settings(
+    matrix, hostname, expected
+):
+    assert latency_matrix_params(matrix, REGIONS, hostname) == {
+        "device": "eth0",
+        "tc": expected,
+    }
+
+
+def test_latency_matrix_params_should_return_None_when_no_destination_is_delayed():
+    assert latency_matrix_params({"tokyo": {"osaka": 10}}, REGIONS, "10.0.2.1") is None
+
+
+def test_inject_latency_matrix_should_apply_the_plan_of_each_host_in_parallel(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    target_lst = [
+        {"hostname": hostname, "username": "user", "key_filename": "/foo/baz/bar"}
+        for hostname in ("10.0.0.1", "10.0.1.1")
+    ]
+    results = inject_latency_matrix(
+        matrix={"tokyo": {"osaka": 10}},
+        regions={"10.0.0.1": "tokyo", "10.0.1.1": "osaka"},
+        target=target_lst,
+    )
+    assert {hostname: result["status"] for hostname, result in results.items()} == {
+        "10.0.0.1": "succeeded",
+        "10.0.1.1": "succeeded",
+    }
+    assert sorted(
+        call.args[1]
+        for call in spy_exec_command.call_args_list
+        if "CLASSIFY" in call.args[1] and "-p tcp" in call.args[1]
+    ) == [
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 10.0.0.1",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 10.0.1.1",
+    ]
+
+
+def test_rollback_latency_matrix_should_delete_the_rules_of_the_same_plan(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    rollback_latency_matrix(
+        matrix={"tokyo": {"osaka": 10}},
+        regions={"localhost": "tokyo", "10.0.1.1": "osaka"},
+        target=target,
+    )
+    assert [
+        call.args[1]
+        for call in spy_exec_command.call_args_list
+        if "CLASSIFY" in call.args[1]
+    ] == [
+        f"sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p {proto} -d 10.0.1.1"
+        for proto in ("tcp", "udp", "icmp")
+    ]
+
+
+def test_inject_latency_matrix_should_throw_ValueError_when_the_host_has_no_region(
+    target: target, mock_ssh_client: mock_ssh_client
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_latency_matrix(
+            matrix={"tokyo": {"osaka": 10}},
+            regions={"10.0.1.1": "osaka"},
+            target=target,
+        )
+    assert (
+        str(error_info.value)
+        == "The host 'localhost' is not found in the argument 'regions'."
+    )
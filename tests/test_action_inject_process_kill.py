@@ -4,7 +4,7 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import inject_process_kill
-from tests.conftest import mock_ssh_client, target
+from tests.conftest import mock_exec_result, mock_ssh_client, target
 
 
 def test_inject_process_kill_should_call_exec_command_with_kill_cmd_generated_by_default_param(
@@ -65,3 +65,22 @@ def test_inject_process_kill_should_throw_ValueError_when_the_argument_signal_is
         " ['HUP', 'INT', 'QUIT', 'ILL', 'TRAP', 'ABRT', 'FPE',"
         " 'KILL', 'SEGV', 'PIPE', 'ALRM', 'TERM', 'USR1', 'USR2']."
     )
+
+
+def test_inject_process_kill_should_run_the_kill_loop_on_the_target_when_remote_loop_is_True(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client, "exec_command", return_value=mock_exec_result(stdout="42\n")
+    )
+    kills = inject_process_kill(
+        pid_lst=[12345], interval=0.1, length=5, remote_loop=True, target=target
+    )
+    assert kills == 42
+    spy_exec_command.assert_called_once_with(
+        "sudo sh -c 'n=0; end=$(($(($(date +%s%N)/1000000))+5000));"
+        " while :; do sleep 0.1;"
+        " for c in $(for pid in 12345; do kill -KILL $pid && echo 1; done 2>/dev/null);"
+        " do n=$((n+c)); done;"
+        " [ $(($(date +%s%N)/1000000)) -ge $end ] && break; done; echo $n'"
+    )
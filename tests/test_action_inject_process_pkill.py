@@ -4,7 +4,7 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import inject_process_pkill
-from tests.conftest import mock_ssh_client, target
+from tests.conftest import mock_exec_result, mock_ssh_client, target
 
 
 def test_inject_process_pkill_should_call_exec_command_with_pkill_cmd_generated_by_default_params(
@@ -189,3 +189,21 @@ def test_inject_process_pkill_should_exec_pkill_cmd_with_full_option_when_full_m
         ANY,
         "for pname in app1 app2; do sudo pkill -KILL $pname -o -x -f; done",
     )
+
+
+def test_inject_process_pkill_should_run_the_kill_loop_on_the_target_when_remote_loop_is_True(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client, "exec_command", return_value=mock_exec_result(stdout="7\n")
+    )
+    kills = inject_process_pkill(
+        process_name_lst=["app1"], length=1, remote_loop=True, target=target
+    )
+    assert kills == 7
+    spy_exec_command.assert_called_once_with(
+        "sudo sh -c 'n=0; end=$(($(($(date +%s%N)/1000000))+1000));"
+        " while :; do for c in $(for pname in app1; do pkill -KILL -c $pname; done"
+        " 2>/dev/null); do n=$((n+c)); done;"
+        " [ $(($(date +%s%N)/1000000)) -ge $end ] && break; done; echo $n'"
+    )
@@ -4,6 +4,7 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import inject_time_travel, rollback_time_travel
+from src.fault_journal import Journal
 from tests.conftest import mock_ssh_client, target
 
 
@@ -12,10 +13,12 @@ def test_inject_time_travel_should_call_exec_command_with_date_cmd_generated_by_
 ):
     spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
     inject_time_travel(target=target)
-    spy_exec_command.assert_called_once_with(
-        ANY,
-        "sudo date -s `date --date='86400 seconds' +@%s`",
-    )
+    assert spy_exec_command.call_args_list == [
+        mocker.call(
+            ANY, Journal.record("time_travel", "time_travel", {"disable_ntp": False})
+        ),
+        mocker.call(ANY, "sudo date -s `date --date='86400 seconds' +@%s`"),
+    ]
 
 
 def test_inject_time_travel_should_call_exec_command_with_date_cmd_generated_by_arb_params(
@@ -23,10 +26,9 @@ def test_inject_time_travel_should_call_exec_command_with_date_cmd_generated_by_
 ):
     spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
     inject_time_travel(offset=-86400, target=target)
-    spy_exec_command.assert_called_once_with(
-        ANY,
-        "sudo date -s `date --date='-86400 seconds' +@%s`",
-    )
+    assert spy_exec_command.call_args_list[1:] == [
+        mocker.call(ANY, "sudo date -s `date --date='-86400 seconds' +@%s`"),
+    ]
 
 
 def test_inject_time_travel_should_call_exec_command_with_block_ntp_port_command_when_the_argument_disable_ntp_is_True(
@@ -42,6 +44,36 @@ def test_inject_time_travel_should_call_exec_command_with_block_ntp_port_command
     )
 
 
+def test_inject_time_travel_should_set_a_timer_that_rolls_back_the_fault_when_ttl_is_given(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_time_travel(disable_ntp=True, ttl=600, target=target)
+    assert spy_exec_command.call_args_list[1] == mocker.call(
+        ANY,
+        Journal.lease(
+            "time_travel",
+            600,
+            [
+                "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP",
+                "sudo chronyc -a makestep",
+            ],
+            [Journal.discard("time_travel")],
+        ),
+    )
+    assert spy_exec_command.call_count == 4
+
+
+def test_inject_time_travel_should_throw_ValueError_when_ttl_is_less_than_1(
+    target: target,
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_time_travel(ttl=0, target=target)
+    assert (
+        str(error_info.value) == "The argument 'ttl' must be greater than or equal to 1"
+    )
+
+
 def test_inject_time_travel_should_throw_ValueError_when_the_argument_target_is_invalid():
     invalid_target = {
         "hostname": "localhost",
@@ -57,10 +89,10 @@ def test_rollback_time_travel_should_call_exec_command_with_chronyc_cmd(
 ):
     spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
     rollback_time_travel(target=target)
-    spy_exec_command.assert_called_once_with(
-        ANY,
-        "sudo chronyc -a makestep",
-    )
+    assert spy_exec_command.call_args_list == [
+        mocker.call(ANY, "sudo chronyc -a makestep"),
+        mocker.call(ANY, Journal.discard("time_travel")),
+    ]
 
 
 def test_rollback_time_travel_should_call_exec_command_with_iptables_cmd_when_enable_ntp_is_True(
@@ -4,9 +4,28 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import inject_traffic_block
+from src.fault_journal import Journal
+from src.plan import traffic_block_fault
 from tests.conftest import mock_ssh_client, target
 
 
+def __digest(**arguments) -> str:
+    # the digest of the fault ID that names the table and the ipsets of a block
+    fault_id, _ = traffic_block_fault(
+        **{
+            "destination_ip_addresses": None,
+            "device": "eth0",
+            "destination_ports": None,
+            "source_ports": None,
+            "tcp": True,
+            "udp": True,
+            "icmp": True,
+            **arguments,
+        }
+    )
+    return fault_id.rsplit("-", 1)[-1][:12]
+
+
 @pytest.mark.parametrize(
     argnames="args,expected",
     argvalues=[
@@ -117,6 +136,48 @@ from tests.conftest import mock_ssh_client, target
                 "sudo iptables -A OUTPUT -o eth0 -p icmp -d 4.4.4.4 -j DROP",
             ],
         ),
+        # 11: 隣接するipアドレスはCIDRにまとめる
+        (
+            {
+                "destination_ip_addresses": [
+                    "10.0.1.0/24",
+                    "8.8.8.8",
+                    "10.0.0.1",
+                    "10.0.0.0/24",
+                    "8.8.8.8/32",
+                ],
+                "udp": False,
+                "icmp": False,
+            },
+            [
+                "sudo iptables -A OUTPUT -o eth0 -p tcp -d 10.0.0.0/23 -j DROP",
+                "sudo iptables -A OUTPUT -o eth0 -p tcp -d 8.8.8.8 -j DROP",
+            ],
+        ),
+        # 12: 連続するポートは範囲にまとめる
+        (
+            {
+                "destination_ports": ["82", "22", "80", "81", "8000:8080", "8081"],
+                "udp": False,
+                "icmp": False,
+            },
+            [
+                "sudo iptables -A OUTPUT -o eth0 -p tcp --match multiport --dports 80:82,22,8000:8081 -j DROP",
+            ],
+        ),
+        # 13: multiportに入りきらないポートはルールを分ける(範囲は2つと数える)
+        (
+            {
+                "destination_ports": ["1000:1001"] + [str(p) for p in range(0, 28, 2)],
+                "source_ports": ["53"],
+                "udp": False,
+                "icmp": False,
+            },
+            [
+                "sudo iptables -A OUTPUT -o eth0 -p tcp --match multiport --dports 1000:1001,0,2,4,6,8,10,12,14,16,18,20,22,24 --match multiport --sports 53 -j DROP",
+                "sudo iptables -A OUTPUT -o eth0 -p tcp --match multiport --dports 26 --match multiport --sports 53 -j DROP",
+            ],
+        ),
     ],
 )
 def test_inject_traffic_block_should_call_exec_command_with_iptables(
@@ -131,7 +192,7 @@ def test_inject_traffic_block_should_call_exec_command_with_iptables(
     spy_exec_command.assert_has_calls(
         list(map(lambda cmd: mocker.call(ANY, cmd), expected))
     )
-    assert spy_exec_command.call_count == len(expected)
+    assert spy_exec_command.call_count == len(expected) + 1
 
 
 def test_inject_traffic_block_should_throw_ValueError_when_the_argument_target_is_invalid():
@@ -142,3 +203,204 @@ def test_inject_traffic_block_should_throw_ValueError_when_the_argument_target_i
     with pytest.raises(ValueError) as error_info:
         inject_traffic_block(target=invalid_target)
     assert str(error_info.value) == "'username' is not found in target."
+
+
+def test_inject_traffic_block_should_apply_all_rules_with_iptables_restore_when_atomic_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_block(
+        destination_ip_addresses=["192.168.0.1", "192.168.0.2"],
+        icmp=False,
+        atomic=True,
+        target=target,
+    )
+    assert spy_exec_command.call_args_list[1:] == [
+        mocker.call(
+            ANY,
+            "sudo iptables-restore --noflush <<'__FIT_EOF__'\n"
+            "*filter\n"
+            "-A OUTPUT -o eth0 -p tcp -d 192.168.0.1 -j DROP\n"
+            "-A OUTPUT -o eth0 -p udp -d 192.168.0.1 -j DROP\n"
+            "-A OUTPUT -o eth0 -p tcp -d 192.168.0.2 -j DROP\n"
+            "-A OUTPUT -o eth0 -p udp -d 192.168.0.2 -j DROP\n"
+            "COMMIT\n"
+            "__FIT_EOF__",
+        )
+    ]
+
+
+def test_inject_traffic_block_should_match_destinations_with_ipset_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    args = {
+        "destination_ip_addresses": ["192.168.0.1", "10.0.0.0/8"],
+        "destination_ports": ["80", "8000:8080"],
+        "icmp": False,
+        "ipset": True,
+    }
+    inject_traffic_block(**args, target=target)
+    name = f"fit-block-{__digest(**args)}"
+    assert spy_exec_command.call_args_list[1:] == [
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {name}-dst hash:net\n"
+            f"flush {name}-dst\n"
+            f"add {name}-dst 192.168.0.1\n"
+            f"add {name}-dst 10.0.0.0/8\n"
+            f"create {name}-dport bitmap:port range 0-65535\n"
+            f"flush {name}-dport\n"
+            f"add {name}-dport 80\n"
+            f"add {name}-dport 8000-8080\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -A OUTPUT -o eth0 -p tcp"
+            f" -m set --match-set {name}-dport dst"
+            f" -m set --match-set {name}-dst dst -j DROP",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -A OUTPUT -o eth0 -p udp"
+            f" -m set --match-set {name}-dport dst"
+            f" -m set --match-set {name}-dst dst -j DROP",
+        ),
+    ]
+
+
+def test_inject_traffic_block_should_apply_one_nft_transaction_when_firewall_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    args = {
+        "destination_ip_addresses": ["192.168.0.0", "192.168.0.1", "2001:db8::1"],
+        "destination_ports": ["80", "8000:8080"],
+        "firewall": "nftables",
+    }
+    inject_traffic_block(**args, target=target)
+    table = f"fit-block-eth0-{__digest(**args)}"
+    assert spy_exec_command.call_args_list[1:] == [
+        mocker.call(
+            ANY,
+            "sudo nft -f - <<'__FIT_EOF__'\n"
+            f"add table inet {table}\n"
+            f"delete table inet {table}\n"
+            f"table inet {table} {{\n"
+            "  set dst4 { type ipv4_addr; flags interval; auto-merge; elements = { 192.168.0.0/31 } }\n"
+            "  set dst6 { type ipv6_addr; flags interval; auto-merge; elements = { 2001:db8::1 } }\n"
+            "  set dport { type inet_service; flags interval; auto-merge; elements = { 80, 8000-8080 } }\n"
+            "  chain output {\n"
+            "    type filter hook output priority 0; policy accept;\n"
+            '    oifname "eth0" meta l4proto { tcp, udp } th dport @dport ip daddr @dst4 drop\n'
+            '    oifname "eth0" meta l4proto { tcp, udp } th dport @dport ip6 daddr @dst6 drop\n'
+            '    oifname "eth0" meta l4proto icmp ip daddr @dst4 drop\n'
+            "  }\n"
+            "}\n"
+            "__FIT_EOF__",
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (
+            {"firewall": "pf"},
+            "'pf' is not a valid Firewall. The argument 'firewall' must be chosen between ['iptables', 'nftables'].",
+        ),
+        (
+            {"firewall": "nftables", "ipset": True},
+            "The argument 'ipset' cannot be used with the firewall 'nftables'.",
+        ),
+    ],
+)
+def test_inject_traffic_block_should_throw_ValueError_when_firewall_is_invalid(
+    target: target, args, message
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_block(**args, target=target)
+    assert str(error_info.value) == message
+
+
+def test_inject_traffic_block_should_set_a_timer_that_rolls_back_the_rules_when_ttl_is_given(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_block(
+        destination_ip_addresses=["10.0.0.1"],
+        udp=False,
+        icmp=False,
+        ttl=60,
+        target=target,
+    )
+    fault_id = Journal.fault_id(
+        "traffic_block",
+        {
+            "destination_ip_addresses": ["10.0.0.1"],
+            "device": "eth0",
+            "destination_ports": None,
+            "source_ports": None,
+            "tcp": True,
+            "udp": False,
+            "icmp": False,
+            "atomic": False,
+            "ipset": False,
+            "firewall": "iptables",
+        },
+    )
+    # タイマーは障害を設定する前に設定する
+    assert [call.args[1] for call in spy_exec_command.call_args_list][1:] == [
+        Journal.lease(
+            fault_id,
+            60,
+            [
+                "sudo iptables -D OUTPUT -o eth0 -p tcp -d 10.0.0.1 -j DROP",
+            ],
+            [Journal.discard(fault_id)],
+        ),
+        "sudo iptables -A OUTPUT -o eth0 -p tcp -d 10.0.0.1 -j DROP",
+    ]
+
+
+def test_inject_traffic_block_should_use_a_table_per_fault_when_firewall_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_block(
+        destination_ip_addresses=["10.0.0.1"], firewall="nftables", target=target
+    )
+    inject_traffic_block(
+        destination_ip_addresses=["10.0.0.2"], firewall="nftables", target=target
+    )
+    first, second = (
+        spy_exec_command.call_args_list[1].args[1],
+        spy_exec_command.call_args_list[3].args[1],
+    )
+    # 2つ目の障害のトランザクションは1つ目の障害のテーブルを置き換えない
+    digest = __digest(destination_ip_addresses=["10.0.0.1"], firewall="nftables")
+    table = f"fit-block-eth0-{digest}"
+    assert f"table inet {table} {{" in first
+    assert table not in second
+
+
+def test_inject_traffic_block_should_use_ipsets_per_fault_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    for address in ["10.0.0.1", "10.0.0.2"]:
+        inject_traffic_block(
+            destination_ip_addresses=[address], icmp=False, ipset=True, target=target
+        )
+    restores = [
+        call.args[1]
+        for call in spy_exec_command.call_args_list
+        if call.args[1].startswith("sudo ipset restore")
+    ]
+    # 2つ目の障害は1つ目の障害のipsetを読み込み直さない
+    digest = __digest(destination_ip_addresses=["10.0.0.1"], icmp=False, ipset=True)
+    name = f"fit-block-{digest}"
+    assert f"create {name}-dst hash:net" in restores[0]
+    assert name not in restores[1]
@@ -4,62 +4,43 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import inject_traffic_control
-from tests.conftest import mock_ssh_client, target
+from src.fault_journal import Journal
+from src.link import Link
+from src.plan import normalize_traffic_control_params
+from src.qdisc_snapshot import QdiscSnapshot
+from src.tc_registry import Allocation
+from tests.conftest import mock_exec_result, mock_ssh_client, target
 
 
 @pytest.mark.parametrize(
     argnames="input,expected",
     argvalues=[
-        # 0:すべての通信に遅延をかける
+        # 0:すべての通信に遅延をかける場合はnetemをルートに直接設定する
         (
             {"tc": [{"latency": 100}]},
             [
-                "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+                "sudo tc qdisc add dev eth0 handle 10: root netem delay 100ms limit 833334",
             ],
         ),
         # 1:すべての通信にパケットロスを発生させる
         (
             {"tc": [{"loss": 0.1}]},
             [
-                "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem loss 0.1%",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+                "sudo tc qdisc add dev eth0 handle 10: root netem loss 0.1%",
             ],
         ),
         # 2:すべての通信にパケット破壊を発生させる
         (
             {"tc": [{"loss": 0.5, "corrupt": True}]},
             [
-                "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem corrupt 0.5%",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+                "sudo tc qdisc add dev eth0 handle 10: root netem corrupt 0.5%",
             ],
         ),
         # 3:すべての通信に遅延とパケットロスを同時に発生させる
         (
             {"tc": [{"latency": 100, "loss": 0.1}]},
             [
-                "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms loss 0.1%",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+                "sudo tc qdisc add dev eth0 handle 10: root netem delay 100ms loss 0.1% limit 833334",
             ],
         ),
         # 4:特定のプロトコルに対してのみ変更を適用
@@ -75,9 +56,9 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms loss 0.1%",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms loss 0.1% limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
             ],
         ),
@@ -86,9 +67,9 @@ from tests.conftest import mock_ssh_client, target
             {"tc": [{"latency": 100, "destination_ports": ["80"]}]},
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp --match multiport --dports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
@@ -99,9 +80,9 @@ from tests.conftest import mock_ssh_client, target
             {"tc": [{"latency": 100, "destination_ports": ["80", "22"]}]},
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp --match multiport --dports 80,22",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
@@ -112,9 +93,9 @@ from tests.conftest import mock_ssh_client, target
             {"tc": [{"latency": 100, "source_ports": ["80"]}]},
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --sports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp --match multiport --sports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
@@ -125,9 +106,9 @@ from tests.conftest import mock_ssh_client, target
             {"tc": [{"latency": 100, "source_ports": ["80", "22"]}]},
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --sports 80,22",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp --match multiport --sports 80,22",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
@@ -146,9 +127,9 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 --match multiport --sports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp --match multiport --dports 80,22 --match multiport --sports 80",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
@@ -159,9 +140,9 @@ from tests.conftest import mock_ssh_client, target
             {"tc": [{"latency": 100, "destination_ip_addresses": ["8.8.8.8"]}]},
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 8.8.8.8",
@@ -176,9 +157,9 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 8.8.8.8",
@@ -201,9 +182,9 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 -d 4.4.4.4",
@@ -230,12 +211,12 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
-                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 -d 4.4.4.4",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 4.4.4.4",
-                "sudo tc class add dev eth0 parent 10: classid 10:11 htb rate 1000000kbit",
+                "sudo tc class add dev eth0 parent 10: classid 10:11 htb rate 100gbit",
                 "sudo tc qdisc add dev eth0 parent 10:11 handle 101: netem loss 0.5%",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:11 -p tcp --match multiport --dports 80 --match multiport --sports 80 -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:11 -p udp --match multiport --dports 80 --match multiport --sports 80 -d 8.8.8.8",
@@ -263,14 +244,14 @@ from tests.conftest import mock_ssh_client, target
             },
             [
                 "sudo tc qdisc add dev ens33 handle 10: root htb default 1",
-                "sudo tc class add dev ens33 parent 10: classid 10:1 htb rate 1000000kbit",
-                "sudo tc class add dev ens33 parent 10: classid 10:10 htb rate 1000000kbit",
-                "sudo tc qdisc add dev ens33 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc class add dev ens33 parent 10: classid 10:1 htb rate 100gbit",
+                "sudo tc class add dev ens33 parent 10: classid 10:10 htb rate 100gbit",
+                "sudo tc qdisc add dev ens33 parent 10:10 handle 100: netem delay 100ms limit 833334",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp --match multiport --dports 80,22 -d 4.4.4.4",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp -d 4.4.4.4",
-                "sudo tc class add dev ens33 parent 10: classid 10:11 htb rate 1000000kbit",
+                "sudo tc class add dev ens33 parent 10: classid 10:11 htb rate 100gbit",
                 "sudo tc qdisc add dev ens33 parent 10:11 handle 101: netem loss 0.5%",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:11 -p tcp --match multiport --dports 80 --match multiport --sports 80 -d 8.8.8.8",
                 "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:11 -p udp --match multiport --dports 80 --match multiport --sports 80 -d 8.8.8.8",
@@ -288,6 +269,8 @@ def test_inject_traffic_control_should_call_exec_command_with_tc_and_iptables(
 ):
     spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
     inject_traffic_control(params=input, target=target)
+    device = input.get("device", "eth0")
+    expected = [Link.probe(device), ANY, ANY, QdiscSnapshot.save(device)] + expected
     spy_exec_command.assert_has_calls(
         list(map(lambda cmd: mocker.call(ANY, cmd), expected))
     )
@@ -319,3 +302,738 @@ def test_inject_traffic_control_should_throw_ValueError_when_the_argument_target
     with pytest.raises(ValueError) as error_info:
         inject_traffic_control(params=params, target=invalid_target)
     assert str(error_info.value) == "'username' is not found in target."
+
+
+def test_inject_traffic_control_should_send_all_commands_as_one_script_when_exec_mode_is_batch(
+    target: target,
+    mocker: MockerFixture,
+    mock_ssh_client: mock_ssh_client,
+):
+    out_lst = [f"@@fit\t{i}\t0\t1000\t\t\n" for i in range(7)]
+    stdin = mocker.MagicMock()
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        side_effect=[
+            mock_exec_result(stdout="-1 1\n"),
+            mock_exec_result(),
+            mock_exec_result(stdout="".join(out_lst), stdin=stdin),
+        ],
+    )
+    results = inject_traffic_control(
+        params={"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+        exec_mode="batch",
+        target=target,
+    )
+    assert spy_exec_command.call_args_list == [
+        mocker.call(Link.probe("eth0")),
+        mocker.call(ANY),
+        mocker.call("sh -s"),
+    ]
+    script = stdin.write.call_args.args[0]
+    assert (
+        "\nsudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334\n"
+        in script
+    )
+    stdin.channel.shutdown_write.assert_called_once()
+    assert [result["exit_status"] for result in results] == [0] * 7
+    assert results[5]["command"] == (
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334"
+    )
+
+
+def test_inject_traffic_control_should_throw_ValueError_when_exec_mode_is_invalid(
+    target: target,
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(
+            params={"tc": [{"latency": 100}]}, exec_mode="foo", target=target
+        )
+    assert str(error_info.value) == (
+        "'foo' is not a valid ExecMode."
+        " The argument 'exec_mode' must be chosen between ['exec', 'batch', 'agent']."
+    )
+
+
+def test_inject_traffic_control_should_apply_tc_and_iptables_in_two_commands_when_atomic_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+        atomic=True,
+        target=target,
+    )
+    assert spy_exec_command.call_args_list == [
+        mocker.call(ANY, Link.probe("eth0")),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, QdiscSnapshot.save("eth0")),
+        mocker.call(
+            ANY,
+            "sudo tc -batch - <<'__FIT_EOF__'\n"
+            "qdisc add dev eth0 handle 10: root htb default 1\n"
+            "class add dev eth0 parent 10: classid 10:1 htb rate 100gbit\n"
+            "class add dev eth0 parent 10: classid 10:10 htb rate 100gbit\n"
+            "qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables-restore --noflush <<'__FIT_EOF__'\n"
+            "*mangle\n"
+            "-A POSTROUTING -j CLASSIFY --set-class 10:10 -p tcp\n"
+            "COMMIT\n"
+            "__FIT_EOF__",
+        ),
+    ]
+
+
+def test_inject_traffic_control_should_create_one_rule_per_protocol_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {
+        "tc": [
+            {
+                "destination_ip_addresses": ["addr1", "addr2", "addr3"],
+                "source_ports": ["p1"],
+                "latency": 100,
+                "protocol": ["tcp", "icmp"],
+            }
+        ]
+    }
+    name = f"fit-tc-{Allocation.key(normalize_traffic_control_params(params))[:12]}-0"
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params=params,
+        ipset=True,
+        target=target,
+    )
+    assert spy_exec_command.call_args_list == [
+        mocker.call(ANY, Link.probe("eth0")),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, QdiscSnapshot.save("eth0")),
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {name}-dst hash:net\n"
+            f"flush {name}-dst\n"
+            f"add {name}-dst addr1\n"
+            f"add {name}-dst addr2\n"
+            f"add {name}-dst addr3\n"
+            f"create {name}-sport bitmap:port range 0-65535\n"
+            f"flush {name}-sport\n"
+            f"add {name}-sport p1\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(ANY, "sudo tc qdisc add dev eth0 handle 10: root htb default 1"),
+        mocker.call(
+            ANY,
+            "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+        ),
+        mocker.call(
+            ANY,
+            "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+        ),
+        mocker.call(
+            ANY,
+            "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp"
+            f" -m set --match-set {name}-sport src -m set --match-set {name}-dst dst",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp"
+            f" -m set --match-set {name}-dst dst",
+        ),
+    ]
+
+
+def test_inject_traffic_control_should_classify_with_iptables_when_multiple_unfiltered_entries_are_given(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={"tc": [{"latency": 100}, {"loss": 0.1}]}, target=target
+    )
+    assert spy_exec_command.call_count == 16
+    spy_exec_command.assert_any_call(
+        ANY, "sudo tc qdisc add dev eth0 handle 10: root htb default 1"
+    )
+
+
+def test_inject_traffic_control_should_classify_with_tc_flower_when_classifier_is_flower(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={
+            "tc": [
+                {
+                    "latency": 100,
+                    "destination_ip_addresses": ["8.8.8.8", "4.4.4.4"],
+                    "destination_ports": ["80", "8000:8080"],
+                    "protocol": ["tcp", "icmp"],
+                },
+                {"loss": 0.5, "source_ports": ["22"], "protocol": ["udp"]},
+            ]
+        },
+        classifier="flower",
+        target=target,
+    )
+    filter_cmd = "sudo tc filter add dev eth0 parent 10: protocol ip"
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        ANY,
+        ANY,
+        QdiscSnapshot.save("eth0"),
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
+        f"{filter_cmd} prio 4 flower ip_proto tcp dst_ip 8.8.8.8 dst_port 80 classid 10:10",
+        f"{filter_cmd} prio 4 flower ip_proto tcp dst_ip 8.8.8.8 dst_port 8000-8080 classid 10:10",
+        f"{filter_cmd} prio 4 flower ip_proto tcp dst_ip 4.4.4.4 dst_port 80 classid 10:10",
+        f"{filter_cmd} prio 4 flower ip_proto tcp dst_ip 4.4.4.4 dst_port 8000-8080 classid 10:10",
+        f"{filter_cmd} prio 4 flower ip_proto icmp dst_ip 8.8.8.8 classid 10:10",
+        f"{filter_cmd} prio 4 flower ip_proto icmp dst_ip 4.4.4.4 classid 10:10",
+        "sudo tc class add dev eth0 parent 10: classid 10:11 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:11 handle 101: netem loss 0.5%",
+        f"{filter_cmd} prio 2 flower ip_proto udp src_port 22 classid 10:11",
+    ]
+
+
+def test_inject_traffic_control_should_aggregate_addresses_and_ports_of_the_filters_when_classifier_is_flower(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={
+            "tc": [
+                {
+                    "latency": 100,
+                    "destination_ip_addresses": [
+                        "192.168.0.2",
+                        "192.168.0.0",
+                        "192.168.0.1",
+                        "192.168.0.3",
+                    ],
+                    "destination_ports": ["443", "80", "81", "444"],
+                    "protocol": ["tcp"],
+                }
+            ]
+        },
+        classifier="flower",
+        target=target,
+    )
+    filter_cmd = "sudo tc filter add dev eth0 parent 10: protocol ip"
+    assert [call.args[1] for call in spy_exec_command.call_args_list][-2:] == [
+        f"{filter_cmd} prio 2 flower ip_proto tcp dst_ip 192.168.0.0/30 dst_port 443-444 classid 10:10",
+        f"{filter_cmd} prio 2 flower ip_proto tcp dst_ip 192.168.0.0/30 dst_port 80-81 classid 10:10",
+    ]
+
+
+def test_inject_traffic_control_should_classify_with_one_nft_transaction_when_classifier_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={
+            "tc": [
+                {
+                    "latency": 100,
+                    "destination_ip_addresses": ["8.8.8.8"],
+                    "destination_ports": ["80", "81"],
+                    "protocol": ["tcp"],
+                },
+                {"loss": 0.5, "source_ports": ["22"], "protocol": ["udp", "icmp"]},
+            ]
+        },
+        classifier="nftables",
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list][4:] == [
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 833334",
+        "sudo tc class add dev eth0 parent 10: classid 10:11 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:11 handle 101: netem loss 0.5%",
+        "sudo nft -f - <<'__FIT_EOF__'\n"
+        "add table inet fit-tc-eth0\n"
+        "delete table inet fit-tc-eth0\n"
+        "table inet fit-tc-eth0 {\n"
+        "  set tc0-dst4 { type ipv4_addr; flags interval; auto-merge; elements = { 8.8.8.8 } }\n"
+        "  set tc0-dport { type inet_service; flags interval; auto-merge; elements = { 80-81 } }\n"
+        "  set tc1-sport { type inet_service; flags interval; auto-merge; elements = { 22 } }\n"
+        "  chain postrouting {\n"
+        "    type filter hook postrouting priority -150; policy accept;\n"
+        '    oifname "eth0" meta l4proto tcp th dport @tc0-dport ip daddr @tc0-dst4 meta priority set 10:10\n'
+        '    oifname "eth0" meta l4proto udp th sport @tc1-sport meta priority set 10:11\n'
+        '    oifname "eth0" meta l4proto icmp meta priority set 10:11\n'
+        "  }\n"
+        "}\n"
+        "__FIT_EOF__",
+    ]
+
+
+def test_inject_traffic_control_should_throw_ValueError_when_classifier_is_invalid(
+    target: target,
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(
+            params={"tc": [{"latency": 100}]}, classifier="u32", target=target
+        )
+    assert str(error_info.value) == (
+        "'u32' is not a valid Classifier."
+        " The argument 'classifier' must be chosen between ['iptables', 'flower', 'nftables']."
+    )
+
+
+def test_inject_traffic_control_should_throw_ValueError_when_ipset_is_used_with_flower(
+    target: target,
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(
+            params={"tc": [{"latency": 100}]},
+            ipset=True,
+            classifier="flower",
+            target=target,
+        )
+    assert str(error_info.value) == (
+        "The argument 'ipset' cannot be used with the classifier 'flower'."
+    )
+
+
+def test_inject_traffic_control_should_use_the_detected_link_speed_as_htb_rate(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="25000 1\n")]
+        + [mock_exec_result() for _ in range(8)],
+    )
+    inject_traffic_control(
+        params={"tc": [{"latency": 100, "protocol": ["tcp"]}]}, target=target
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        ANY,
+        ANY,
+        QdiscSnapshot.save("eth0"),
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 25000mbit",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 25000mbit",
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 100ms limit 208334",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+    ]
+
+
+def test_inject_traffic_control_should_attach_netem_to_each_tx_queue_when_the_device_is_multiqueue(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="10000 2\n")]
+        + [mock_exec_result() for _ in range(6)],
+    )
+    inject_traffic_control(params={"tc": [{"latency": 100}]}, target=target)
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        ANY,
+        ANY,
+        QdiscSnapshot.save("eth0"),
+        "sudo tc qdisc add dev eth0 handle 10: root mq",
+        "sudo tc qdisc add dev eth0 parent 10:1 netem delay 100ms limit 83334",
+        "sudo tc qdisc add dev eth0 parent 10:2 netem delay 100ms limit 83334",
+    ]
+
+
+def test_inject_traffic_control_should_build_htb_per_tx_queue_when_classifier_is_flower_on_multiqueue_device(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="10000 2\n")]
+        + [mock_exec_result() for _ in range(14)],
+    )
+    inject_traffic_control(
+        params={"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+        classifier="flower",
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        ANY,
+        ANY,
+        QdiscSnapshot.save("eth0"),
+        "sudo tc qdisc add dev eth0 handle 10: root mq",
+        "sudo tc qdisc add dev eth0 handle 101: parent 10:1 htb default 1",
+        "sudo tc class add dev eth0 parent 101: classid 101:1 htb rate 10000mbit",
+        "sudo tc class add dev eth0 parent 101: classid 101:10 htb rate 10000mbit",
+        "sudo tc qdisc add dev eth0 parent 101:10 netem delay 100ms limit 83334",
+        "sudo tc filter add dev eth0 parent 101: protocol ip prio 2 flower ip_proto tcp classid 101:10",
+        "sudo tc qdisc add dev eth0 handle 102: parent 10:2 htb default 1",
+        "sudo tc class add dev eth0 parent 102: classid 102:1 htb rate 10000mbit",
+        "sudo tc class add dev eth0 parent 102: classid 102:10 htb rate 10000mbit",
+        "sudo tc qdisc add dev eth0 parent 102:10 netem delay 100ms limit 83334",
+        "sudo tc filter add dev eth0 parent 102: protocol ip prio 2 flower ip_proto tcp classid 102:10",
+    ]
+
+
+def test_inject_traffic_control_should_shape_bandwidth_with_the_htb_class(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(
+        params={
+            "tc": [
+                {"rate": "10mbit", "ceil": "20mbit", "burst": "15kb"},
+                {"latency": 100, "protocol": ["udp"]},
+            ]
+        },
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        ANY,
+        ANY,
+        QdiscSnapshot.save("eth0"),
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 100gbit",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 10mbit ceil 20mbit burst 15kb",
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+        "sudo tc class add dev eth0 parent 10: classid 10:11 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:11 handle 101: netem delay 100ms limit 833334",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:11 -p udp",
+    ]
+
+
+def test_inject_traffic_control_should_keep_a_single_htb_when_bandwidth_is_shaped_on_multiqueue_device(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="10000 2\n")]
+        + [mock_exec_result() for _ in range(10)],
+    )
+    inject_traffic_control(
+        params={"tc": [{"rate": "1gbit"}]}, classifier="flower", target=target
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list][4:8] == [
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo tc class add dev eth0 parent 10: classid 10:1 htb rate 10000mbit",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1gbit",
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem",
+    ]
+
+
+@pytest.mark.parametrize(
+    "tc, message",
+    [
+        ({"ceil": "10mbit"}, "The field 'ceil' of tc[0] requires 'rate'."),
+        ({"burst": "15kb"}, "The field 'burst' of tc[0] requires 'rate'."),
+        (
+            {"rate": "1gbit", "ceil": "100mbps"},
+            "The field 'ceil' of tc[0] must be greater than or equal to 'rate'.",
+        ),
+        ({"jitter": 10}, "The field 'jitter' of tc[0] requires 'latency'."),
+        (
+            {"latency": 100, "distribution": "normal"},
+            "The field 'distribution' of tc[0] requires 'jitter'.",
+        ),
+        (
+            {"latency": 100, "correlation": 25},
+            "The field 'correlation' of tc[0] requires 'jitter'.",
+        ),
+        ({"reorder": 25}, "The field 'reorder' of tc[0] requires 'latency'."),
+        (
+            {"slot": {"min_delay": 10, "max_delay": 5}},
+            "The field 'slot.max_delay' of tc[0] must be greater than or equal to 'slot.min_delay'.",
+        ),
+    ],
+)
+def test_inject_traffic_control_should_throw_ValueError_when_fields_are_inconsistent(
+    target: target, tc, message
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(params={"tc": [tc]}, target=target)
+    assert str(error_info.value) == message
+
+
+def test_inject_traffic_control_should_size_netem_limit_from_the_shaped_rate_and_packet_size(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="10000 1 1000000 10000\n")]
+        + [mock_exec_result() for _ in range(8)],
+    )
+    inject_traffic_control(
+        params={"tc": [{"latency": 200, "rate": "1gbit", "protocol": ["tcp"]}]},
+        target=target,
+    )
+    # 1gbit * 200ms / (8 * 100 bytes)
+    spy_exec_command.assert_any_call(
+        ANY,
+        "sudo tc qdisc add dev eth0 parent 10:10 handle 100: netem delay 200ms limit 250000",
+    )
+
+
+@pytest.mark.parametrize(
+    "tc, netem",
+    [
+        # 帯域幅と遅延の積がnetemのデフォルトのlimitに収まる場合はlimitを指定しない
+        ({"latency": 1, "rate": "10mbit"}, "netem delay 1ms"),
+        ({"loss": 0.1}, "netem loss 0.1%"),
+        # limitを明示した場合は計算した値の代わりに指定した値を使う
+        ({"latency": 100, "limit": 5000}, "netem delay 100ms limit 5000"),
+        ({"loss": 0.1, "limit": 5000}, "netem loss 0.1% limit 5000"),
+    ],
+)
+def test_inject_traffic_control_should_not_size_netem_limit_when_it_is_not_needed_or_given(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client, tc, netem
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(params={"tc": [tc]}, target=target)
+    assert any(
+        call.args[1].endswith(f" {netem}") for call in spy_exec_command.call_args_list
+    )
+
+
+@pytest.mark.parametrize(
+    "tc, netem",
+    [
+        (
+            {"latency": 100, "jitter": 20},
+            "netem delay 100ms 20ms limit 1000000",
+        ),
+        (
+            {
+                "latency": 100,
+                "jitter": 20,
+                "correlation": 25,
+                "distribution": "paretonormal",
+            },
+            "netem delay 100ms 20ms 25% distribution paretonormal limit 1000000",
+        ),
+        (
+            {"latency": 10, "reorder": 25, "duplicate": 1, "loss": 0.5},
+            "netem delay 10ms reorder 25% loss 0.5% duplicate 1% limit 83334",
+        ),
+        ({"slot": {"min_delay": 10}}, "netem slot 10ms"),
+        (
+            {"slot": {"min_delay": 1, "max_delay": 5, "packets": 32, "bytes": 65536}},
+            "netem slot 1ms 5ms packets 32 bytes 65536",
+        ),
+    ],
+)
+def test_inject_traffic_control_should_build_extended_netem_options(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client, tc, netem
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(params={"tc": [tc]}, target=target)
+    assert spy_exec_command.call_args_list[4].args[1] == (
+        f"sudo tc qdisc add dev eth0 handle 10: root {netem}"
+    )
+
+
+def test_inject_traffic_control_should_run_the_profile_on_the_target_and_return_the_timeline(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result() for _ in range(5)]
+        + [mock_exec_result(stdout="0 0 latency 100 0\n503 0 latency 150 0\n")],
+    )
+    timeline = inject_traffic_control(
+        params={
+            "tc": [
+                {
+                    "profile": {
+                        "shape": "ramp",
+                        "start": 100,
+                        "end": 200,
+                        "length": 1,
+                        "interval": 0.5,
+                    }
+                }
+            ]
+        },
+        target=target,
+    )
+    # 初期値はstartで,limitはプロファイルの最大値から計算する
+    assert spy_exec_command.call_args_list[4].args[1] == (
+        "sudo tc qdisc add dev eth0 handle 10: root netem delay 100ms limit 1666667"
+    )
+    profile_cmd = spy_exec_command.call_args_list[5].args[1]
+    assert profile_cmd.startswith("sudo sh -c ")
+    assert "tc qdisc change dev eth0 handle 10: root netem delay ${v}ms" in profile_cmd
+    assert timeline == [
+        {"time": 0.0, "tc": 0, "field": "latency", "value": 100, "exit_status": 0},
+        {"time": 0.503, "tc": 0, "field": "latency", "value": 150, "exit_status": 0},
+    ]
+
+
+def test_inject_traffic_control_should_throw_ValueError_when_the_loss_profile_exceeds_100_percent(
+    target: target,
+):
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(
+            params={
+                "tc": [
+                    {
+                        "profile": {
+                            "field": "loss",
+                            "shape": "step",
+                            "start": 10,
+                            "end": 120,
+                            "length": 10,
+                        }
+                    }
+                ]
+            },
+            target=target,
+        )
+    assert (
+        str(error_info.value)
+        == "The field 'profile' of tc[0] must stay within 100% of loss."
+    )
+
+
+def test_inject_traffic_control_should_share_the_htb_with_the_faults_already_on_the_device(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {"tc": [{"latency": 100, "protocol": ["tcp"]}]}
+    key = Allocation.key(normalize_traffic_control_params(params))
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[
+            mock_exec_result(),
+            mock_exec_result(stdout=f"0 0123456789abcdef 10\n1 {key} 10\n"),
+        ]
+        + [mock_exec_result() for _ in range(4)],
+    )
+    inject_traffic_control(params=params, target=target)
+    assert spy_exec_command.call_args_list[1].args[1] == Allocation.allocate(
+        "eth0", key, "10"
+    )
+    # the root qdisc, the default class and the snapshot belong to the first fault
+    assert [call.args[1] for call in spy_exec_command.call_args_list][3:] == [
+        "sudo tc class add dev eth0 parent 10: classid 10:110 htb rate 100gbit",
+        "sudo tc qdisc add dev eth0 parent 10:110 handle 200: netem delay 100ms limit 833334",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:110 -p tcp",
+    ]
+
+
+@pytest.mark.parametrize(
+    "params, registry",
+    [
+        # すべての通信に対する障害はqdiscの構成を共有できない
+        ({"tc": [{"latency": 100}]}, "0 0123456789abcdef 10\n"),
+        ({"tc": [{"latency": 100, "protocol": ["tcp"]}]}, "0 0123456789abcdef root\n"),
+    ],
+)
+def test_inject_traffic_control_should_release_the_slot_and_throw_ValueError_when_the_qdisc_tree_cannot_be_shared(
+    target: target,
+    mocker: MockerFixture,
+    mock_ssh_client: mock_ssh_client,
+    params,
+    registry,
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(), mock_exec_result(stdout=registry)]
+        + [mock_exec_result()],
+    )
+    with pytest.raises(ValueError) as error_info:
+        inject_traffic_control(params=params, target=target)
+    assert str(error_info.value) == (
+        "The device 'eth0' already has a traffic control fault that cannot share its qdisc tree."
+    )
+    key = Allocation.key(normalize_traffic_control_params(params))
+    assert spy_exec_command.call_args_list[-1].args[1] == Allocation.release(
+        "eth0", key
+    )
+
+
+def test_inject_traffic_control_should_set_a_timer_that_only_removes_the_fault_when_ttl_is_given(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {"tc": [{"latency": 100, "protocol": ["tcp"]}]}
+    normalized = normalize_traffic_control_params(params)
+    key = Allocation.key(normalized)
+    fault_id = Journal.fault_id("traffic_control", normalized)
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    inject_traffic_control(params=params, ttl=300, target=target)
+    # 最後の障害かどうかはタイマーの実行時にレジストリから判定し,
+    # 最後の障害の場合は保存したqdiscの構成は復元せずにルートのqdiscを削除する
+    assert spy_exec_command.call_args_list[3].args[1] == Journal.lease(
+        fault_id,
+        300,
+        [
+            Allocation.release_with(
+                "eth0",
+                key,
+                [
+                    "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+                    "sudo tc class del dev eth0 classid 10:10",
+                ],
+                [
+                    "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+                    "sudo tc qdisc del dev eth0 handle 10: root",
+                    QdiscSnapshot.discard("eth0"),
+                ],
+            )
+        ],
+        [Journal.discard(fault_id)],
+    )
+    assert spy_exec_command.call_args_list[4].args[1] == QdiscSnapshot.save("eth0")
+
+
+def test_inject_traffic_control_should_give_faults_on_different_devices_their_own_ipsets(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    set_names = []
+    for device in ("eth0", "eth1"):
+        spy_exec_command.reset_mock()
+        inject_traffic_control(
+            params={
+                "device": device,
+                "tc": [{"destination_ip_addresses": ["addr1"], "latency": 100}],
+            },
+            ipset=True,
+            target=target,
+        )
+        restore = next(
+            call.args[1]
+            for call in spy_exec_command.call_args_list
+            if call.args[1].startswith("sudo ipset restore")
+        )
+        set_names.append(restore.splitlines()[1].split()[1])
+    assert set_names[0] != set_names[1]
+    assert all(len(name) <= 31 for name in set_names)
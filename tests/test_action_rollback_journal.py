@@ -0,0 +1,195 @@
+import json
+
+from pytest_mock import MockerFixture
+
+import local_journal
+from src.action import inject_time_travel, rollback_all, rollback_journal
+from src.fault_journal import FILE_MARKER, Journal
+from src.plan import normalize_traffic_control_params
+from src.tc_registry import Allocation
+from target import Target
+from tests.conftest import mock_exec_result, mock_ssh_client, target
+
+
+def __entry(time: int, fault_id: str, action: str, arguments: dict) -> str:
+    data = json.dumps({"action": action, "arguments": arguments})
+    return f"{FILE_MARKER} {Journal.path(fault_id)}\n{time} {data}\n"
+
+
+def test_rollback_journal_should_roll_back_the_recorded_faults_newest_first(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = normalize_traffic_control_params({"tc": [{"latency": 100}]})
+    key = Allocation.key(params)
+    tc_id = Journal.fault_id("traffic_control", params)
+    block = {
+        "destination_ip_addresses": ["10.0.0.1"],
+        "destination_ports": None,
+        "source_ports": None,
+        "device": "eth0",
+        "tcp": True,
+        "udp": False,
+        "icmp": False,
+        "atomic": False,
+        "ipset": False,
+        "firewall": "iptables",
+    }
+    block_id = Journal.fault_id("traffic_block", block)
+    stdout = (
+        __entry(
+            100,
+            tc_id,
+            "traffic_control",
+            {
+                "params": params,
+                "atomic": False,
+                "ipset": False,
+                "classifier": "iptables",
+            },
+        )
+        + __entry(300, "time_travel", "time_travel", {"disable_ntp": True})
+        + __entry(200, block_id, "traffic_block", block)
+        + f"{FILE_MARKER} /run/fit/tc-eth0.registry\n0 {key} root\n"
+        + f"{FILE_MARKER} /run/fit/tc-eth0\nqdisc fq 8001: root refcnt 2\n"
+    )
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout=stdout)]
+        + [mock_exec_result() for _ in range(10)],
+    )
+    rollback_journal(exec_mode="exec", target=target)
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Journal.probe(),
+        "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP",
+        "sudo chronyc -a makestep",
+        "sudo iptables -D OUTPUT -o eth0 -p tcp -d 10.0.0.1 -j DROP",
+        "sudo tc qdisc del dev eth0 handle 10: root",
+        "sudo tc qdisc replace dev eth0 handle 8001: root fq",
+        "sudo rm -f /run/fit/tc-eth0",
+        # 記録は障害を削除できた後に破棄する
+        Journal.discard("time_travel"),
+        Journal.discard(block_id),
+        Allocation.release("eth0", key),
+        Journal.discard(tc_id),
+    ]
+
+
+def test_rollback_journal_should_only_roll_back_the_fault_of_the_given_id(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    stdout = __entry(
+        200, "traffic_block-0123456789abcdef", "traffic_block", {"icmp": False}
+    ) + __entry(100, "time_travel", "time_travel", {"disable_ntp": False})
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout=stdout)]
+        + [mock_exec_result() for _ in range(2)],
+    )
+    rollback_journal(fault_id="time_travel", exec_mode="exec", target=target)
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Journal.probe(),
+        "sudo chronyc -a makestep",
+        Journal.discard("time_travel"),
+    ]
+
+
+def test_rollback_journal_should_do_nothing_when_the_journal_is_empty(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    assert rollback_journal(target=target) == []
+    spy_exec_command.assert_called_once_with(mocker.ANY, Journal.probe())
+
+
+def test_rollback_all_should_roll_back_the_faults_recorded_on_the_controller(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    inject_time_travel(offset=10, exec_mode="exec", target=target)
+    # 他のコントローラーが設定した障害はロールバックしない
+    stdout = __entry(
+        200, "traffic_block-0123456789abcdef", "traffic_block", {"icmp": False}
+    ) + __entry(100, "time_travel", "time_travel", {"disable_ntp": True})
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout=stdout)]
+        + [mock_exec_result() for _ in range(3)],
+    )
+    results = rollback_all(exec_mode="exec")
+    assert list(results) == [target["hostname"]]
+    assert results[target["hostname"]]["status"] == "succeeded"
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Journal.probe(),
+        "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP",
+        "sudo chronyc -a makestep",
+        Journal.discard("time_travel"),
+    ]
+    assert local_journal.journal.outstanding() == {}
+    assert rollback_all() == {}
+
+
+def test_rollback_all_should_not_run_the_rollback_of_a_fault_without_the_remote_record(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    inject_time_travel(offset=10, exec_mode="exec", target=target)
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    results = rollback_all(exec_mode="exec")
+    assert results[target["hostname"]] == {"status": "succeeded", "result": []}
+    spy_exec_command.assert_called_once_with(mocker.ANY, Journal.probe())
+    assert local_journal.journal.outstanding() == {}
+
+
+def test_rollback_all_should_keep_the_fault_outstanding_when_the_rollback_failed(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    inject_time_travel(offset=10, exec_mode="exec", target=target)
+    stdout = __entry(100, "time_travel", "time_travel", {"disable_ntp": False})
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[
+            mock_exec_result(stdout=stdout),
+            mock_exec_result(exit_status=1),
+            mock_exec_result(),
+        ],
+    )
+    rollback_all(exec_mode="exec")
+    outstanding = local_journal.journal.outstanding()
+    assert [entry.fault_id for entry in outstanding[Target.from_(target)]] == [
+        "time_travel"
+    ]
+    # 失敗したロールバックは記録を残し,やり直せるようにする
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Journal.probe(),
+        "sudo chronyc -a makestep",
+    ]
+
+
+def test_rollback_all_should_treat_the_rules_that_are_already_gone_as_rolled_back(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    inject_time_travel(offset=10, disable_ntp=True, exec_mode="exec", target=target)
+    stdout = __entry(100, "time_travel", "time_travel", {"disable_ntp": True})
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[
+            mock_exec_result(stdout=stdout),
+            mock_exec_result(
+                stderr="iptables: Bad rule (does a matching rule exist in that chain?).",
+                exit_status=1,
+            ),
+            mock_exec_result(),
+            mock_exec_result(),
+        ],
+    )
+    rollback_all(exec_mode="exec")
+    assert spy_exec_command.call_args_list[-1].args[1] == Journal.discard("time_travel")
+    assert local_journal.journal.outstanding() == {}
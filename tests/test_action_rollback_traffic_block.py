@@ -4,9 +4,27 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import rollback_traffic_block
+from src.plan import traffic_block_fault
 from tests.conftest import mock_ssh_client, target
 
 
+def __digest(**arguments) -> str:
+    # the digest of the fault ID that names the table and the ipsets of a block
+    fault_id, _ = traffic_block_fault(
+        **{
+            "destination_ip_addresses": None,
+            "device": "eth0",
+            "destination_ports": None,
+            "source_ports": None,
+            "tcp": True,
+            "udp": True,
+            "icmp": True,
+            **arguments,
+        }
+    )
+    return fault_id.rsplit("-", 1)[-1][:12]
+
+
 @pytest.mark.parametrize(
     argnames="args,expected",
     argvalues=[
@@ -131,7 +149,7 @@ def test_inject_traffic_block_should_call_exec_command_with_iptables(
     spy_exec_command.assert_has_calls(
         list(map(lambda cmd: mocker.call(ANY, cmd), expected))
     )
-    assert spy_exec_command.call_count == len(expected)
+    assert spy_exec_command.call_count == len(expected) + 1
 
 
 def test_inject_traffic_block_should_throw_ValueError_when_the_argument_target_is_invalid():
@@ -142,3 +160,51 @@ def test_inject_traffic_block_should_throw_ValueError_when_the_argument_target_i
     with pytest.raises(ValueError) as error_info:
         rollback_traffic_block(target=invalid_target)
     assert str(error_info.value) == "'username' is not found in target."
+
+
+def test_rollback_traffic_block_should_destroy_ipsets_after_deleting_rules_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    args = {
+        "destination_ip_addresses": ["192.168.0.1"],
+        "source_ports": ["22"],
+        "tcp": False,
+        "udp": False,
+        "ipset": True,
+    }
+    rollback_traffic_block(**args, target=target)
+    name = f"fit-block-{__digest(**args)}"
+    assert spy_exec_command.call_args_list[:-1] == [
+        mocker.call(
+            ANY,
+            "sudo iptables -D OUTPUT -o eth0 -p icmp"
+            f" -m set --match-set {name}-dst dst -j DROP",
+        ),
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {name}-dst hash:net\n"
+            f"destroy {name}-dst\n"
+            f"create {name}-sport bitmap:port range 0-65535\n"
+            f"destroy {name}-sport\n"
+            "__FIT_EOF__",
+        ),
+    ]
+
+
+def test_rollback_traffic_block_should_delete_the_table_when_firewall_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    args = {"destination_ip_addresses": ["192.168.0.1"], "firewall": "nftables"}
+    rollback_traffic_block(**args, target=target)
+    assert spy_exec_command.call_args_list[:-1] == [
+        mocker.call(
+            ANY,
+            "sudo nft -f - <<'__FIT_EOF__'\n"
+            f"add table inet fit-block-eth0-{__digest(**args)}\n"
+            f"delete table inet fit-block-eth0-{__digest(**args)}\n"
+            "__FIT_EOF__",
+        )
+    ]
@@ -4,19 +4,19 @@ import pytest
 from pytest_mock import MockerFixture
 
 from src.action import rollback_traffic_control
-from tests.conftest import mock_ssh_client, target
+from src.plan import normalize_traffic_control_params
+from src.qdisc_snapshot import QdiscSnapshot
+from src.tc_registry import Allocation
+from tests.conftest import mock_exec_result, mock_ssh_client, target
 
 
 @pytest.mark.parametrize(
     argnames="input,expected",
     argvalues=[
-        # 0:すべての通信に遅延をかける設定を削除
+        # 0:すべての通信に遅延をかける設定を削除する場合はiptablesのルールを削除しない
         (
             {"tc": [{"latency": 100}]},
             [
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
                 "sudo tc qdisc del dev eth0 handle 10: root",
             ],
         ),
@@ -24,9 +24,6 @@ from tests.conftest import mock_ssh_client, target
         (
             {"tc": [{"loss": 0.1}]},
             [
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
                 "sudo tc qdisc del dev eth0 handle 10: root",
             ],
         ),
@@ -34,9 +31,6 @@ from tests.conftest import mock_ssh_client, target
         (
             {"tc": [{"loss": 0.5, "corrupt": True}]},
             [
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
                 "sudo tc qdisc del dev eth0 handle 10: root",
             ],
         ),
@@ -44,9 +38,6 @@ from tests.conftest import mock_ssh_client, target
         (
             {"tc": [{"latency": 100, "loss": 0.1}]},
             [
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
-                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
                 "sudo tc qdisc del dev eth0 handle 10: root",
             ],
         ),
@@ -228,6 +219,16 @@ from tests.conftest import mock_ssh_client, target
                 "sudo tc qdisc del dev ens33 handle 10: root",
             ],
         ),
+        # 15:すべての通信の帯域を制限する設定を削除する場合はiptablesのルールも削除する
+        (
+            {"tc": [{"rate": "10mbit", "protocol": ["icmp", "tcp", "udp"]}]},
+            [
+                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
+                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+                "sudo tc qdisc del dev eth0 handle 10: root",
+            ],
+        ),
     ],
 )
 def test_inject_traffic_control_should_call_exec_command_with_tc_and_iptables(
@@ -239,6 +240,13 @@ def test_inject_traffic_control_should_call_exec_command_with_tc_and_iptables(
 ):
     spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
     rollback_traffic_control(params=input, target=target)
+    device = input.get("device", "eth0")
+    key = Allocation.key(normalize_traffic_control_params(input))
+    expected = (
+        [Allocation.probe(device), QdiscSnapshot.probe(device)]
+        + expected
+        + [QdiscSnapshot.discard(device), Allocation.release(device, key), ANY]
+    )
     spy_exec_command.assert_has_calls(
         list(map(lambda cmd: mocker.call(ANY, cmd), expected))
     )
@@ -270,3 +278,218 @@ def test_inject_traffic_control_should_throw_ValueError_when_the_argument_target
     with pytest.raises(ValueError) as error_info:
         rollback_traffic_control(params=params, target=invalid_target)
     assert str(error_info.value) == "'username' is not found in target."
+
+
+def test_rollback_traffic_control_should_delete_rules_before_qdisc_when_atomic_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    rollback_traffic_control(
+        params={"tc": [{"latency": 100, "protocol": ["icmp"]}]},
+        atomic=True,
+        target=target,
+    )
+    assert spy_exec_command.call_args_list[2:] == [
+        mocker.call(
+            ANY,
+            "sudo iptables-restore --noflush <<'__FIT_EOF__' 2>/dev/null"
+            " || sudo sh -c 'r=0; iptables -D POSTROUTING -t mangle -j CLASSIFY"
+            " --set-class 10:10 -p icmp || r=1; exit $r'\n"
+            "*mangle\n"
+            "-D POSTROUTING -j CLASSIFY --set-class 10:10 -p icmp\n"
+            "COMMIT\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(
+            ANY,
+            "sudo tc -force -batch - <<'__FIT_EOF__'\n"
+            "qdisc del dev eth0 handle 10: root\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(ANY, "sudo rm -f /run/fit/tc-eth0"),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, ANY),
+    ]
+
+
+def test_rollback_traffic_control_should_destroy_ipsets_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {
+        "tc": [
+            {
+                "destination_ip_addresses": ["addr1", "addr2"],
+                "latency": 100,
+                "protocol": ["udp"],
+            }
+        ]
+    }
+    name = f"fit-tc-{Allocation.key(normalize_traffic_control_params(params))[:12]}-0"
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    rollback_traffic_control(
+        params=params,
+        ipset=True,
+        target=target,
+    )
+    assert spy_exec_command.call_args_list[2:] == [
+        mocker.call(
+            ANY,
+            "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp"
+            f" -m set --match-set {name}-dst dst",
+        ),
+        mocker.call(ANY, "sudo tc qdisc del dev eth0 handle 10: root"),
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {name}-dst hash:net\n"
+            f"destroy {name}-dst\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(ANY, "sudo rm -f /run/fit/tc-eth0"),
+        mocker.call(ANY, ANY),
+        mocker.call(ANY, ANY),
+    ]
+
+
+def test_rollback_traffic_control_should_only_delete_root_qdisc_when_classifier_is_flower(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    rollback_traffic_control(
+        params={"tc": [{"latency": 100, "destination_ports": ["80"]}]},
+        classifier="flower",
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        ANY,
+        "cat /run/fit/tc-eth0 2>/dev/null",
+        "sudo tc qdisc del dev eth0 handle 10: root",
+        "sudo rm -f /run/fit/tc-eth0",
+        ANY,
+        ANY,
+    ]
+
+
+def test_rollback_traffic_control_should_delete_the_nftables_table_and_the_root_qdisc_when_classifier_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    rollback_traffic_control(
+        params={"tc": [{"latency": 100, "destination_ports": ["80"]}]},
+        classifier="nftables",
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        ANY,
+        "cat /run/fit/tc-eth0 2>/dev/null",
+        "sudo nft -f - <<'__FIT_EOF__'\n"
+        "add table inet fit-tc-eth0\n"
+        "delete table inet fit-tc-eth0\n"
+        "__FIT_EOF__",
+        "sudo tc qdisc del dev eth0 handle 10: root",
+        "sudo rm -f /run/fit/tc-eth0",
+        ANY,
+        ANY,
+    ]
+
+
+def test_rollback_traffic_control_should_restore_the_saved_qdiscs_and_classes(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    snapshot = (
+        "qdisc mq 8001: root\n"
+        "qdisc fq 8002: parent 8001:1 limit 10000p flow_limit 100p\n"
+        "qdisc ingress ffff: parent ffff:fff1 ----------------\n"
+        "class mq 8001:1 root leaf 8002:\n"
+    )
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(), mock_exec_result(stdout=snapshot)]
+        + [mock_exec_result() for _ in range(6)],
+    )
+    rollback_traffic_control(params={"tc": [{"latency": 100}]}, target=target)
+    assert [call.args[1] for call in spy_exec_command.call_args_list][2:] == [
+        "sudo tc qdisc del dev eth0 handle 10: root",
+        "sudo tc qdisc replace dev eth0 handle 8001: root mq",
+        "sudo tc qdisc replace dev eth0 handle 8002: parent 8001:1 fq limit 10000 flow_limit 100",
+        "sudo rm -f /run/fit/tc-eth0",
+        ANY,
+        ANY,
+    ]
+
+
+@pytest.mark.parametrize(
+    "classifier, expected",
+    [
+        (
+            "iptables",
+            [
+                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:110 -p tcp",
+                "sudo tc class del dev eth0 classid 10:110",
+            ],
+        ),
+        (
+            "flower",
+            [
+                "sudo tc filter del dev eth0 parent 10: prio 202",
+                "sudo tc class del dev eth0 classid 10:110",
+            ],
+        ),
+        (
+            "nftables",
+            [
+                "sudo nft -f - <<'__FIT_EOF__'\n"
+                "add table inet fit-tc-eth0-1\n"
+                "delete table inet fit-tc-eth0-1\n"
+                "__FIT_EOF__",
+                "sudo tc class del dev eth0 classid 10:110",
+            ],
+        ),
+    ],
+)
+def test_rollback_traffic_control_should_only_delete_its_classes_when_other_faults_remain(
+    target: target,
+    mocker: MockerFixture,
+    mock_ssh_client: mock_ssh_client,
+    classifier,
+    expected,
+):
+    params = {"tc": [{"latency": 100, "protocol": ["tcp"]}]}
+    key = Allocation.key(normalize_traffic_control_params(params))
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout=f"0 0123456789abcdef 10\n1 {key} 10\n")]
+        + [mock_exec_result() for _ in range(4)],
+    )
+    rollback_traffic_control(params=params, classifier=classifier, target=target)
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Allocation.probe("eth0")
+    ] + expected + [Allocation.release("eth0", key), ANY]
+
+
+def test_rollback_traffic_control_should_keep_the_slot_when_the_rollback_failed(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {"tc": [{"latency": 100, "protocol": ["tcp"]}]}
+    key = Allocation.key(normalize_traffic_control_params(params))
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[
+            mock_exec_result(stdout=f"1 {key} 10\n"),
+            mock_exec_result(),
+            mock_exec_result(
+                exit_status=4, stderr="Another app is holding the xtables lock"
+            ),
+        ]
+        + [mock_exec_result() for _ in range(3)],
+    )
+    rollback_traffic_control(params=params, target=target)
+    cmd_lst = [call.args[1] for call in spy_exec_command.call_args_list]
+    assert cmd_lst[0] == Allocation.probe("eth0")
+    assert Allocation.release("eth0", key) not in cmd_lst
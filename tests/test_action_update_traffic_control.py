@@ -0,0 +1,279 @@
+from unittest.mock import ANY
+
+import pytest
+from pytest_mock import MockerFixture
+
+from src.action import update_traffic_control
+from src.fault_journal import Journal
+from src.link import Link
+from src.plan import normalize_traffic_control_params
+from src.tc_registry import Allocation
+from tests.conftest import mock_exec_result, mock_ssh_client, target
+
+
+@pytest.mark.parametrize(
+    argnames="params,new_params,expected",
+    argvalues=[
+        # 0:すべての通信に対する遅延を変更する場合はルートのnetemだけを変更する
+        (
+            {"tc": [{"latency": 100}]},
+            {"tc": [{"latency": 200, "jitter": 10}]},
+            [
+                "sudo tc qdisc change dev eth0 handle 10: root netem delay 200ms 10ms limit 1750000",
+            ],
+        ),
+        # 1:変更がない場合は何も実行しない
+        (
+            {"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+            {"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+            [],
+        ),
+        # 2:netemとHTBのクラスの設定だけを変更する場合はiptablesのルールを変更しない
+        # (帯域を制限するとnetemのlimitも小さくなる)
+        (
+            {"tc": [{"latency": 100, "protocol": ["tcp"]}, {"loss": 0.1}]},
+            {
+                "tc": [
+                    {"latency": 100, "protocol": ["tcp"], "rate": "10mbit"},
+                    {"loss": 0.5},
+                ]
+            },
+            [
+                "sudo tc class change dev eth0 parent 10: classid 10:10 htb rate 10mbit",
+                "sudo tc qdisc change dev eth0 parent 10:10 handle 100: netem delay 100ms",
+                "sudo tc qdisc change dev eth0 parent 10:11 handle 101: netem loss 0.5%",
+            ],
+        ),
+        # 3:宛先を変更する場合は追加されたルールを追加してから削除されたルールを削除する
+        (
+            {
+                "tc": [
+                    {
+                        "latency": 100,
+                        "destination_ip_addresses": ["8.8.8.8", "4.4.4.4"],
+                        "protocol": ["tcp"],
+                    }
+                ]
+            },
+            {
+                "tc": [
+                    {
+                        "latency": 100,
+                        "destination_ip_addresses": ["8.8.8.8", "1.1.1.1"],
+                        "protocol": ["tcp"],
+                    }
+                ]
+            },
+            [
+                "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 1.1.1.1",
+                "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 4.4.4.4",
+            ],
+        ),
+    ],
+)
+def test_update_traffic_control_should_only_apply_the_difference(
+    target: target,
+    mocker: MockerFixture,
+    mock_ssh_client: mock_ssh_client,
+    params,
+    new_params,
+    expected,
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    update_traffic_control(params=params, new_params=new_params, target=target)
+    # the registry is updated to find the fault by the new parameters
+    rename = [ANY] * 4 if new_params != params else []
+    assert [call.args[1] for call in spy_exec_command.call_args_list] == [
+        Link.probe("eth0"),
+        Allocation.probe("eth0"),
+    ] + expected + rename
+
+
+def test_update_traffic_control_should_change_netem_of_each_tx_queue_when_the_device_is_multiqueue(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        autospec=True,
+        side_effect=[mock_exec_result(stdout="10000 2\n")]
+        + [mock_exec_result() for _ in range(7)],
+    )
+    update_traffic_control(
+        params={"tc": [{"loss": 0.1}]},
+        new_params={"tc": [{"loss": 1.0}]},
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list][2:-4] == [
+        "sudo tc qdisc change dev eth0 parent 10:1 netem loss 1.0%",
+        "sudo tc qdisc change dev eth0 parent 10:2 netem loss 1.0%",
+    ]
+
+
+def test_update_traffic_control_should_switch_to_the_sets_of_the_new_fault_when_ipset_is_true(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = {
+        "tc": [
+            {
+                "latency": 100,
+                "destination_ip_addresses": ["addr1", "addr2"],
+                "source_ports": ["p1"],
+                "protocol": ["tcp"],
+            }
+        ]
+    }
+    new_params = {
+        "tc": [
+            {
+                "latency": 100,
+                "destination_ip_addresses": ["addr1", "addr3"],
+                "protocol": ["tcp"],
+            }
+        ]
+    }
+    old = f"fit-tc-{Allocation.key(normalize_traffic_control_params(params))[:12]}-0"
+    new = (
+        f"fit-tc-{Allocation.key(normalize_traffic_control_params(new_params))[:12]}-0"
+    )
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    update_traffic_control(
+        params=params, new_params=new_params, ipset=True, target=target
+    )
+    assert spy_exec_command.call_args_list[2:-4] == [
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {new}-dst hash:net\n"
+            f"flush {new}-dst\n"
+            f"add {new}-dst addr1\n"
+            f"add {new}-dst addr3\n"
+            "__FIT_EOF__",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp"
+            f" -m set --match-set {new}-dst dst",
+        ),
+        mocker.call(
+            ANY,
+            "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp"
+            f" -m set --match-set {old}-sport src -m set --match-set {old}-dst dst",
+        ),
+        mocker.call(
+            ANY,
+            "sudo ipset restore -exist <<'__FIT_EOF__'\n"
+            f"create {old}-dst hash:net\n"
+            f"destroy {old}-dst\n"
+            f"create {old}-sport bitmap:port range 0-65535\n"
+            f"destroy {old}-sport\n"
+            "__FIT_EOF__",
+        ),
+    ]
+
+
+def test_update_traffic_control_should_replace_the_filters_of_a_changed_entry_when_classifier_is_flower(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    update_traffic_control(
+        params={
+            "tc": [
+                {"latency": 100, "destination_ports": ["80"], "protocol": ["tcp"]},
+                {"loss": 0.1, "protocol": ["udp"]},
+            ]
+        },
+        new_params={
+            "tc": [
+                {"latency": 100, "destination_ports": ["443"], "protocol": ["tcp"]},
+                {"loss": 0.1, "protocol": ["udp"]},
+            ]
+        },
+        classifier="flower",
+        target=target,
+    )
+    # 新しいフィルタを直前に照合される空きのprioに追加してから古いフィルタを削除する
+    assert [call.args[1] for call in spy_exec_command.call_args_list][2:-4] == [
+        "sudo tc filter add dev eth0 parent 10: protocol ip prio 3 flower ip_proto tcp dst_port 443 classid 10:10",
+        "sudo tc filter del dev eth0 parent 10: prio 4",
+        "sudo tc filter add dev eth0 parent 10: protocol ip prio 4 flower ip_proto tcp dst_port 443 classid 10:10",
+        "sudo tc filter del dev eth0 parent 10: prio 3",
+    ]
+
+
+def test_update_traffic_control_should_replace_the_table_in_one_transaction_when_classifier_is_nftables(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    update_traffic_control(
+        params={
+            "tc": [{"latency": 100, "destination_ports": ["80"], "protocol": ["tcp"]}]
+        },
+        new_params={
+            "tc": [{"latency": 100, "destination_ports": ["443"], "protocol": ["tcp"]}]
+        },
+        classifier="nftables",
+        target=target,
+    )
+    assert [call.args[1] for call in spy_exec_command.call_args_list][2:-4] == [
+        "sudo nft -f - <<'__FIT_EOF__'\n"
+        "add table inet fit-tc-eth0\n"
+        "delete table inet fit-tc-eth0\n"
+        "table inet fit-tc-eth0 {\n"
+        "  set tc0-dport { type inet_service; flags interval; auto-merge; elements = { 443 } }\n"
+        "  chain postrouting {\n"
+        "    type filter hook postrouting priority -150; policy accept;\n"
+        '    oifname "eth0" meta l4proto tcp th dport @tc0-dport meta priority set 10:10\n'
+        "  }\n"
+        "}\n"
+        "__FIT_EOF__",
+    ]
+
+
+@pytest.mark.parametrize(
+    "new_params, message",
+    [
+        (
+            {"device": "ens33", "tc": [{"latency": 200}]},
+            "The argument 'new_params' must have the same device and the same number of tc entries as 'params'.",
+        ),
+        (
+            {"tc": [{"latency": 200}, {"loss": 0.1}]},
+            "The argument 'new_params' must have the same device and the same number of tc entries as 'params'.",
+        ),
+        (
+            {"tc": [{"latency": 200, "protocol": ["tcp"]}]},
+            "The argument 'new_params' cannot change the qdisc tree built for 'params'.",
+        ),
+    ],
+)
+def test_update_traffic_control_should_throw_ValueError_when_the_change_cannot_be_applied_in_place(
+    target: target, mock_ssh_client: mock_ssh_client, new_params, message
+):
+    with pytest.raises(ValueError) as error_info:
+        update_traffic_control(
+            params={"tc": [{"latency": 100}]}, new_params=new_params, target=target
+        )
+    assert str(error_info.value) == message
+
+
+def test_update_traffic_control_should_throw_ValueError_when_validating_new_params_failed():
+    with pytest.raises(ValueError, match=r"Validate arguments is failed:.*"):
+        update_traffic_control(params={"tc": [{"latency": 100}]}, new_params={"tc": []})
+
+
+def test_update_traffic_control_should_move_the_timer_to_the_new_fault_id(
+    target: target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    params = normalize_traffic_control_params({"tc": [{"latency": 100}]})
+    new_params = normalize_traffic_control_params({"tc": [{"latency": 200}]})
+    fault_id = Journal.fault_id("traffic_control", params)
+    new_fault_id = Journal.fault_id("traffic_control", new_params)
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    update_traffic_control(params=params, new_params=new_params, target=target)
+    rearm, discard = [call.args[1] for call in spy_exec_command.call_args_list][-2:]
+    # 古いタイマーの残りの時間で新しいIDのタイマーを設定してから,古いタイマーを解除する
+    assert rearm.startswith("sudo sh -c ")
+    assert f"/run/fit/lease/{fault_id} ]" in rearm
+    assert f"--unit={Journal.unit(new_fault_id)}" in rearm
+    assert discard == Journal.discard(fault_id)
@@ -0,0 +1,279 @@
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+import pytest
+from pytest_mock import MockerFixture
+
+import agent_client
+from src.action import inject_cpu_stress, inject_process_kill, inject_traffic_block
+from target import Target
+from tests.conftest import mock_exec_result, mock_ssh_client
+
+
+class LocalAgentChannel:
+    def __init__(self, proc: subprocess.Popen):
+        self.proc = proc
+        self.closed = False
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def close(self):
+        self.closed = True
+        self.proc.wait(timeout=5)
+
+
+class LocalAgentStdin:
+    def __init__(self, channel: LocalAgentChannel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.proc.stdin.write(data)
+
+    def flush(self):
+        self.channel.proc.stdin.flush()
+
+
+class LocalAgentStdout:
+    def __init__(self, channel: LocalAgentChannel):
+        self.channel = channel
+
+    def readline(self):
+        return self.channel.proc.stdout.readline()
+
+
+class LocalAgentStderr:
+    def __init__(self, channel: LocalAgentChannel):
+        self.channel = channel
+
+    def read(self):
+        return self.channel.proc.stderr.read().encode()
+
+
+def start_local_agent(args=None):
+    """ターゲットの代わりにローカルでエージェントを起動し,exec_commandの戻り値と同じ組を返す"""
+    proc = subprocess.Popen(
+        args
+        or [
+            sys.executable,
+            agent_client.__file__.replace("agent_client", "fault_agent"),
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    channel = LocalAgentChannel(proc)
+    return (
+        LocalAgentStdin(channel),
+        LocalAgentStdout(channel),
+        LocalAgentStderr(channel),
+    )
+
+
+@pytest.fixture
+def local_agent(mocker: MockerFixture, mock_ssh_client: mock_ssh_client):
+    def exec_command(self, command):
+        if command.startswith("sudo python3"):
+            return start_local_agent()
+        return mock_exec_result()
+
+    return mocker.patch.object(
+        mock_ssh_client, "exec_command", autospec=True, side_effect=exec_command
+    )
+
+
+@pytest.fixture
+def agent_target() -> Target:
+    return Target(hostname="localhost", username="user", key_filename="/foo/baz/bar")
+
+
+def test_session_should_skip_upload_when_the_agent_is_already_installed(
+    local_agent, agent_target: Target, mocker: MockerFixture
+):
+    agent_client.session(agent_target)
+    assert [call.args[1] for call in local_agent.call_args_list] == [
+        f"echo '{agent_client.DIGEST}  {agent_client.REMOTE_PATH}' | sha256sum -c --status",
+        f"sudo python3 {agent_client.REMOTE_PATH}",
+    ]
+
+
+def test_session_should_upload_the_agent_when_hash_check_fails(
+    agent_target: Target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    stdin = mocker.MagicMock()
+
+    def exec_command(self, command):
+        if command.startswith("echo"):
+            return mock_exec_result(exit_status=1)
+        if command.startswith("sudo python3"):
+            return start_local_agent()
+        return mock_exec_result(stdin=stdin)
+
+    spy_exec_command = mocker.patch.object(
+        mock_ssh_client, "exec_command", autospec=True, side_effect=exec_command
+    )
+    agent_client.session(agent_target)
+    assert spy_exec_command.call_args_list[1].args[1] == (
+        "umask 077 && mkdir -p .cache/fault-agent"
+        f" && cat > {agent_client.REMOTE_PATH}.$$"
+        f" && mv {agent_client.REMOTE_PATH}.$$ {agent_client.REMOTE_PATH}"
+    )
+    stdin.write.assert_called_once_with(agent_client.SOURCE)
+    stdin.channel.shutdown_write.assert_called_once()
+
+
+def test_session_should_throw_RuntimeError_when_upload_fails(
+    agent_target: Target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    mocker.patch.object(
+        mock_ssh_client,
+        "exec_command",
+        return_value=mock_exec_result(
+            stderr="No space left on device\n", exit_status=1
+        ),
+    )
+    with pytest.raises(RuntimeError) as error_info:
+        agent_client.session(agent_target)
+    assert str(error_info.value) == (
+        "Failed to install the fault agent: No space left on device\n"
+    )
+
+
+def test_session_should_throw_RuntimeError_when_the_agent_exits_unexpectedly(
+    agent_target: Target, mocker: MockerFixture, mock_ssh_client: mock_ssh_client
+):
+    def exec_command(self, command):
+        if command.startswith("sudo python3"):
+            return start_local_agent(
+                ["sh", "-c", "echo 'sudo: a password is required' >&2"]
+            )
+        return mock_exec_result()
+
+    mocker.patch.object(
+        mock_ssh_client, "exec_command", autospec=True, side_effect=exec_command
+    )
+    with pytest.raises(RuntimeError) as error_info:
+        agent_client.session(agent_target)
+    assert str(error_info.value) == (
+        "The fault agent exited unexpectedly: sudo: a password is required\n"
+    )
+
+
+def test_session_should_reuse_the_running_agent(local_agent, agent_target: Target):
+    agent = agent_client.session(agent_target)
+    assert agent_client.session(agent_target) is agent
+    assert local_agent.call_count == 2
+
+
+def test_session_should_restart_the_agent_when_it_has_exited(
+    local_agent, agent_target: Target
+):
+    agent = agent_client.session(agent_target)
+    agent.close()
+    assert agent_client.session(agent_target) is not agent
+    assert local_agent.call_count == 4
+
+
+def test_run_should_execute_command_without_sudo_and_return_its_result(
+    local_agent, agent_target: Target
+):
+    result = agent_client.session(agent_target).run("sudo echo hello; exit 3")
+    assert asdict(result) == {
+        "command": "sudo echo hello; exit 3",
+        "exit_status": 3,
+        "stdout": "hello\n",
+        "stderr": "",
+        "duration": result.duration,
+        "truncated": False,
+    }
+
+
+def test_request_should_answer_ping(local_agent, agent_target: Target):
+    res = agent_client.session(agent_target).request("ping")
+    assert res == {"exit_status": 0, "stdout": "", "stderr": "", "id": 1}
+
+
+def test_run_should_not_wait_for_a_slower_command_sent_before_it(
+    local_agent, agent_target: Target, tmp_path
+):
+    agent = agent_client.session(agent_target)
+    done = tmp_path / "done"
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # 先に送ったコマンドは,後に送ったコマンドがファイルを作るまで(最大5秒)待つ
+        slow = executor.submit(
+            agent.run,
+            f"for i in $(seq 500); do [ -f {done} ] && break; sleep 0.01; done;"
+            f" [ -f {done} ] && echo slow",
+        )
+        fast = agent.run(f"touch {done}; echo fast")
+        assert fast.stdout == "fast\n"
+        assert slow.result(timeout=5).stdout == "slow\n"
+
+
+def test_stop_should_stop_the_command_started_in_the_background(
+    local_agent, agent_target: Target, tmp_path
+):
+    agent = agent_client.session(agent_target)
+    command = f"sudo sh -c 'echo started; touch {tmp_path / 'started'}; sleep 30'"
+    handle = agent.start(command)
+    # バックグラウンドのコマンドの実行中も他のリクエストに応答する
+    assert agent.request("ping")["exit_status"] == 0
+    while not (tmp_path / "started").exists():
+        time.sleep(0.01)
+    result = agent.stop(handle)
+    assert result.command == command
+    assert result.exit_status == -signal.SIGTERM
+    assert result.stdout == "started\n"
+    assert result.duration < 30
+    with pytest.raises(ValueError) as error_info:
+        agent.stop(handle)
+    assert str(error_info.value) == f"Unknown handle: {handle}"
+
+
+def test_inject_traffic_block_should_run_commands_on_agent_when_exec_mode_is_agent(
+    target, mocker: MockerFixture
+):
+    spy_run_commands = mocker.patch.object(
+        agent_client, "run_commands", return_value=[]
+    )
+    results = inject_traffic_block(icmp=False, exec_mode="agent", target=target)
+    spy_run_commands.assert_called_once_with(
+        Target.from_(target),
+        [
+            mocker.ANY,
+            "sudo iptables -A OUTPUT -o eth0 -p tcp -j DROP",
+            "sudo iptables -A OUTPUT -o eth0 -p udp -j DROP",
+        ],
+    )
+    assert results == []
+
+
+def test_inject_process_kill_should_not_use_sudo_when_exec_mode_is_agent(
+    target, mocker: MockerFixture
+):
+    spy_run_commands = mocker.patch.object(
+        agent_client, "run_commands", return_value=[]
+    )
+    inject_process_kill(
+        pid_lst=[12345], kill_children=True, exec_mode="agent", target=target
+    )
+    spy_run_commands.assert_called_once_with(
+        Target.from_(target), ["pkill -KILL -P 12345", "kill -KILL 12345"]
+    )
+
+
+def test_inject_cpu_stress_should_run_the_command_on_agent_when_exec_mode_is_agent(
+    target, mocker: MockerFixture
+):
+    spy_session = mocker.patch.object(agent_client, "session")
+    inject_cpu_stress(cores=2, percent=50, length=10, exec_mode="agent", target=target)
+    spy_session.assert_called_once_with(Target.from_(target))
+    spy_session.return_value.run.assert_called_once_with("stress-ng -c 2 -l 50 -t 10")
@@ -0,0 +1,293 @@
+import asyncio
+
+import pytest
+from pytest_mock import MockerFixture
+
+import local_journal
+from src.async_action import (
+    inject_cpu_stress,
+    inject_latency_matrix,
+    inject_process_kill,
+    inject_time_travel,
+    inject_traffic_control,
+    rollback_all,
+    rollback_journal,
+    rollback_traffic_block,
+    rollback_traffic_control,
+    update_traffic_control,
+)
+from src.fault_journal import FILE_MARKER, Journal
+from src.link import Link
+from src.qdisc_snapshot import QdiscSnapshot
+from src.tc_registry import Allocation
+from target import Target
+from tests.conftest import MockCompletedProcess, mock_asyncssh_connect, target
+
+
+def test_inject_cpu_stress_should_run_the_same_command_as_the_sync_action(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    spy_run = mocker.spy(mock_asyncssh_connect, "run")
+    asyncio.run(inject_cpu_stress(cores=2, percent=50, length=10, target=target))
+    spy_run.assert_called_once_with(mocker.ANY, "stress-ng -c 2 -l 50 -t 10")
+
+
+def test_rollback_traffic_block_should_run_commands_over_one_connection(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    spy_run = mocker.spy(mock_asyncssh_connect, "run")
+    asyncio.run(rollback_traffic_block(destination_ports=["80"], target=target))
+    spy_run.assert_has_calls(
+        [
+            mocker.call(
+                mocker.ANY,
+                "sudo iptables -D OUTPUT -o eth0 -p tcp --match multiport --dports 80 -j DROP",
+            ),
+            mocker.call(
+                mocker.ANY,
+                "sudo iptables -D OUTPUT -o eth0 -p udp --match multiport --dports 80 -j DROP",
+            ),
+            mocker.call(mocker.ANY, "sudo iptables -D OUTPUT -o eth0 -p icmp -j DROP"),
+        ]
+    )
+    assert len({id(c.args[0]) for c in spy_run.call_args_list}) == 1
+
+
+def test_inject_traffic_control_should_send_one_script_when_exec_mode_is_batch(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    stdout = "".join(f"@@fit\t{i}\t0\t1000\t\t\n" for i in range(7))
+    spy_run = mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        side_effect=[
+            MockCompletedProcess(stdout="10000 1\n"),
+            MockCompletedProcess(),
+            MockCompletedProcess(stdout=stdout),
+        ],
+    )
+    results = asyncio.run(
+        inject_traffic_control(
+            params={"tc": [{"latency": 100, "protocol": ["tcp"]}]},
+            exec_mode="batch",
+            target=target,
+        )
+    )
+    assert [call.args[1] for call in spy_run.call_args_list] == [
+        Link.probe("eth0"),
+        mocker.ANY,
+        "sh -s",
+    ]
+    assert "htb rate 10000mbit" in spy_run.call_args.kwargs["input"]
+    assert len(results) == 7
+
+
+def test_inject_process_kill_should_return_the_number_of_kills_when_remote_loop_is_True(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        return_value=MockCompletedProcess(stdout="12\n"),
+    )
+    kills = asyncio.run(
+        inject_process_kill(pid_lst=[12345], length=1, remote_loop=True, target=target)
+    )
+    assert kills == 12
+
+
+def test_action_should_run_on_every_target_in_one_event_loop(
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    target_lst = [
+        {"hostname": f"host{i}", "username": "user", "key_filename": "/foo/baz/bar"}
+        for i in range(100)
+    ]
+    spy_run = mocker.spy(mock_asyncssh_connect, "run")
+    results = asyncio.run(inject_cpu_stress(target=target_lst, concurrency=10))
+    assert len(results) == 100
+    assert all(r == {"status": "succeeded", "result": None} for r in results.values())
+    assert spy_run.call_count == 100
+
+
+def test_inject_cpu_stress_should_throw_ValueError_when_the_argument_target_is_invalid():
+    with pytest.raises(ValueError) as error_info:
+        asyncio.run(inject_cpu_stress(target={"hostname": "localhost"}))
+    assert str(error_info.value) == "'username' is not found in target."
+
+
+def test_update_traffic_control_should_change_netem_in_place(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    spy_run = mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        return_value=MockCompletedProcess(stdout="10000 1\n"),
+    )
+    asyncio.run(
+        update_traffic_control(
+            params={"tc": [{"loss": 0.1}]},
+            new_params={"tc": [{"loss": 0.5}]},
+            target=target,
+        )
+    )
+    assert [call.args[1] for call in spy_run.call_args_list] == [
+        Link.probe("eth0"),
+        Allocation.probe("eth0"),
+        "sudo tc qdisc change dev eth0 handle 10: root netem loss 0.5%",
+        mocker.ANY,
+        mocker.ANY,
+        mocker.ANY,
+        mocker.ANY,
+    ]
+
+
+def test_rollback_traffic_control_should_restore_the_saved_root_qdisc(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    spy_run = mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        return_value=MockCompletedProcess(stdout="qdisc fq 8001: root refcnt 2\n"),
+    )
+    asyncio.run(rollback_traffic_control(params={"tc": [{"loss": 0.1}]}, target=target))
+    assert [call.args[1] for call in spy_run.call_args_list] == [
+        Allocation.probe("eth0"),
+        QdiscSnapshot.probe("eth0"),
+        "sudo tc qdisc del dev eth0 handle 10: root",
+        "sudo tc qdisc replace dev eth0 handle 8001: root fq",
+        QdiscSnapshot.discard("eth0"),
+        mocker.ANY,
+        mocker.ANY,
+    ]
+
+
+def test_inject_latency_matrix_should_apply_the_plan_of_each_host_in_one_event_loop(
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    target_lst = [
+        {"hostname": hostname, "username": "user", "key_filename": "/foo/baz/bar"}
+        for hostname in ("10.0.0.1", "10.0.1.1", "10.0.2.1")
+    ]
+    spy_run = mocker.spy(mock_asyncssh_connect, "run")
+    results = asyncio.run(
+        inject_latency_matrix(
+            matrix={"tokyo": {"osaka": 10}},
+            regions={"10.0.0.1": "tokyo", "10.0.1.1": "osaka", "10.0.2.1": "virginia"},
+            target=target_lst,
+        )
+    )
+    assert results["10.0.2.1"] == {"status": "succeeded", "result": None}
+    assert sorted(
+        call.args[1]
+        for call in spy_run.call_args_list
+        if "CLASSIFY" in call.args[1] and "-p tcp" in call.args[1]
+    ) == [
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 10.0.0.1",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp -d 10.0.1.1",
+    ]
+
+
+def test_rollback_journal_should_roll_back_the_recorded_faults_in_one_script(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    journal = (
+        f"{FILE_MARKER} {Journal.path('time_travel')}\n"
+        '100 {"action":"time_travel","arguments":{"disable_ntp":false}}\n'
+    )
+    spy_run = mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        side_effect=[
+            MockCompletedProcess(stdout=journal),
+            MockCompletedProcess(stdout="@@fit\t0\t0\t1000\t\t\n"),
+            MockCompletedProcess(stdout="@@fit\t0\t0\t1000\t\t\n"),
+        ],
+    )
+    results = asyncio.run(rollback_journal(target=target))
+    # 記録はロールバックが成功した後に破棄する
+    assert [call.args[1] for call in spy_run.call_args_list] == [
+        Journal.probe(),
+        "sh -s",
+        "sh -s",
+    ]
+    assert [result["command"] for result in results] == [
+        "sudo chronyc -a makestep",
+        Journal.discard("time_travel"),
+    ]
+
+
+def test_rollback_all_should_roll_back_the_faults_recorded_on_the_controller(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    asyncio.run(inject_time_travel(offset=10, exec_mode="exec", target=target))
+    journal = (
+        f"{FILE_MARKER} {Journal.path('time_travel')}\n"
+        '100 {"action":"time_travel","arguments":{"disable_ntp":true}}\n'
+    )
+    spy_run = mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        side_effect=[MockCompletedProcess(stdout=journal)]
+        + [MockCompletedProcess() for _ in range(3)],
+    )
+    results = asyncio.run(rollback_all(exec_mode="exec"))
+    assert results[target["hostname"]]["status"] == "succeeded"
+    assert [call.args[1] for call in spy_run.call_args_list] == [
+        Journal.probe(),
+        "sudo iptables -D OUTPUT -p udp --dport 123 -j DROP",
+        "sudo chronyc -a makestep",
+        Journal.discard("time_travel"),
+    ]
+    assert asyncio.run(rollback_all()) == {}
+
+
+def test_rollback_all_should_keep_the_fault_outstanding_when_the_rollback_failed(
+    target: target,
+    mocker: MockerFixture,
+    mock_asyncssh_connect: mock_asyncssh_connect,
+):
+    asyncio.run(inject_time_travel(offset=10, exec_mode="exec", target=target))
+    journal = (
+        f"{FILE_MARKER} {Journal.path('time_travel')}\n"
+        '100 {"action":"time_travel","arguments":{"disable_ntp":false}}\n'
+    )
+    mocker.patch.object(
+        mock_asyncssh_connect,
+        "run",
+        autospec=True,
+        side_effect=[
+            MockCompletedProcess(stdout=journal),
+            MockCompletedProcess(exit_status=1),
+            MockCompletedProcess(),
+        ],
+    )
+    asyncio.run(rollback_all(exec_mode="exec"))
+    outstanding = local_journal.journal.outstanding()
+    assert [entry.fault_id for entry in outstanding[Target.from_(target)]] == [
+        "time_travel"
+    ]
@@ -0,0 +1,66 @@
+import base64
+from dataclasses import asdict
+
+import pytest
+
+from src.batch import parse, script
+
+
+def test_script():
+    assert script(["sudo tc qdisc show", "true"]) == (
+        "d=$(mktemp -d) || exit 1\n"
+        "trap 'rm -rf \"$d\"' EXIT\n"
+        "s=$(date +%s%N)\n"
+        "{\n"
+        "sudo tc qdisc show\n"
+        '} >"$d/out" 2>"$d/err" </dev/null\n'
+        "rc=$?\n"
+        "e=$(date +%s%N)\n"
+        'printf \'@@fit\\t%d\\t%d\\t%d\\t%s\\t%s\\n\' 0 "$rc" "$((e-s))"'
+        ' "$(base64 -w0 <"$d/out")" "$(base64 -w0 <"$d/err")"\n'
+        "s=$(date +%s%N)\n"
+        "{\n"
+        "true\n"
+        '} >"$d/out" 2>"$d/err" </dev/null\n'
+        "rc=$?\n"
+        "e=$(date +%s%N)\n"
+        'printf \'@@fit\\t%d\\t%d\\t%d\\t%s\\t%s\\n\' 1 "$rc" "$((e-s))"'
+        ' "$(base64 -w0 <"$d/out")" "$(base64 -w0 <"$d/err")"\n'
+    )
+
+
+def test_parse():
+    out = base64.b64encode(b"qdisc noqueue 0: dev lo root\n").decode()
+    err = base64.b64encode(b"RTNETLINK answers: File exists\n").decode()
+    out_lst = [
+        "unrelated output\n",
+        f"@@fit\t0\t0\t1500000\t{out}\t\n",
+        f"@@fit\t1\t2\t2000000\t\t{err}\n",
+    ]
+    assert list(map(asdict, parse(["cmd1", "cmd2"], out_lst))) == [
+        dict(
+            command="cmd1",
+            exit_status=0,
+            stdout="qdisc noqueue 0: dev lo root\n",
+            stderr="",
+            duration=0.0015,
+            truncated=False,
+        ),
+        dict(
+            command="cmd2",
+            exit_status=2,
+            stdout="",
+            stderr="RTNETLINK answers: File exists\n",
+            duration=0.002,
+            truncated=False,
+        ),
+    ]
+
+
+def test_parse_should_throw_RuntimeError_when_results_are_missing():
+    with pytest.raises(RuntimeError) as error_info:
+        parse(["cmd1", "cmd2"], ["@@fit\t0\t0\t100\t\t\n"])
+    assert (
+        str(error_info.value)
+        == "Batch execution was interrupted: 1 of 2 commands were completed."
+    )
@@ -0,0 +1,110 @@
+import subprocess
+
+from src.bulk import bundle
+
+
+def test_bundle_should_merge_tc_and_iptables_commands_in_order_of_appearance():
+    cmd_lst = [
+        "sudo tc qdisc add dev eth0 handle 10: root htb default 1",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p tcp",
+        "sudo tc class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit",
+        "sudo iptables -A OUTPUT -o eth0 -p udp -j DROP",
+        "sudo iptables -A POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p udp",
+    ]
+    assert bundle(cmd_lst) == [
+        "sudo tc -batch - <<'__FIT_EOF__'\n"
+        "qdisc add dev eth0 handle 10: root htb default 1\n"
+        "class add dev eth0 parent 10: classid 10:10 htb rate 1000000kbit\n"
+        "__FIT_EOF__",
+        "sudo iptables-restore --noflush <<'__FIT_EOF__'\n"
+        "*mangle\n"
+        "-A POSTROUTING -j CLASSIFY --set-class 10:10 -p tcp\n"
+        "-A POSTROUTING -j CLASSIFY --set-class 10:10 -p udp\n"
+        "COMMIT\n"
+        "*filter\n"
+        "-A OUTPUT -o eth0 -p udp -j DROP\n"
+        "COMMIT\n"
+        "__FIT_EOF__",
+    ]
+
+
+def test_bundle_should_put_iptables_first_when_it_appears_first():
+    cmd_lst = [
+        "sudo iptables -D POSTROUTING -t mangle -j CLASSIFY --set-class 10:10 -p icmp",
+        "sudo tc qdisc del dev eth0 handle 10: root",
+    ]
+    assert bundle(cmd_lst) == [
+        "sudo iptables-restore --noflush <<'__FIT_EOF__'\n"
+        "*mangle\n"
+        "-D POSTROUTING -j CLASSIFY --set-class 10:10 -p icmp\n"
+        "COMMIT\n"
+        "__FIT_EOF__",
+        "sudo tc -batch - <<'__FIT_EOF__'\n"
+        "qdisc del dev eth0 handle 10: root\n"
+        "__FIT_EOF__",
+    ]
+
+
+def test_bundle_should_return_empty_list_when_no_commands_are_given():
+    assert bundle([]) == []
+
+
+def test_bundle_should_keep_other_commands_in_place():
+    cmd_lst = [
+        "sudo ipset create fit-tc-0-dst hash:net",
+        "sudo iptables -A OUTPUT -o eth0 -p tcp -j DROP",
+        "sudo ipset destroy fit-tc-0-dst",
+    ]
+    assert bundle(cmd_lst) == [
+        "sudo ipset create fit-tc-0-dst hash:net",
+        "sudo iptables-restore --noflush <<'__FIT_EOF__'\n"
+        "*filter\n"
+        "-A OUTPUT -o eth0 -p tcp -j DROP\n"
+        "COMMIT\n"
+        "__FIT_EOF__",
+        "sudo ipset destroy fit-tc-0-dst",
+    ]
+
+
+def test_bundle_should_continue_after_a_failing_tc_line_when_force_is_true():
+    cmd_lst = [
+        "sudo tc filter del dev eth0 parent 10: prio 1",
+        "sudo tc qdisc del dev eth0 handle 10: root",
+    ]
+    assert bundle(cmd_lst, force=True) == [
+        "sudo tc -force -batch - <<'__FIT_EOF__'\n"
+        "filter del dev eth0 parent 10: prio 1\n"
+        "qdisc del dev eth0 handle 10: root\n"
+        "__FIT_EOF__",
+    ]
+
+
+def test_bundle_should_apply_the_iptables_rules_one_by_one_when_the_restore_fails(
+    tmp_path,
+):
+    # iptables-restoreは常に失敗し,iptablesは引数を記録して2つ目のルールで失敗する
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in (
+        ("sudo", 'exec "$@"'),
+        ("iptables-restore", "cat >/dev/null; exit 1"),
+        (
+            "iptables",
+            f'echo "$*" >> {tmp_path / "calls"}; [ "$4" != udp ] || exit 1',
+        ),
+    ):
+        (bin_dir / name).write_text(f"#!/bin/sh\n{script}\n")
+        (bin_dir / name).chmod(0o755)
+    cmd_lst = [
+        "sudo iptables -D OUTPUT -p tcp -j DROP",
+        "sudo iptables -D OUTPUT -p udp -j DROP",
+        "sudo iptables -D OUTPUT -p icmp -m comment --comment 'a b' -j DROP",
+    ]
+    (cmd,) = bundle(cmd_lst, force=True)
+    result = subprocess.run(["sh", "-c", cmd], env={"PATH": f"{bin_dir}:/usr/bin:/bin"})
+    assert result.returncode == 1
+    assert (tmp_path / "calls").read_text().splitlines() == [
+        "-D OUTPUT -p tcp -j DROP",
+        "-D OUTPUT -p udp -j DROP",
+        "-D OUTPUT -p icmp -m comment --comment a b -j DROP",
+    ]
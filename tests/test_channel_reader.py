@@ -0,0 +1,86 @@
+import src.channel_reader
+from src.channel_reader import RingBuffer, read
+from tests.conftest import MockChannel
+
+
+class BlockingChannel(MockChannel):
+    """標準エラー出力が読み出されるまで標準出力を送らないリモートコマンドを模したチャネル"""
+
+    def recv_ready(self):
+        return not self.stderr and bool(self.stdout)
+
+    def exit_status_ready(self):
+        return not self.stdout and not self.stderr
+
+
+class LateChannel(MockChannel):
+    """終了ステータスより後に出力の残りが届くチャネル"""
+
+    def __init__(self, stdout, stderr, late_stdout, late_stderr):
+        super().__init__(stdout, stderr)
+        self.late = (late_stdout, late_stderr)
+        self.eof_received = False
+
+    def arrive(self):
+        self.stdout += self.late[0]
+        self.stderr += self.late[1]
+        self.eof_received = True
+
+
+def test_ring_buffer_should_keep_all_data_within_max_bytes():
+    buffer = RingBuffer(max_bytes=10)
+    buffer.write(b"abc")
+    buffer.write(b"def")
+    assert buffer.getvalue() == b"abcdef"
+    assert buffer.dropped == 0
+
+
+def test_ring_buffer_should_keep_the_last_max_bytes():
+    buffer = RingBuffer(max_bytes=4)
+    buffer.write(b"abc")
+    buffer.write(b"defg")
+    buffer.write(b"h")
+    assert buffer.getvalue() == b"efgh"
+    assert buffer.dropped == 4
+
+
+def test_ring_buffer_should_not_drop_data_without_max_bytes():
+    buffer = RingBuffer(max_bytes=None)
+    buffer.write(b"a" * 100000)
+    assert len(buffer.getvalue()) == 100000
+    assert buffer.dropped == 0
+
+
+def test_read_should_capture_stdout_stderr_and_exit_status():
+    channel = MockChannel(stdout=b"out\n", stderr=b"err\n", exit_status=3)
+    result = read(channel, "cmd")
+    assert result.command == "cmd"
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+    assert result.exit_status == 3
+    assert not result.truncated
+
+
+def test_read_should_drain_stderr_while_stdout_is_not_ready():
+    channel = BlockingChannel(stdout=b"done\n", stderr=b"x" * 100000)
+    result = read(channel, "cmd")
+    assert result.stdout == "done\n"
+    assert len(result.stderr) == 100000
+
+
+def test_read_should_truncate_output_over_max_bytes():
+    channel = MockChannel(stdout=b"a" * 100 + b"tail", stderr=b"")
+    result = read(channel, "cmd", max_bytes=4)
+    assert result.stdout == "tail"
+    assert result.truncated
+
+
+def test_read_should_read_the_output_arriving_after_the_exit_status(monkeypatch):
+    channel = LateChannel(b"out\n", b"", b"late out\n", b"late err\n")
+    # selectで待っている間に出力の残りとEOFが届く
+    monkeypatch.setattr(
+        src.channel_reader.select, "select", lambda *args: channel.arrive()
+    )
+    result = read(channel, "cmd")
+    assert result.stdout == "out\nlate out\n"
+    assert result.stderr == "late err\n"
@@ -1,9 +1,13 @@
+import shlex
+import subprocess
+
 from src.command import (
     cpu_stress,
     disk_stress,
     io_stress,
     kill,
     kill_children_by_pid,
+    kill_loop,
     memory_stress,
     os_shutdown,
     pkill,
@@ -166,3 +170,59 @@ def test_pkill_when_kill_children_flag_is_True():
         ),
         "for pname in app1 app2; do sudo pkill -KILL $pname -n -x -f; done",
     ]
+
+
+def test_kill_without_sudo():
+    assert (
+        kill(signal=Signal.SIGTERM, pid_lst=[12345], sudo=False) == "kill -TERM 12345"
+    )
+
+
+def test_pkill_without_sudo():
+    assert pkill(
+        signal=Signal.SIGKILL,
+        process_name_lst=["app1"],
+        kill_children=True,
+        sudo=False,
+    ) == [
+        "for pname in app1; do for pid in $(pgrep $pname); do pkill -KILL -P $pid; done; done",
+        "for pname in app1; do pkill -KILL $pname; done",
+    ]
+
+
+def test_kill_loop():
+    assert kill_loop(
+        cmd_lst=["pkill -KILL -P 12345", "pkill -KILL -c app1"], interval=0.5, length=10
+    ) == (
+        "sudo sh -c 'n=0; end=$(($(($(date +%s%N)/1000000))+10000));"
+        " while :; do sleep 0.5; pkill -KILL -P 12345 2>/dev/null;"
+        " for c in $(pkill -KILL -c app1 2>/dev/null); do n=$((n+c)); done;"
+        " [ $(($(date +%s%N)/1000000)) -ge $end ] && break; done; echo $n'"
+    )
+
+
+def test_kill_loop_without_interval():
+    assert kill_loop(cmd_lst=["pkill -KILL -c app1"], interval=0, length=0.5) == (
+        "sudo sh -c 'n=0; end=$(($(($(date +%s%N)/1000000))+500));"
+        " while :; do for c in $(pkill -KILL -c app1 2>/dev/null); do n=$((n+c)); done;"
+        " [ $(($(date +%s%N)/1000000)) -ge $end ] && break; done; echo $n'"
+    )
+
+
+def test_kill_loop_should_add_up_the_counts_printed_by_the_last_command():
+    cmd = kill_loop(cmd_lst=["for x in 2 3; do echo $x; done"], interval=0, length=0)
+    script = shlex.split(cmd)[3]
+    result = subprocess.run(["sh", "-c", script], capture_output=True, text=True)
+    assert result.stdout == "5\n"
+
+
+def test_kill_with_count():
+    assert kill(
+        signal=Signal.SIGKILL, pid_lst=[2012, 2022], sudo=False, count=True
+    ) == ("for pid in 2012 2022; do kill -KILL $pid && echo 1; done")
+
+
+def test_pkill_with_count():
+    assert pkill(
+        signal=Signal.SIGKILL, process_name_lst=["app1", "app2"], sudo=False, count=True
+    ) == ["for pname in app1 app2; do pkill -KILL -c $pname; done"]
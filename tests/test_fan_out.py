@@ -0,0 +1,153 @@
+import inspect
+import json
+
+import pytest
+from pytest_mock import MockerFixture
+
+from src.action import inject_cpu_stress, inject_traffic_block
+from src.fan_out import load_inventory
+from tests.conftest import mock_ssh_client, target
+
+
+@pytest.fixture
+def target_lst():
+    return [
+        {"hostname": "host1", "username": "user", "key_filename": "/foo/baz/bar"},
+        {"hostname": "host2", "username": "user", "key_filename": "/foo/baz/bar"},
+    ]
+
+
+def test_action_should_run_on_every_target_when_target_is_a_list(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, target_lst
+):
+    spy_connect = mocker.spy(mock_ssh_client, "connect")
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    results = inject_cpu_stress(target=target_lst)
+    assert results == {
+        "host1": {"status": "succeeded", "result": None},
+        "host2": {"status": "succeeded", "result": None},
+    }
+    assert sorted(c.kwargs["hostname"] for c in spy_connect.call_args_list) == [
+        "host1",
+        "host2",
+    ]
+    assert spy_exec_command.call_count == 2
+
+
+def test_action_should_run_on_targets_in_the_inventory(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, tmp_path
+):
+    inventory = tmp_path / "inventory.json"
+    inventory.write_text(
+        json.dumps(
+            {
+                "defaults": {"username": "user", "key_filename": "/foo/baz/bar"},
+                "hosts": ["host1", {"hostname": "host2", "username": "admin"}],
+            }
+        )
+    )
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    results = inject_traffic_block(tcp=False, udp=False, inventory=str(inventory))
+    assert list(results) == ["host1", "host2"]
+    assert spy_exec_command.call_count == 4
+
+
+def test_action_should_record_the_error_per_host_when_execution_failed(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, target_lst
+):
+    def connect(self, hostname, username, key_filename):
+        if hostname == "host2":
+            raise ConnectionRefusedError("refused")
+
+    mocker.patch.object(mock_ssh_client, "connect", connect)
+    results = inject_cpu_stress(target=target_lst)
+    assert results == {
+        "host1": {"status": "succeeded", "result": None},
+        "host2": {"status": "failed", "error": "ConnectionRefusedError: refused"},
+    }
+
+
+def test_action_should_throw_ValueError_when_one_of_the_targets_is_invalid(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, target_lst
+):
+    spy_exec_command = mocker.spy(mock_ssh_client, "exec_command")
+    target_lst.append({"hostname": "host3", "username": "user"})
+    with pytest.raises(ValueError) as error_info:
+        inject_cpu_stress(target=target_lst, concurrency=1)
+    assert str(error_info.value) == "'key_filename' is not found in target."
+    # 不正なターゲットがある場合はどのターゲットでも実行しない
+    spy_exec_command.assert_not_called()
+
+
+def test_action_should_throw_ValueError_when_hostnames_are_duplicated(
+    mock_ssh_client: mock_ssh_client, target_lst
+):
+    target_lst.append({**target_lst[0], "username": "admin"})
+    with pytest.raises(ValueError) as error_info:
+        inject_cpu_stress(target=target_lst)
+    assert str(error_info.value) == "The hostname 'host1' is duplicated in targets."
+
+
+def test_action_should_record_ValueError_per_host_and_keep_the_other_results(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, target_lst
+):
+    def connect(self, hostname, username, key_filename):
+        if hostname == "host2":
+            raise ValueError("conflict")
+
+    mocker.patch.object(mock_ssh_client, "connect", connect)
+    results = inject_cpu_stress(target=target_lst, concurrency=1)
+    assert results == {
+        "host1": {"status": "succeeded", "result": None},
+        "host2": {"status": "failed", "error": "ValueError: conflict"},
+    }
+
+
+def test_action_should_throw_ValueError_when_target_is_an_empty_list():
+    with pytest.raises(ValueError) as error_info:
+        inject_cpu_stress(target=[])
+    assert str(error_info.value) == "The argument 'target' must not be empty."
+
+
+def test_action_should_throw_ValueError_when_concurrency_is_less_than_1(target_lst):
+    with pytest.raises(ValueError) as error_info:
+        inject_cpu_stress(target=target_lst, concurrency=0)
+    assert (
+        str(error_info.value)
+        == "The argument 'concurrency' must be greater than or equal to 1"
+    )
+
+
+def test_action_should_run_on_a_single_target_as_before(
+    mock_ssh_client: mock_ssh_client, target: target
+):
+    assert inject_cpu_stress(target=target) is None
+
+
+def test_action_signature_should_accept_inventory_and_concurrency():
+    params = inspect.signature(inject_cpu_stress).parameters
+    assert list(params) == [
+        "cores",
+        "percent",
+        "length",
+        "exec_mode",
+        "target",
+        "inventory",
+        "concurrency",
+    ]
+
+
+def test_load_inventory_should_accept_a_list_of_targets(tmp_path, target_lst):
+    inventory = tmp_path / "inventory.json"
+    inventory.write_text(json.dumps(target_lst))
+    assert load_inventory(str(inventory)) == target_lst
+
+
+def test_load_inventory_should_throw_ValueError_when_hosts_is_missing(tmp_path):
+    inventory = tmp_path / "inventory.json"
+    inventory.write_text(json.dumps({"defaults": {}}))
+    with pytest.raises(ValueError) as error_info:
+        load_inventory(str(inventory))
+    assert str(error_info.value) == (
+        f"Invalid inventory: {inventory}. 'hosts' must be a list."
+    )
@@ -0,0 +1,178 @@
+import shlex
+import subprocess
+
+import pytest
+
+import src.fault_journal
+from src.fault_journal import FILE_MARKER, Journal, JournalEntry
+
+
+def test_fault_id_should_not_depend_on_the_order_of_the_keys():
+    assert Journal.fault_id("traffic_block", {"a": 1, "b": 2}) == Journal.fault_id(
+        "traffic_block", {"b": 2, "a": 1}
+    )
+    assert Journal.fault_id("traffic_block", {"a": 1}).startswith("traffic_block-")
+    assert Journal.fault_id("traffic_block", {"a": 1}) != Journal.fault_id(
+        "traffic_block", {"a": 2}
+    )
+
+
+def test_parse_should_sort_the_entries_newest_first_and_keep_the_other_files():
+    output = (
+        f"{FILE_MARKER} /run/fit/journal/time_travel\n"
+        '100 {"action":"time_travel","arguments":{"disable_ntp":true}}\n'
+        f"{FILE_MARKER} /run/fit/journal/traffic_block-0123456789abcdef\n"
+        '200 {"action":"traffic_block","arguments":{"device":"eth0"}}\n'
+        # 書き込みの途中で中断した記録は読み飛ばす
+        f"{FILE_MARKER} /run/fit/journal/traffic_block-fedcba9876543210.tmp\n"
+        '300 {"action":"traffic_block"\n'
+        f"{FILE_MARKER} /run/fit/journal/traffic_block-fedcba9876543210\n"
+        "300 {\n"
+        f"{FILE_MARKER} /run/fit/tc-eth0.registry\n"
+        "0 0123456789abcdef 10\n"
+        "1 fedcba9876543210 10\n"
+    )
+    assert Journal.parse(output) == Journal(
+        entries=(
+            JournalEntry(
+                fault_id="traffic_block-0123456789abcdef",
+                time=200,
+                action="traffic_block",
+                arguments={"device": "eth0"},
+            ),
+            JournalEntry(
+                fault_id="time_travel",
+                time=100,
+                action="time_travel",
+                arguments={"disable_ntp": True},
+            ),
+        ),
+        files={
+            "/run/fit/tc-eth0.registry": "0 0123456789abcdef 10\n1 fedcba9876543210 10\n"
+        },
+    )
+    assert Journal.parse("").file("/run/fit/tc-eth0") == ""
+
+
+def test_probe_should_print_the_entries_written_by_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.fault_journal, "SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(src.fault_journal, "JOURNAL_DIR", str(tmp_path / "journal"))
+
+    def run(cmd: str) -> str:
+        # run the script without sudo
+        script = shlex.split(cmd)[3] if cmd.startswith("sudo sh ") else cmd[5:]
+        return subprocess.run(
+            ["sh", "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    assert Journal.parse(run(Journal.probe())) == Journal()
+    arguments = {"device": "eth0", "destination_ip_addresses": ["10.0.0.1"]}
+    run(Journal.record("traffic_block-a", "traffic_block", arguments))
+    run(Journal.record("time_travel", "time_travel", {"disable_ntp": False}))
+    (tmp_path / "tc-eth0.registry").write_text("0 key 10\n")
+    journal = Journal.parse(run(Journal.probe()))
+    assert [entry.fault_id for entry in journal.entries] == [
+        "time_travel",
+        "traffic_block-a",
+    ]
+    assert journal.entries[1].arguments == arguments
+    assert journal.file(f"{tmp_path}/tc-eth0.registry") == "0 key 10\n"
+    run(Journal.discard("time_travel"))
+    run(Journal.discard("time_travel"))
+    journal = Journal.parse(run(Journal.probe()))
+    assert [entry.fault_id for entry in journal.entries] == ["traffic_block-a"]
+
+
+def test_lease_should_run_the_rollback_commands_with_systemd_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.fault_journal, "LEASE_DIR", str(tmp_path / "lease"))
+    # systemd-runの代わりにオプションを読み飛ばしてすぐにコマンドを実行する
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "systemd-run").write_text(
+        '#!/bin/sh\necho "$@" > ' + str(tmp_path / "args") + "\n"
+        'while [ "${1#--}" != "$1" ]; do shift; done\nexec "$@"\n'
+    )
+    (bin_dir / "systemd-run").chmod(0o755)
+    out = tmp_path / "out"
+    cmd_lst = [
+        f"echo 'first' >> {out}",
+        f"cat >> {out} <<'__FIT_EOF__'\nsecond\n__FIT_EOF__",
+    ]
+    lease = Journal.lease(
+        "traffic_block-0123456789abcdef", 60, cmd_lst, [f"echo 'done' >> {out}"]
+    )
+    assert lease.startswith("sudo sh -c ")
+    subprocess.run(
+        ["sh", "-c", shlex.split(lease)[3]],
+        env={"PATH": f"{bin_dir}:/usr/bin:/bin"},
+        check=True,
+    )
+    assert out.read_text() == "first\nsecond\ndone\n"
+    assert (
+        (tmp_path / "args")
+        .read_text()
+        .startswith(
+            "--quiet --collect --unit=fit-lease-traffic_block-0123456789abcdef"
+            " --on-active=60s"
+        )
+    )
+
+
+def test_rearm_should_set_the_remaining_time_of_the_timer_under_the_new_id(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(src.fault_journal, "LEASE_DIR", str(tmp_path / "lease"))
+    # systemd-runの代わりに引数を記録する
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ("systemd-run", "systemctl"):
+        (bin_dir / name).write_text(
+            f'#!/bin/sh\necho "{name} $1 $2 $3 $4" >> {tmp_path / "calls"}\n'
+        )
+        (bin_dir / name).chmod(0o755)
+
+    def run(cmd: str):
+        subprocess.run(
+            ["sh", "-c", shlex.split(cmd)[3]],
+            env={"PATH": f"{bin_dir}:/usr/bin:/bin"},
+            check=True,
+        )
+
+    # タイマーのない障害では何もしない
+    run(Journal.rearm("traffic_control-a", "traffic_control-b", ["true"], []))
+    assert not (tmp_path / "calls").exists()
+    run(Journal.lease("traffic_control-a", 600, ["true"], []))
+    deadline = (tmp_path / "lease" / "traffic_control-a").read_text()
+    run(Journal.rearm("traffic_control-a", "traffic_control-b", ["true"], []))
+    assert (tmp_path / "lease" / "traffic_control-b").read_text() == deadline
+    calls = (tmp_path / "calls").read_text().splitlines()
+    assert calls[-1].startswith(
+        "systemd-run --quiet --collect --unit=fit-lease-traffic_control-b --on-active="
+    )
+    assert 598 <= int(calls[-1].split("=")[-1].rstrip("s")) <= 600
+
+
+@pytest.mark.parametrize(
+    "cmd, returncode, done",
+    [
+        ("true", 0, True),
+        # すでに削除されたものに対するエラーは成功として扱う
+        ("echo 'RTNETLINK answers: No such file or directory' >&2; false", 0, True),
+        ("echo 'Cannot find specified qdisc' >&2; false", 0, True),
+        ("echo 'RTNETLINK answers: Operation not permitted' >&2; false", 1, False),
+        ("false", 1, False),
+    ],
+)
+def test_gate_should_only_go_on_when_the_commands_succeeded(
+    tmp_path, cmd, returncode, done
+):
+    out = tmp_path / "out"
+    result = subprocess.run(
+        ["sh", "-c", "\n".join([Journal.gate(["true", cmd]), f"touch {out}"])],
+        capture_output=True,
+    )
+    assert result.returncode == returncode
+    assert out.exists() == done
@@ -0,0 +1,127 @@
+import shlex
+import shutil
+import subprocess
+
+import pytest
+
+from src.fault_profile import loop, parse, schedule
+
+
+def __profile(**kwargs):
+    profile = {
+        "field": "latency",
+        "interval": 1,
+        "steps": 5,
+        "period": None,
+        "step_size": None,
+        "seed": None,
+    }
+    profile.update(kwargs)
+    return profile
+
+
+def __run_awk(statement: str):
+    output = subprocess.run(
+        ["awk", f"BEGIN {{ {statement}; }}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return [line.split() for line in output.splitlines()]
+
+
+@pytest.mark.skipif(shutil.which("awk") is None, reason="awk is not found")
+@pytest.mark.parametrize(
+    "profile, expected",
+    [
+        (
+            __profile(shape="ramp", start=100, end=200, length=2, interval=0.5),
+            [
+                ("0", "100"),
+                ("500", "125"),
+                ("1000", "150"),
+                ("1500", "175"),
+                ("2000", "200"),
+            ],
+        ),
+        (
+            __profile(shape="step", start=0, end=30, length=4, steps=4),
+            [
+                ("0", "0"),
+                ("1000", "10"),
+                ("2000", "20"),
+                ("3000", "30"),
+                ("4000", "30"),
+            ],
+        ),
+        (
+            __profile(shape="sine", start=0, end=100, length=4, period=4),
+            [
+                ("0", "0"),
+                ("1000", "50"),
+                ("2000", "100"),
+                ("3000", "50"),
+                ("4000", "0"),
+            ],
+        ),
+        (
+            __profile(
+                field="loss", shape="ramp", start=0, end=1, length=1, interval=0.25
+            ),
+            [
+                ("0", "0.000"),
+                ("250", "0.250"),
+                ("500", "0.500"),
+                ("750", "0.750"),
+                ("1000", "1.000"),
+            ],
+        ),
+    ],
+)
+def test_schedule_should_print_the_value_of_each_interval(profile, expected):
+    lines = __run_awk(schedule(0, profile))
+    assert [(t, v) for t, _, _, v in lines] == expected
+    assert all(i == "0" and f == profile["field"] for _, i, f, _ in lines)
+
+
+@pytest.mark.skipif(shutil.which("awk") is None, reason="awk is not found")
+def test_schedule_should_keep_the_random_walk_within_start_and_end():
+    profile = __profile(
+        shape="random_walk", start=50, end=60, length=100, step_size=5, seed=1
+    )
+    lines = __run_awk(schedule(1, profile))
+    assert len(lines) == 101
+    assert lines[0][3] == "50"
+    assert all(50 <= int(v) <= 60 for _, _, _, v in lines)
+    assert __run_awk(schedule(1, profile)) == lines
+
+
+def test_loop_should_apply_the_changes_of_each_tc_entry_in_one_command():
+    cmd = loop(
+        ["s0", "s1"],
+        {
+            0: ["tc qdisc change dev eth0 parent 10:10 handle 100: netem delay ${v}ms"],
+            1: [
+                "tc qdisc change dev eth0 parent 10:1 netem loss ${v}%",
+                "tc qdisc change dev eth0 parent 10:2 netem loss ${v}%",
+            ],
+        },
+    )
+    sudo, sh, c, script = shlex.split(cmd)
+    assert [sudo, sh, c] == ["sudo", "sh", "-c"]
+    assert "awk 'BEGIN { s0; s1; }' | sort -n -s -k1,1" in script
+    assert (
+        "0) tc qdisc change dev eth0 parent 10:10 handle 100: netem delay ${v}ms || rc=$?;;"
+        in script
+    )
+    assert (
+        "1) tc qdisc change dev eth0 parent 10:1 netem loss ${v}% || rc=$?;"
+        " tc qdisc change dev eth0 parent 10:2 netem loss ${v}% || rc=$?;;"
+    ) in script
+
+
+def test_parse_should_convert_the_output_to_a_timeline():
+    assert parse("0 0 latency 100 0\n1002 1 loss 0.500 2\n\nbroken line\n") == [
+        {"time": 0.0, "tc": 0, "field": "latency", "value": 100, "exit_status": 0},
+        {"time": 1.002, "tc": 1, "field": "loss", "value": 0.5, "exit_status": 2},
+    ]
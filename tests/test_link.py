@@ -0,0 +1,39 @@
+from dataclasses import asdict
+
+import pytest
+
+from src.link import Link
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        (
+            "25000 8 90000\n100\n",
+            {"speed": 25000, "tx_queues": 8, "packet_size": 900},
+        ),
+        ("-1 1 0\n0\n", {"speed": None, "tx_queues": 1, "packet_size": 1500}),
+        ("0 0\n", {"speed": None, "tx_queues": 1, "packet_size": 1500}),
+        ("\n", {"speed": None, "tx_queues": 1, "packet_size": 1500}),
+        ("unknown\n", {"speed": None, "tx_queues": 1, "packet_size": 1500}),
+    ],
+)
+def test_parse_should_read_link_speed_tx_queues_and_packet_size(output, expected):
+    assert asdict(Link.parse(output)) == expected
+
+
+def test_rate_should_be_the_link_speed_in_mbit():
+    assert Link(speed=25000).rate == "25000mbit"
+
+
+def test_rate_should_fall_back_when_the_link_speed_is_unknown():
+    assert Link().rate == "100gbit"
+
+
+def test_probe_should_read_speed_tx_queues_and_statistics_from_sysfs():
+    assert Link.probe("eth0") == (
+        'echo "$(cat /sys/class/net/eth0/speed 2>/dev/null || echo -1)'
+        " $(ls -d /sys/class/net/eth0/queues/tx-* 2>/dev/null | wc -l)"
+        " $(cat /sys/class/net/eth0/statistics/tx_bytes"
+        ' /sys/class/net/eth0/statistics/tx_packets 2>/dev/null)"'
+    )
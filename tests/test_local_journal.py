@@ -0,0 +1,45 @@
+from fault_journal import JournalEntry
+from local_journal import LocalJournal
+from target import Target
+
+TARGET = Target(hostname="10.0.0.1", username="user", key_filename="/foo/baz/bar")
+OTHER = Target(hostname="10.0.0.2", username="user", key_filename="/foo/baz/bar")
+
+
+def test_outstanding_should_return_the_faults_not_rolled_back_newest_first(tmp_path):
+    journal = LocalJournal(str(tmp_path / "fit" / "journal.jsonl"))
+    assert journal.outstanding() == {}
+    journal.record(TARGET, "time_travel", "time_travel", {"disable_ntp": True}, [])
+    journal.record(
+        TARGET, "traffic_block", "traffic_block-a", {"device": "eth0"}, ["cmd"]
+    )
+    journal.record(OTHER, "time_travel", "time_travel", {"disable_ntp": False}, [])
+    journal.complete(OTHER, "time_travel")
+    outstanding = journal.outstanding()
+    assert list(outstanding) == [TARGET]
+    assert [entry.fault_id for entry in outstanding[TARGET]] == [
+        "traffic_block-a",
+        "time_travel",
+    ]
+    entry = outstanding[TARGET][0]
+    assert entry == JournalEntry(
+        fault_id="traffic_block-a",
+        time=entry.time,
+        action="traffic_block",
+        arguments={"device": "eth0"},
+    )
+
+
+def test_outstanding_should_skip_a_line_not_written_completely(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = LocalJournal(str(path))
+    journal.record(TARGET, "time_travel", "time_travel", {"disable_ntp": True}, [])
+    with open(path, "a") as f:
+        f.write('{"time":1,"event":"rollback","target":')
+    assert [entry.fault_id for entry in journal.outstanding()[TARGET]] == [
+        "time_travel"
+    ]
+    # 再び設定した障害は,1回のロールバックでロールバックされたものとみなす
+    journal.record(TARGET, "time_travel", "time_travel", {"disable_ntp": True}, [])
+    journal.complete(TARGET, "time_travel")
+    assert journal.outstanding() == {}
@@ -0,0 +1,74 @@
+import pytest
+
+from src.qdisc_snapshot import QdiscSnapshot
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        # カーネルが作成したデフォルトのqdiscは復元しない
+        (
+            "qdisc mq 0: root\n"
+            "qdisc fq_codel 0: parent :1 limit 10240p flows 1024\n"
+            "class mq :1 root leaf 0:\n",
+            [],
+        ),
+        # 親のqdiscを先に設定し,mqのクラスとingressは復元しない
+        (
+            "qdisc fq 8003: parent 8001:2 limit 10000p flow_limit 100p\n"
+            "qdisc mq 8001: root\n"
+            "qdisc fq 8002: parent 8001:1 limit 10000p flow_limit 100p\n"
+            "qdisc ingress ffff: parent ffff:fff1 ----------------\n"
+            "class mq 8001:1 root leaf 8002:\n"
+            "class mq 8001:2 root leaf 8003:\n",
+            [
+                "sudo tc qdisc replace dev eth0 handle 8001: root mq",
+                "sudo tc qdisc replace dev eth0 handle 8003: parent 8001:2 fq limit 10000 flow_limit 100",
+                "sudo tc qdisc replace dev eth0 handle 8002: parent 8001:1 fq limit 10000 flow_limit 100",
+            ],
+        ),
+        # HTBのクラスは親のクラスから順に設定し,統計値とleafは取り除く
+        (
+            "qdisc htb 1: root refcnt 2 r2q 10 default 0x10 direct_packets_stat 0 direct_qlen 1000\n"
+            "qdisc fq_codel 10: parent 1:10 limit 10240p flows 1024\n"
+            "class htb 1:10 parent 1:1 leaf 10: prio 0 rate 100Mbit ceil 1Gbit burst 1600b cburst 1375b\n"
+            "class htb 1:1 root rate 1Gbit ceil 1Gbit burst 1375b cburst 1375b\n",
+            [
+                "sudo tc qdisc replace dev eth0 handle 1: root htb r2q 10 default 0x10 direct_qlen 1000",
+                "sudo tc class replace dev eth0 parent 1: classid 1:1 htb rate 1Gbit ceil 1Gbit burst 1375b cburst 1375b",
+                "sudo tc class replace dev eth0 parent 1:1 classid 1:10 htb prio 0 rate 100Mbit ceil 1Gbit burst 1600b cburst 1375b",
+                "sudo tc qdisc replace dev eth0 handle 10: parent 1:10 fq_codel limit 10240 flows 1024",
+            ],
+        ),
+        # デフォルトのmqの送信キューに設定したqdiscは復元する
+        (
+            "qdisc mq 0: root\nqdisc fq 8001: parent :1 limit 10000p\n",
+            ["sudo tc qdisc replace dev eth0 handle 8001: parent :1 fq limit 10000"],
+        ),
+        # tcが整数として読む値の単位を取り除き,サイズはバイト数に変換する
+        (
+            "qdisc fq 8001: root refcnt 2 limit 10000p flow_limit 100p buckets 1024"
+            " orphan_mask 1023 quantum 3028b initial_quantum 15Kb"
+            " low_rate_threshold 550Kbit refill_delay 40ms\n",
+            [
+                "sudo tc qdisc replace dev eth0 handle 8001: root fq limit 10000 flow_limit 100"
+                " buckets 1024 orphan_mask 1023 quantum 3028 initial_quantum 15360"
+                " low_rate_threshold 550Kbit refill_delay 40ms"
+            ],
+        ),
+        ("", []),
+    ],
+)
+def test_restore_should_rebuild_the_saved_qdiscs_and_classes_from_the_parent(
+    output, expected
+):
+    assert QdiscSnapshot.parse(output).restore("eth0") == expected
+
+
+def test_save_should_keep_the_first_snapshot_until_it_is_discarded():
+    assert QdiscSnapshot.save("eth0") == (
+        "sudo sh -c 'mkdir -p /run/fit; if [ ! -s /run/fit/tc-eth0 ]; then"
+        " { tc qdisc show dev eth0; tc class show dev eth0; } > /run/fit/tc-eth0;"
+        " tc qdisc del dev eth0 root 2>/dev/null; fi; true'"
+    )
+    assert QdiscSnapshot.discard("eth0") == "sudo rm -f /run/fit/tc-eth0"
@@ -0,0 +1,128 @@
+import paramiko
+import pytest
+from pytest_mock import MockerFixture
+
+from src.ssh_pool import SSHConnectionPool
+from src.target import Target
+from tests.conftest import mock_ssh_client
+
+
+@pytest.fixture
+def pool_target() -> Target:
+    return Target(hostname="localhost", username="user", key_filename="/foo/baz/bar")
+
+
+def test_connection_should_reuse_the_client_for_the_same_target(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    spy_connect = mocker.spy(mock_ssh_client, "connect")
+    pool = SSHConnectionPool()
+    with pool.connection(pool_target) as first:
+        pass
+    with pool.connection(pool_target) as second:
+        pass
+    assert first is second
+    assert spy_connect.call_count == 1
+    assert len(pool) == 1
+
+
+def test_connection_should_create_a_client_per_target(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    spy_connect = mocker.spy(mock_ssh_client, "connect")
+    pool = SSHConnectionPool()
+    other = Target(hostname="otherhost", username="user", key_filename="/foo/baz/bar")
+    with pool.connection(pool_target) as first:
+        pass
+    with pool.connection(other) as second:
+        pass
+    assert first is not second
+    assert spy_connect.call_count == 2
+
+
+def test_connection_should_reconnect_when_the_transport_is_not_active(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    pool = SSHConnectionPool()
+    with pool.connection(pool_target) as first:
+        pass
+    mocker.patch.object(first, "get_transport", return_value=None)
+    with pool.connection(pool_target) as second:
+        pass
+    assert first is not second
+
+
+def test_connection_should_evict_the_client_after_idle_timeout(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    spy_close = mocker.spy(mock_ssh_client, "close")
+    pool = SSHConnectionPool(idle_timeout=0)
+    other = Target(hostname="otherhost", username="user", key_filename="/foo/baz/bar")
+    with pool.connection(pool_target):
+        pass
+    with pool.connection(other):
+        pass
+    assert spy_close.call_count == 1
+    assert len(pool) == 1
+
+
+def test_connection_should_evict_the_least_recently_used_client_over_max_size(
+    mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    pool = SSHConnectionPool(max_size=1)
+    other = Target(hostname="otherhost", username="user", key_filename="/foo/baz/bar")
+    with pool.connection(pool_target) as first:
+        pass
+    with pool.connection(other):
+        pass
+    assert len(pool) == 1
+    with pool.connection(pool_target) as second:
+        pass
+    assert first is not second
+
+
+def test_connection_should_not_evict_clients_in_use(
+    mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    pool = SSHConnectionPool(max_size=1)
+    other = Target(hostname="otherhost", username="user", key_filename="/foo/baz/bar")
+    with pool.connection(pool_target):
+        with pool.connection(other):
+            assert len(pool) == 2
+    with pool.connection(pool_target):
+        pass
+    assert len(pool) == 1
+
+
+def test_connection_should_discard_the_client_when_ssh_error_occurred(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    spy_close = mocker.spy(mock_ssh_client, "close")
+    pool = SSHConnectionPool()
+    with pytest.raises(paramiko.SSHException):
+        with pool.connection(pool_target):
+            raise paramiko.SSHException("connection reset")
+    assert spy_close.call_count == 1
+    assert len(pool) == 0
+
+
+def test_connection_should_not_keep_the_entry_when_connect_failed(
+    mocker: MockerFixture, mock_ssh_client: mock_ssh_client, pool_target: Target
+):
+    mocker.patch.object(
+        mock_ssh_client, "connect", side_effect=paramiko.SSHException("auth failed")
+    )
+    pool = SSHConnectionPool()
+    with pytest.raises(paramiko.SSHException):
+        with pool.connection(pool_target):
+            pass
+    assert len(pool) == 0
+
+
+def test_pool_should_throw_ValueError_when_max_size_is_less_than_1():
+    with pytest.raises(ValueError) as error_info:
+        SSHConnectionPool(max_size=0)
+    assert (
+        str(error_info.value)
+        == "The argument 'max_size' must be greater than or equal to 1"
+    )
@@ -0,0 +1,118 @@
+import shlex
+import shutil
+import subprocess
+
+import pytest
+
+import src.tc_registry
+from src.tc_registry import Allocation
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        ("", Allocation()),
+        ("0 key1 10\n", Allocation(slot=0, tree="10")),
+        (
+            "0 key0 10\n1 key1 10\n2 key2 10\n",
+            Allocation(slot=1, tree="10", others=("10", "10")),
+        ),
+        # 記録されていない障害はスロット0とする
+        ("0 key0 root\n", Allocation(slot=0, tree="", others=("root",))),
+    ],
+)
+def test_parse_should_find_the_slot_of_the_key(output, expected):
+    assert Allocation.parse(output, "key1") == expected
+
+
+def test_key_should_not_depend_on_the_order_of_the_keys():
+    assert Allocation.key({"device": "eth0", "tc": []}) == Allocation.key(
+        {"tc": [], "device": "eth0"}
+    )
+    assert Allocation.key({"device": "eth0"}) != Allocation.key({"device": "eth1"})
+
+
+@pytest.mark.skipif(shutil.which("flock") is None, reason="flock is not found")
+def test_allocate_should_reuse_the_lowest_released_slot(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.tc_registry, "SNAPSHOT_DIR", str(tmp_path))
+
+    def run(cmd: str) -> str:
+        # run the script without sudo
+        script = shlex.split(cmd)[3] if cmd.startswith("sudo ") else cmd
+        return subprocess.run(
+            ["sh", "-c", script], capture_output=True, text=True, check=True
+        ).stdout
+
+    assert Allocation.parse(run(Allocation.allocate("eth0", "a", "10")), "a").slot == 0
+    assert Allocation.parse(
+        run(Allocation.allocate("eth0", "b", "10")), "b"
+    ) == Allocation(slot=1, tree="10", others=("10",))
+    # allocating the same key again keeps its slot
+    assert Allocation.parse(run(Allocation.allocate("eth0", "b", "10")), "b").slot == 1
+    assert Allocation.parse(run(Allocation.release("eth0", "a")), "a") == Allocation(
+        slot=0, tree="10", others=("10",)
+    )
+    assert Allocation.parse(run(Allocation.allocate("eth0", "c", "10")), "c").slot == 0
+    run(Allocation.rename("eth0", "c", "d"))
+    assert run(Allocation.probe("eth0")) == "1 b 10\n0 d 10\n"
+
+
+@pytest.mark.skipif(shutil.which("flock") is None, reason="flock is not found")
+def test_release_with_should_run_the_commands_for_the_last_fault_only_once(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(src.tc_registry, "SNAPSHOT_DIR", str(tmp_path))
+    out = tmp_path / "out"
+
+    def run(cmd: str) -> str:
+        # run the script without sudo
+        script = shlex.split(cmd)[3] if cmd.startswith("sudo ") else cmd
+        return subprocess.run(
+            ["sh", "-c", script], capture_output=True, text=True, check=True
+        ).stdout
+
+    run(Allocation.allocate("eth0", "a", "10"))
+    run(Allocation.allocate("eth0", "b", "10"))
+    for key in ("a", "b"):
+        run(
+            Allocation.release_with(
+                "eth0",
+                key,
+                [f"echo shared {key} >> {out}"],
+                [f"echo last {key} >> {out}"],
+            )
+        )
+    assert out.read_text() == "shared a\nlast b\n"
+    assert run(Allocation.probe("eth0")) == ""
+
+
+@pytest.mark.skipif(shutil.which("flock") is None, reason="flock is not found")
+def test_release_with_should_keep_the_line_when_the_commands_failed(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(src.tc_registry, "SNAPSHOT_DIR", str(tmp_path))
+
+    def run(cmd: str) -> subprocess.CompletedProcess:
+        # run the script without sudo
+        script = shlex.split(cmd)[3] if cmd.startswith("sudo ") else cmd
+        return subprocess.run(["sh", "-c", script], capture_output=True, text=True)
+
+    run(Allocation.allocate("eth0", "a", "10"))
+    result = run(
+        Allocation.release_with(
+            "eth0",
+            "a",
+            [],
+            ["echo 'RTNETLINK answers: Operation not permitted' >&2; false"],
+        )
+    )
+    assert result.returncode == 1
+    assert "Operation not permitted" in result.stderr
+    assert run(Allocation.probe("eth0")).stdout == "0 a 10\n"
+    # すでに削除されたものに対するエラーは成功として扱う
+    run(
+        Allocation.release_with(
+            "eth0", "a", [], ["echo 'Cannot find specified qdisc' >&2; false"]
+        )
+    )
+    assert run(Allocation.probe("eth0")).stdout == ""
@@ -1,3 +1,4 @@
+import pytest
 from cerberus import Validator
 
 from src import tc_schema
@@ -41,6 +42,17 @@ def test_normalized_root_schema_can_set_default_value_for_missing_fields():
                 "loss": 0.1,
                 "corrupt": False,
                 "protocol": ["tcp", "udp", "icmp"],
+                "rate": None,
+                "ceil": None,
+                "burst": None,
+                "limit": None,
+                "jitter": None,
+                "distribution": None,
+                "correlation": None,
+                "reorder": None,
+                "duplicate": None,
+                "slot": None,
+                "profile": None,
             },
             {
                 "destination_ip_addresses": [],
@@ -50,6 +62,17 @@ def test_normalized_root_schema_can_set_default_value_for_missing_fields():
                 "loss": None,
                 "corrupt": False,
                 "protocol": ["tcp", "udp", "icmp"],
+                "rate": None,
+                "ceil": None,
+                "burst": None,
+                "limit": None,
+                "jitter": None,
+                "distribution": None,
+                "correlation": None,
+                "reorder": None,
+                "duplicate": None,
+                "slot": None,
+                "profile": None,
             },
         ],
     }
@@ -86,3 +109,40 @@ def test_validate_with_tc_schema_return_False_when_protocol_is_empty():
     data = {"protocol": []}
     assert not v.validate(data)
     assert v.errors["protocol"] == ["empty values not allowed"]
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [("rate", "10mbits"), ("rate", "mbit"), ("ceil", "10"), ("burst", "15kbit")],
+)
+def test_validate_with_tc_schema_return_False_when_bandwidth_has_invalid_unit(
+    field, value
+):
+    v = Validator(tc_schema.__tc_schema)
+    assert not v.validate({field: value})
+    assert field in v.errors
+
+
+def test_validate_with_tc_schema_return_True_when_bandwidth_has_tc_units():
+    v = Validator(tc_schema.__tc_schema)
+    assert v.validate({"rate": "1.5mbit", "ceil": "1gbps", "burst": "15kb"})
+
+
+def test_validate_with_tc_schema_return_False_when_distribution_is_unallowed():
+    v = Validator(tc_schema.__tc_schema)
+    assert not v.validate({"latency": 100, "jitter": 10, "distribution": "foo"})
+    assert v.errors["distribution"] == ["unallowed value foo"]
+
+
+def test_validate_with_tc_schema_return_False_when_slot_has_no_min_delay():
+    v = Validator(tc_schema.__tc_schema)
+    assert not v.validate({"slot": {"packets": 10}})
+    assert v.errors["slot"] == [{"min_delay": ["required field"]}]
+
+
+def test_validate_with_tc_schema_return_False_when_profile_length_is_0():
+    v = Validator(tc_schema.__tc_schema)
+    assert not v.validate(
+        {"profile": {"shape": "ramp", "start": 10, "end": 100, "length": 0}}
+    )
+    assert v.errors["profile"] == [{"length": ["min value is 0.01"]}]